@@ -0,0 +1,156 @@
+# Execução em lote de perguntas padrão a partir de um arquivo JSONL
+#
+# Uso:
+#   python batch_runner.py perguntas.jsonl respostas.jsonl --concorrencia 4 --taxa 2
+#
+# Cada linha de entrada deve conter {"id": ..., "pergunta": ...} (também aceita "question").
+# Perguntas idênticas são respondidas uma única vez e as respostas já gravadas no arquivo
+# de saída são puladas, permitindo retomar a execução após uma interrupção.
+import argparse
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pipeline import get_llm_client, connect_to_db, load_data, answer_question
+from insights import generate_advanced_insights
+
+class RateLimiter:
+    """
+    Limita o número de perguntas iniciadas por segundo entre todas as threads
+    """
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def acquire(self):
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            wait = self.next_slot - now
+            self.next_slot = max(now, self.next_slot) + self.interval
+        if wait > 0:
+            time.sleep(wait)
+
+def normalize_question(question):
+    """
+    Normaliza a pergunta para deduplicação (caixa, espaços e pontuação final)
+    """
+    question = re.sub(r"\s+", " ", question.strip().casefold())
+    return question.rstrip(" ?!.")
+
+def question_key(question):
+    return hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()[:16]
+
+def read_questions(path):
+    """
+    Lê o JSONL de entrada e agrupa os ids de perguntas idênticas
+
+    Returns:
+        Dicionário {chave: {"pergunta": str, "ids": [...]}} na ordem do arquivo
+    """
+    questions = {}
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            record = json.loads(line)
+            question = record.get("pergunta") or record.get("question")
+            if not question:
+                print(f"Linha {line_number} ignorada: pergunta ausente")
+                continue
+            key = question_key(question)
+            entry = questions.setdefault(key, {"pergunta": question, "ids": []})
+            entry["ids"].append(record.get("id", line_number))
+    return questions
+
+def read_completed(path):
+    """
+    Retorna as chaves já respondidas com sucesso no arquivo de saída
+    """
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Linha truncada por uma interrupção no meio da escrita
+                continue
+            if record.get("status") == "ok":
+                completed.add(record["chave"])
+    return completed
+
+def run_batch(input_path, output_path, concurrency=4, rate=1.0):
+    questions = read_questions(input_path)
+    completed = read_completed(output_path)
+    pending = {key: entry for key, entry in questions.items() if key not in completed}
+
+    print(f"Perguntas únicas: {len(questions)} | já respondidas: {len(questions) - len(pending)} | pendentes: {len(pending)}")
+    if not pending:
+        return
+
+    engine = connect_to_db()
+    if engine is None:
+        raise SystemExit("Não foi possível conectar ao banco de dados.")
+
+    start = time.perf_counter()
+    df = load_data(engine)
+    insights = generate_advanced_insights(df)
+    print(f"Dados e insights carregados em {time.perf_counter() - start:.2f}s ({len(df)} linhas)")
+
+    llm = get_llm_client()
+    limiter = RateLimiter(rate)
+    session_id = f"lote-{time.strftime('%Y%m%d%H%M%S')}"
+
+    def worker(key, entry):
+        limiter.acquire()
+        record = {"chave": key, "ids": entry["ids"], "pergunta": entry["pergunta"]}
+        try:
+            result = answer_question(entry["pergunta"], llm, df, insights, engine=engine,
+                                     question_id=key, session_id=session_id)
+            record.update({
+                "status": "ok",
+                "intencao": result["intent"],
+                "sql": result["sql"],
+                "resposta": result["answer"],
+                "tempos": result["timings"]
+            })
+        except Exception as e:
+            record.update({"status": "erro", "erro": str(e)})
+        return record
+
+    done = 0
+    with open(output_path, "a", encoding="utf-8") as out, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        # Garantir que uma linha truncada pela interrupção anterior não se junte à próxima
+        if out.tell() > 0:
+            with open(output_path, "rb") as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    out.write("\n")
+        futures = [executor.submit(worker, key, entry) for key, entry in pending.items()]
+        for future in as_completed(futures):
+            record = future.result()
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            done += 1
+            print(f"[{done}/{len(pending)}] {record['status']}: {record['pergunta'][:80]}")
+
+    engine.dispose()
+    print(f"Lote concluído em {time.perf_counter() - start:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Responde perguntas em lote a partir de um arquivo JSONL")
+    parser.add_argument("entrada", help="Arquivo JSONL com as perguntas")
+    parser.add_argument("saida", help="Arquivo JSONL de respostas (retomado se já existir)")
+    parser.add_argument("--concorrencia", type=int, default=4, help="Número máximo de perguntas em paralelo")
+    parser.add_argument("--taxa", type=float, default=1.0, help="Perguntas iniciadas por segundo (0 desativa o limite)")
+    args = parser.parse_args()
+
+    run_batch(args.entrada, args.saida, concurrency=args.concorrencia, rate=args.taxa)
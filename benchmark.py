@@ -0,0 +1,188 @@
+# Suíte de benchmarks sobre dados sintéticos (ver synthetic_data.py)
+#
+# Mede tempo e pico de memória de:
+#   - insights: montagem do cubo (cube.py) e generate_advanced_insights sobre o cubo pronto
+#   - loaders: leitura via SQLite (pd.read_sql), parquet e snapshot Arrow mapeado em memória
+#   - queries: execução das consultas dinâmicas típicas de cada intenção
+#   - pipeline: fluxo completo de answer_question com LLM roteirizado (llm_stub.py), com as consultas
+#     dinâmicas executadas no banco SQLite sintético
+#   - forecast: ajuste dos modelos por segmento em um processo e no pool (fora dos casos padrão)
+#   - bitmap: filtros por índice de bitmap x máscara booleana, com as somas filtradas (fora dos casos padrão)
+#
+# Uso:
+#   python benchmark.py --linhas 1000000 --casos insights,loaders,queries,pipeline --saida bench.json
+import argparse
+import json
+import os
+import statistics
+import tempfile
+import time
+import tracemalloc
+import pandas as pd
+from sqlalchemy import create_engine
+from insights import generate_advanced_insights
+from synthetic_data import generate_synthetic_data, write_sqlite
+from llm_stub import get_stub_llm, CANNED_SQL
+
+SAMPLE_QUESTIONS = [
+    "Qual estado com maior inadimplência e quais os valores devidos?",
+    "Qual tipo de cliente apresenta o maior número de operações?",
+    "Em qual modalidade existe maior inadimplência?",
+    "Compare a inadimplência entre PF e PJ",
+    "Qual ocupação entre PF possui maior inadimplência?",
+    "Como evoluiu a inadimplência ao longo de 2024?",
+    "Qual o valor de inadimplência em São Paulo?",
+    "Quais são os principais riscos de inadimplência?"
+]
+
+def measure(name, fn, repeat=3):
+    """
+    Executa fn `repeat` vezes para medir o tempo e uma vez adicional com tracemalloc para o pico de memória
+
+    Returns:
+        Dicionário com mediana e mínimo do tempo (s) e pico de memória alocada (MB)
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    result = {
+        "caso": name,
+        "mediana_s": statistics.median(times),
+        "min_s": min(times),
+        "pico_mb": peak / 1e6
+    }
+    print(f"{name:<45} mediana {result['mediana_s'] * 1000:10.1f} ms | mín {result['min_s'] * 1000:10.1f} ms | pico {result['pico_mb']:9.1f} MB")
+    return result
+
+def bench_insights(df, repeat):
+    from cube import build_cube
+
+    cube = build_cube(df)
+    return [
+        measure("insights/build_cube", lambda: build_cube(df), repeat),
+        measure("insights/generate_advanced_insights", lambda: generate_advanced_insights(df, cube=cube), repeat)
+    ]
+
+def bench_loaders(df, workdir, sqlite_url, repeat):
+    from snapshot import write_snapshot, open_snapshot
+
+    results = []
+    parquet_path = os.path.join(workdir, "dados.parquet")
+    df.to_parquet(parquet_path, index=False)
+    snapshot_dir = os.path.join(workdir, "snapshots")
+    snapshot_id = write_snapshot(df, snapshot_dir)
+
+    results.append(measure("loaders/parquet", lambda: pd.read_parquet(parquet_path), repeat))
+    results.append(measure("loaders/snapshot_arrow_mmap", lambda: open_snapshot(snapshot_id, snapshot_dir), repeat))
+    if sqlite_url:
+        engine = create_engine(sqlite_url)
+        results.append(measure("loaders/sqlite_read_sql", lambda: pd.read_sql("SELECT * FROM table_agg_inad_consolidado", engine), repeat))
+        engine.dispose()
+    return results
+
+def bench_queries(sqlite_url, repeat):
+    results = []
+    engine = create_engine(sqlite_url)
+    for intent, query in CANNED_SQL.items():
+        results.append(measure(f"queries/{intent}", lambda q=query: pd.read_sql(q, engine), repeat))
+    engine.dispose()
+    return results
+
+def bench_pipeline(df, sqlite_url, repeat):
+    from pipeline import answer_question
+
+    llm = get_stub_llm()
+    insights = generate_advanced_insights(df)
+    # O banco tem as mesmas linhas de df (mesma semente), então o SQL dinâmico roda sobre os mesmos dados
+    engine = create_engine(sqlite_url)
+
+    def run_all():
+        for question in SAMPLE_QUESTIONS:
+            answer_question(question, llm, df, insights, engine=engine)
+
+    result = measure(f"pipeline/answer_question x{len(SAMPLE_QUESTIONS)}", run_all, repeat)
+    engine.dispose()
+    return [result]
+
+def bench_forecast(df, repeat):
+    from forecast import build_forecasts, FORECAST_WORKERS
+
+    # O pico de memória mede apenas o processo principal; os processos do pool ficam de fora
+    return [
+        measure("forecast/build_forecasts workers=1", lambda: build_forecasts(df, workers=1), repeat),
+        measure(f"forecast/build_forecasts workers={FORECAST_WORKERS}", lambda: build_forecasts(df), repeat)
+    ]
+
+def bench_bitmap(df, repeat):
+    from bitmap_index import build_bitmap_index, default_cases, derived_columns, mask_aggregate
+
+    index = build_bitmap_index(df)
+    print(f"bitmap: {index.nbytes / 1e6:.1f} MB de bitmaps para {len(df):,} linhas")
+    results = [measure("bitmap/build_bitmap_index", lambda: build_bitmap_index(df), repeat)]
+    derived = derived_columns(df)
+    for name, filters in default_cases(index).items():
+        results.append(measure(f"bitmap/{name} mascara", lambda f=filters: mask_aggregate(df, f, derived), repeat))
+        results.append(measure(f"bitmap/{name} bitmap", lambda f=filters: index.aggregate(index.select(**f)), repeat))
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks de insights, carregamento e consultas sobre dados sintéticos")
+    parser.add_argument("--linhas", type=int, default=1_000_000, help="Quantidade de linhas sintéticas")
+    parser.add_argument("--casos", default="insights,loaders,queries,pipeline", help="Casos separados por vírgula")
+    parser.add_argument("--repeticoes", type=int, default=3)
+    parser.add_argument("--sqlite-max-linhas", type=int, default=5_000_000,
+                        help="Acima deste tamanho o banco SQLite não é criado (loaders/queries via SQL e pipeline são pulados)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--saida", help="Arquivo JSON com os resultados")
+    args = parser.parse_args()
+
+    cases = [c.strip() for c in args.casos.split(",") if c.strip()]
+
+    start = time.perf_counter()
+    df = generate_synthetic_data(args.linhas, seed=args.seed)
+    print(f"{len(df):,} linhas sintéticas geradas em {time.perf_counter() - start:.2f}s "
+          f"({df.memory_usage(deep=True).sum() / 1e6:.1f} MB em memória)")
+
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        sqlite_url = None
+        if {"loaders", "queries", "pipeline"} & set(cases) and args.linhas <= args.sqlite_max_linhas:
+            start = time.perf_counter()
+            sqlite_url = write_sqlite(os.path.join(workdir, "local.db"), args.linhas, seed=args.seed)
+            print(f"Banco SQLite local criado em {time.perf_counter() - start:.2f}s")
+
+        if "insights" in cases:
+            results += bench_insights(df, args.repeticoes)
+        if "loaders" in cases:
+            results += bench_loaders(df, workdir, sqlite_url, args.repeticoes)
+        if "queries" in cases:
+            if sqlite_url:
+                results += bench_queries(sqlite_url, args.repeticoes)
+            else:
+                print("queries: pulado (acima de --sqlite-max-linhas)")
+        if "pipeline" in cases:
+            if sqlite_url:
+                results += bench_pipeline(df, sqlite_url, args.repeticoes)
+            else:
+                print("pipeline: pulado (acima de --sqlite-max-linhas)")
+        if "forecast" in cases:
+            results += bench_forecast(df, args.repeticoes)
+        if "bitmap" in cases:
+            results += bench_bitmap(df, args.repeticoes)
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump({"linhas": args.linhas, "resultados": results}, f, ensure_ascii=False, indent=2)
+        print(f"Resultados gravados em {args.saida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+# Índices de bitmap sobre as colunas de dimensão para filtros ad hoc nas linhas
+#
+# Para cada dimensão (uf, regiao, tipo_cliente, porte, modalidade, ocupacao, cnae_secao e data_base)
+# guarda um bitmap compactado (np.packbits, 1 bit por linha) de cada valor, montado uma vez por
+# snapshot. Um filtro com vários predicados vira OU bit a bit entre os valores de uma dimensão e E
+# entre as dimensões, sobre arrays 8x menores que uma máscara booleana e sem comparar textos; as
+# somas filtradas leem só as posições selecionadas. O caminho legado de df.query no pipeline usa o
+# índice quando a expressão é uma conjunção de predicados == / in sobre essas dimensões.
+#
+# Uso:
+#   python bitmap_index.py --linhas 10000000      (compara com máscaras booleanas sobre dados sintéticos)
+#   python benchmark.py --linhas 10000000 --casos bitmap
+import argparse
+import ast
+import re
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+from insights import REGION_MAP, client_type
+from tracing import traced
+
+DIMENSIONS = ["uf", "regiao", "tipo_cliente", "porte", "modalidade", "ocupacao", "cnae_secao", "data_base"]
+MEASURE_COLUMNS = [
+    "soma_carteira_inadimplida_arrastada",
+    "soma_carteira_ativa",
+    "soma_ativo_problematico",
+    "soma_numero_de_operacoes",
+    "soma_a_vencer_ate_90_dias"
+]
+# Quantidade de bits 1 de cada byte, para contar as linhas selecionadas sem descompactar
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+# Predicado `coluna == 'valor'` ou `coluna in ['a', 'b']`, opcionalmente entre parênteses
+_PREDICATE = re.compile(r"\s*\(?\s*`?(\w+)`?\s*(==|in)\s*('[^']*'|\"[^\"]*\"|\[[^\]]*\])\s*\)?\s*")
+_SEPARATOR = re.compile(r"(?:and\b|&)\s*", re.IGNORECASE)
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+
+class BitmapIndex:
+    """
+    Bitmaps compactados por (dimensão, valor) e as medidas das linhas na mesma ordem
+
+    Params:
+        size: quantidade de linhas indexadas
+        bitmaps: {dimensão: {valor: array uint8 de np.packbits}}
+        measures: {coluna: array das medidas}
+    """
+    def __init__(self, size, bitmaps, measures):
+        self.size = size
+        self.bitmaps = bitmaps
+        self.measures = measures
+
+    @property
+    def nbytes(self):
+        return sum(bitmap.nbytes for values in self.bitmaps.values() for bitmap in values.values())
+
+    def values(self, dimension):
+        return list(self.bitmaps[dimension])
+
+    def bitmap(self, dimension, value):
+        """
+        OU dos bitmaps dos valores pedidos (valor único ou lista); valores sem linhas não selecionam nada
+        """
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        result = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+        for v in values:
+            bitmap = self.bitmaps[dimension].get(v)
+            if bitmap is not None:
+                np.bitwise_or(result, bitmap, out=result)
+        return result
+
+    def select(self, **filters):
+        """
+        Bitmap das linhas que atendem a todos os filtros (ex.: select(uf=['SP', 'RJ'], tipo_cliente='PF'))
+        """
+        result = np.full((self.size + 7) // 8, 0xFF, dtype=np.uint8)
+        for dimension, value in filters.items():
+            if dimension not in self.bitmaps:
+                raise KeyError(f"Dimensão sem índice: {dimension}")
+            np.bitwise_and(result, self.bitmap(dimension, value), out=result)
+        # Zera os bits de preenchimento do último byte
+        if self.size % 8:
+            result[-1] &= np.uint8((0xFF << (8 - self.size % 8)) & 0xFF)
+        return result
+
+    def count(self, selection):
+        return int(_POPCOUNT[selection].sum(dtype=np.int64))
+
+    def positions(self, selection):
+        """
+        Posições (ordenadas) das linhas selecionadas
+        """
+        return np.flatnonzero(np.unpackbits(selection, count=self.size))
+
+    def aggregate(self, selection, columns=MEASURE_COLUMNS, by=None):
+        """
+        Somas das medidas sobre as linhas selecionadas, no total ou por valor da dimensão `by`
+
+        Returns:
+            Series com as somas (sem `by`) ou DataFrame com uma linha por valor presente na seleção
+        """
+        if by is None:
+            positions = self.positions(selection)
+            return pd.Series({column: self.measures[column][positions].sum() for column in columns})
+
+        rows = {}
+        for label, bitmap in self.bitmaps[by].items():
+            positions = self.positions(np.bitwise_and(selection, bitmap))
+            if len(positions):
+                rows[label] = {column: self.measures[column][positions].sum() for column in columns}
+        frame = pd.DataFrame.from_dict(rows, orient="index", columns=list(columns))
+        frame.index.name = by
+        return frame
+
+    def filter_frame(self, df, **filters):
+        """
+        Linhas do DataFrame indexado que atendem aos filtros, na ordem original
+        """
+        return df.iloc[self.positions(self.select(**filters))]
+
+@traced("build_bitmap_index")
+def build_bitmap_index(df):
+    """
+    Monta um bitmap compactado por valor de cada dimensão
+
+    Returns:
+        BitmapIndex
+    """
+    keys = {
+        "uf": df["uf"],
+        "regiao": df["uf"].map(REGION_MAP),
+        "tipo_cliente": client_type(df["cliente"]),
+        "porte": df["porte"],
+        "modalidade": df["modalidade"],
+        "ocupacao": df["ocupacao"],
+        "cnae_secao": df["cnae_secao"],
+        "data_base": df["data_base"]
+    }
+    bitmaps = {}
+    for dimension in DIMENSIONS:
+        values = keys[dimension]
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            codes, labels = values.cat.codes.to_numpy(), values.cat.categories
+        else:
+            codes, labels = pd.factorize(values, sort=True)
+        # Uma comparação por valor sobre os códigos inteiros; valores ausentes (-1) ficam sem bitmap
+        bitmaps[dimension] = {
+            label: np.packbits(codes == code) for code, label in enumerate(labels)
+        }
+    measures = {column: df[column].to_numpy(dtype=float, na_value=0.0) for column in MEASURE_COLUMNS}
+    return BitmapIndex(len(df), bitmaps, measures)
+
+def get_bitmap_index(df):
+    """
+    Retorna o índice do DataFrame do cache (uma montagem por snapshot ou por DataFrame de sessão)
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0]() is df):
+            return cached[1]
+
+    index = build_bitmap_index(df)
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (reference, index)
+    return index
+
+def parse_filters(expression):
+    """
+    Converte uma expressão de df.query em filtros quando ela é uma conjunção de predicados == / in
+
+    Returns:
+        Dicionário {coluna: [valores]} ou None se a expressão tiver outra forma
+    """
+    filters = {}
+    position = 0
+    expression = expression.strip()
+    while True:
+        match = _PREDICATE.match(expression, position)
+        if match is None:
+            return None
+        column, operator, literal = match.groups()
+        try:
+            value = ast.literal_eval(literal)
+        except (ValueError, SyntaxError):
+            return None
+        if operator == "in" and not isinstance(value, (list, tuple)):
+            return None
+        values = list(value) if operator == "in" else [value]
+        # A mesma coluna em dois predicados é um E: só ficam os valores comuns
+        filters[column] = [v for v in filters[column] if v in values] if column in filters else values
+
+        position = match.end()
+        if position == len(expression):
+            return filters
+        separator = _SEPARATOR.match(expression, position)
+        if separator is None:
+            return None
+        position = separator.end()
+
+def query_frame(df, expression):
+    """
+    df.query com os filtros simples resolvidos pelos bitmaps do DataFrame; o restante vai para df.query
+    """
+    filters = parse_filters(expression)
+    if filters is None or not set(filters) <= set(DIMENSIONS):
+        return df.query(expression)
+    return get_bitmap_index(df).filter_frame(df, **filters)
+
+def derived_columns(df):
+    """
+    Colunas tipo_cliente e regiao calculadas uma vez, para os filtros por máscara
+    """
+    return {"tipo_cliente": client_type(df["cliente"]), "regiao": df["uf"].map(REGION_MAP)}
+
+def mask_aggregate(df, filters, derived):
+    """
+    Somas filtradas por máscara booleana (referência para os bitmaps): uma comparação por linha e predicado
+    """
+    mask = np.ones(len(df), dtype=bool)
+    for dimension, value in filters.items():
+        column = derived[dimension] if dimension in derived else df[dimension]
+        mask &= column.isin(value if isinstance(value, list) else [value]).to_numpy()
+    return df.loc[mask, MEASURE_COLUMNS].sum()
+
+def compare_with_masks(df, index, cases, repeat=5):
+    """
+    Tempo médio (ms) de cada filtro com máscara booleana e com o índice, ambos somando as medidas
+
+    Params:
+        df: DataFrame indexado
+        index: BitmapIndex do DataFrame
+        cases: {nome: filtros}
+
+    Returns:
+        Lista de dicionários com caso, linhas selecionadas, tempo da máscara e do bitmap
+    """
+    derived = derived_columns(df)
+    results = []
+    for name, filters in cases.items():
+        timings = {}
+        for label, fn in [
+            ("mascara_ms", lambda: mask_aggregate(df, filters, derived)),
+            ("bitmap_ms", lambda: index.aggregate(index.select(**filters)))
+        ]:
+            start = time.perf_counter()
+            for _ in range(repeat):
+                fn()
+            timings[label] = (time.perf_counter() - start) / repeat * 1000
+        results.append({"caso": name, "linhas": index.count(index.select(**filters)), **timings})
+    return results
+
+def default_cases(index):
+    """
+    Filtros típicos das perguntas: um valor, PF/PJ com porte, lista de UFs com modalidade e mês
+    """
+    uf = index.values("uf")
+    porte = index.values("porte")
+    modalidade = index.values("modalidade")
+    return {
+        "uf": {"uf": uf[0]},
+        "tipo_cliente+porte": {"tipo_cliente": "PF", "porte": porte[:2]},
+        "ufs+modalidade+mes": {"uf": uf[:5], "modalidade": modalidade[0], "data_base": index.values("data_base")[-1]}
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compara filtros por bitmap com máscaras booleanas sobre dados sintéticos")
+    parser.add_argument("--linhas", type=int, default=10_000_000)
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    from synthetic_data import generate_synthetic_data
+
+    df = generate_synthetic_data(args.linhas, seed=args.seed)
+    start = time.perf_counter()
+    index = build_bitmap_index(df)
+    print(f"Índice montado em {time.perf_counter() - start:.2f}s ({index.nbytes / 1e6:.1f} MB de bitmaps para {len(df):,} linhas)")
+    for result in compare_with_masks(df, index, default_cases(index), args.repeticoes):
+        print(f"{result['caso']:<25} {result['linhas']:>12,} linhas | máscara {result['mascara_ms']:9.1f} ms | "
+              f"bitmap {result['bitmap_ms']:9.1f} ms ({result['mascara_ms'] / result['bitmap_ms']:.1f}x)")
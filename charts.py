@@ -0,0 +1,199 @@
+# Gráficos das respostas montados a partir do cubo e guardados em cache por snapshot
+#
+# Cada gráfico (UF, região, PF x PJ, porte, modalidade, ocupação, setor CNAE e tendência mensal) sai
+# de um rollup do cubo (cube.py), sem groupby sobre as linhas, e é serializado uma única vez por
+# snapshot como especificação JSON do plotly. Para manter o payload enviado ao navegador pequeno, as
+# dimensões com muitos valores mostram os CHART_TOP_K maiores e somam o restante em "Outros", e a
+# série mensal é reduzida a no máximo CHART_MAX_POINTS pontos.
+#
+# Variáveis de ambiente:
+#   CHART_TOP_K=10        barras por gráfico antes de "Outros"
+#   CHART_MAX_POINTS=60   pontos da série de tendência
+#
+# Uso:
+#   python charts.py                 (monta todos os gráficos do snapshot atual e mostra o tamanho de cada um)
+import os
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from dotenv import load_dotenv
+from cube import derive_rates, get_cube
+from insights import DEFAULT_PERIOD, period_labels
+from ranking_index import parse_dimension
+from timeseries import normalize_text
+from tracing import traced
+
+load_dotenv()
+
+CHART_TOP_K = int(os.getenv("CHART_TOP_K", "10"))
+CHART_MAX_POINTS = int(os.getenv("CHART_MAX_POINTS", "60"))
+
+# Gráfico: (dimensão, título, segmento PF/PJ ou None)
+CHARTS = {
+    "uf": ("uf", "Inadimplência por UF", None),
+    "regiao": ("regiao", "Inadimplência por região", None),
+    "tipo_cliente": ("tipo_cliente", "Inadimplência PF x PJ", None),
+    "porte": ("porte", "Inadimplência por porte", None),
+    "modalidade": ("modalidade", "Inadimplência por modalidade", None),
+    "ocupacao": ("ocupacao", "Inadimplência por ocupação (PF)", "PF"),
+    "cnae_secao": ("cnae_secao", "Inadimplência por setor CNAE (PJ)", "PJ")
+}
+TREND = "tendencia"
+OTHERS_LABEL = "Outros"
+SUM_COLUMNS = [
+    "soma_carteira_inadimplida_arrastada",
+    "soma_carteira_ativa",
+    "soma_ativo_problematico",
+    "soma_numero_de_operacoes"
+]
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+
+def top_k_with_others(frame, dimension, k=CHART_TOP_K):
+    """
+    Os k maiores valores por volume inadimplido e uma linha "Outros" com a soma do restante
+    """
+    frame = frame.sort_values("soma_carteira_inadimplida_arrastada", ascending=False)
+    if len(frame) <= k + 1:
+        return frame
+    others = frame.iloc[k:][SUM_COLUMNS].sum().to_frame().T
+    others.insert(0, dimension, OTHERS_LABEL)
+    # As taxas são recalculadas sobre as somas de todas as linhas, inclusive a de "Outros"
+    return derive_rates(pd.concat([frame.iloc[:k][[dimension] + SUM_COLUMNS], others], ignore_index=True))
+
+def downsample(frame, max_points=CHART_MAX_POINTS):
+    """
+    No máximo max_points linhas igualmente espaçadas, mantendo a primeira e a última
+    """
+    if len(frame) <= max_points:
+        return frame
+    positions = np.unique(np.linspace(0, len(frame) - 1, max_points).round().astype(int))
+    return frame.iloc[positions]
+
+def _reference_period(cube):
+    months = [month for month in cube.labels["data_base"] if not pd.isna(month)]
+    return DEFAULT_PERIOD if DEFAULT_PERIOD in months else max(months)
+
+def bar_figure(cube, chart_id):
+    """
+    Barras do volume inadimplido no mês de referência, com a taxa no texto de cada barra
+    """
+    dimension, title, segment = CHARTS[chart_id]
+    period = _reference_period(cube)
+    part = cube.slice(data_base=period)
+    if segment is not None:
+        part = part.slice(tipo_cliente=segment)
+    frame = top_k_with_others(part.rollup(dimension), dimension)
+    if frame.empty:
+        return None
+
+    taxa = frame["taxa_inadimplencia"].fillna(0).round(2)
+    figure = go.Figure(go.Bar(
+        x=frame[dimension].astype(str).tolist(),
+        y=frame["soma_carteira_inadimplida_arrastada"].round(2).tolist(),
+        text=[f"{value:.2f}%" for value in taxa],
+        customdata=frame["soma_carteira_ativa"].round(2).tolist(),
+        hovertemplate="%{x}<br>Inadimplido: R$ %{y:,.2f}<br>Carteira: R$ %{customdata:,.2f}<br>Taxa: %{text}<extra></extra>"
+    ))
+    figure.update_layout(
+        title=f"{title} ({period_labels(period)[1]})",
+        yaxis_title="Valor inadimplido (R$)",
+        margin={"l": 40, "r": 20, "t": 60, "b": 40}
+    )
+    return figure
+
+def trend_figure(cube):
+    """
+    Linhas da taxa de inadimplência mensal no total e para PF e PJ
+    """
+    total = downsample(cube.rollup("data_base"))
+    if total.empty:
+        return None
+    by_type = cube.rollup("data_base", "tipo_cliente")
+    by_type = by_type[by_type["data_base"].isin(total["data_base"])]
+
+    figure = go.Figure()
+    series = [("Total", total)] + [(tipo, by_type[by_type["tipo_cliente"] == tipo]) for tipo in ["PF", "PJ"]]
+    for name, frame in series:
+        if frame.empty:
+            continue
+        figure.add_trace(go.Scatter(
+            x=frame["data_base"].astype(str).tolist(),
+            y=frame["taxa_inadimplencia"].round(2).tolist(),
+            mode="lines",
+            name=name
+        ))
+    figure.update_layout(
+        title="Evolução da taxa de inadimplência",
+        yaxis_title="Taxa de inadimplência (%)",
+        margin={"l": 40, "r": 20, "t": 60, "b": 40}
+    )
+    return figure
+
+@traced("build_chart")
+def build_chart(cube, chart_id):
+    """
+    Especificação JSON do plotly para o gráfico pedido, ou None sem dados
+
+    Params:
+        cube: cubo do snapshot (cube.get_cube)
+        chart_id: chave de CHARTS ou TREND
+    """
+    figure = trend_figure(cube) if chart_id == TREND else bar_figure(cube, chart_id)
+    return figure.to_json() if figure is not None else None
+
+def get_chart(df, chart_id):
+    """
+    Retorna o gráfico do DataFrame do cache (montado uma vez por snapshot ou por DataFrame de sessão)
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0]() is df) and chart_id in cached[1]:
+            return cached[1][chart_id]
+
+    spec = build_chart(get_cube(df), chart_id)
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is None or not (cached[0] is None or cached[0]() is df):
+            if len(_cache) >= _MAX_CACHED:
+                _cache.pop(next(iter(_cache)))
+            cached = _cache[key] = (reference, {})
+        cached[1][chart_id] = spec
+    return spec
+
+def chart_for_question(question, intent):
+    """
+    Gráfico adequado à pergunta: tendência para TENDÊNCIA e PREVISÃO, a dimensão citada nas demais
+
+    Returns:
+        Chave de CHARTS, TREND ou None (perguntas gerais ou sem dimensão reconhecida)
+    """
+    if intent in ("TENDÊNCIA", "PREVISÃO"):
+        return TREND
+    if intent == "GERAL":
+        return None
+    dimension = parse_dimension(normalize_text(question))
+    if dimension in CHARTS:
+        return dimension
+    return "tipo_cliente" if intent == "COMPARAÇÃO" else None
+
+if __name__ == "__main__":
+    from snapshot import current_snapshot_id, open_snapshot
+
+    snapshot_id = current_snapshot_id()
+    if snapshot_id is None:
+        raise SystemExit("Nenhum snapshot publicado (python snapshot.py refresh)")
+    df = open_snapshot(snapshot_id)
+
+    for chart_id in list(CHARTS) + [TREND]:
+        start = time.perf_counter()
+        spec = get_chart(df, chart_id)
+        size = f"{len(spec) / 1e3:8.1f} KB" if spec else "sem dados"
+        print(f"{chart_id:<15} {size} em {(time.perf_counter() - start) * 1000:8.1f} ms")
@@ -0,0 +1,276 @@
+# Cubo OLAP em memória sobre a tabela consolidada
+#
+# As linhas são agregadas uma única vez pelos códigos categóricos de uf, regiao, tipo_cliente, porte,
+# modalidade, ocupacao, cnae_secao e data_base (mês). As medidas aditivas ficam em um array NumPy
+# denso (eixos = dimensões) quando o produto das cardinalidades cabe em CUBE_DENSE_MAX_CELLS, ou em
+# formato esparso (coordenadas das células não vazias + medidas) caso contrário. slice() filtra por
+# valores e rollup() soma pelas dimensões pedidas com reduções de array (bincount ou sum por eixo),
+# devolvendo também as taxas derivadas.
+#
+# Variáveis de ambiente:
+#   CUBE_DENSE_MAX_CELLS=2000000   máximo de células para o armazenamento denso
+#
+# Uso:
+#   python cube.py                          (monta o cubo do snapshot atual e mede slice/rollup)
+import argparse
+import os
+import threading
+import time
+import weakref
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from insights import REGION_MAP, client_type
+from timeseries import month_index
+from tracing import traced
+
+load_dotenv()
+
+DENSE_MAX_CELLS = int(os.getenv("CUBE_DENSE_MAX_CELLS", "2000000"))
+
+DIMENSIONS = ["uf", "regiao", "tipo_cliente", "porte", "modalidade", "ocupacao", "cnae_secao", "data_base"]
+# Medidas aditivas com os nomes das colunas da tabela; a projeção de 90 dias é calculada por linha
+# antes da agregação, como em generate_advanced_insights, e "linhas" conta as linhas de cada célula
+MEASURES = [
+    "soma_carteira_inadimplida_arrastada",
+    "soma_carteira_ativa",
+    "soma_ativo_problematico",
+    "soma_numero_de_operacoes",
+    "soma_a_vencer_ate_90_dias",
+    "projecao_inadimplencia_90d",
+    "linhas"
+]
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+
+def _factorize(values):
+    """
+    Códigos e rótulos de uma dimensão; categorias mantêm a ordem do dicionário, como no groupby
+
+    Valores ausentes recebem um código próprio no fim, com rótulo NaN.
+    """
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        codes = values.cat.codes.to_numpy().astype(np.int64)
+        labels = list(values.cat.categories)
+    else:
+        codes, uniques = pd.factorize(values, sort=True)
+        labels = list(uniques)
+    if (codes < 0).any():
+        codes = np.where(codes < 0, len(labels), codes)
+        labels.append(np.nan)
+    return codes, labels
+
+def derive_rates(frame):
+    """
+    Acrescenta taxa de inadimplência, índice de ativo problemático e indicador de reestruturação
+    """
+    carteira = frame["soma_carteira_ativa"].replace(0, np.nan)
+    frame["taxa_inadimplencia"] = frame["soma_carteira_inadimplida_arrastada"] / carteira * 100
+    frame["indice_ativo_problematico"] = frame["soma_ativo_problematico"] / carteira * 100
+    frame["indicador_reestruturacao"] = frame["soma_ativo_problematico"] - frame["soma_carteira_inadimplida_arrastada"]
+    return frame
+
+class Cube:
+    """
+    Medidas aditivas indexadas pelos códigos das dimensões
+
+    Params:
+        labels: {dimensão: lista de rótulos}, na ordem dos códigos
+        dense: array (cardinalidades..., medidas) no armazenamento denso, ou None
+        coords: array (células, dimensões) de códigos no armazenamento esparso, ou None
+        values: array (células, medidas) no armazenamento esparso, ou None
+    """
+    def __init__(self, labels, dense=None, coords=None, values=None):
+        self.labels = labels
+        self.dense = dense
+        self.coords = coords
+        self.values = values
+        self._positions = {dimension: {label: i for i, label in enumerate(values_)} for dimension, values_ in labels.items()}
+
+    @property
+    def shape(self):
+        return tuple(len(self.labels[dimension]) for dimension in DIMENSIONS)
+
+    @property
+    def cells(self):
+        if self.dense is not None:
+            return int((self.dense[..., MEASURES.index("linhas")] > 0).sum())
+        return len(self.values)
+
+    def _codes(self, dimension, value):
+        """
+        Códigos dos valores pedidos (valor único ou lista); meses aceitam pd.Period ou texto AAAA-MM
+        """
+        values = value if isinstance(value, (list, tuple, set)) else [value]
+        if dimension == "data_base":
+            values = [pd.Period(v, freq="M") for v in values]
+        positions = self._positions[dimension]
+        return np.array([positions[v] for v in values if v in positions], dtype=np.int64)
+
+    def slice(self, **filters):
+        """
+        Subcubo com as células que atendem a todos os filtros (ex.: slice(uf='SP', tipo_cliente='PF'))
+
+        Valores em lista são combinados com OU dentro da dimensão.
+        """
+        for dimension in filters:
+            if dimension not in self.labels:
+                raise KeyError(f"Dimensão desconhecida: {dimension}")
+        if self.dense is not None:
+            dense = self.dense
+            labels = dict(self.labels)
+            for dimension, value in filters.items():
+                codes = self._codes(dimension, value)
+                dense = dense.take(codes, axis=DIMENSIONS.index(dimension))
+                labels[dimension] = [self.labels[dimension][c] for c in codes]
+            return Cube(labels, dense=dense)
+
+        mask = np.ones(len(self.values), dtype=bool)
+        for dimension, value in filters.items():
+            mask &= np.isin(self.coords[:, DIMENSIONS.index(dimension)], self._codes(dimension, value))
+        return Cube(self.labels, coords=self.coords[mask], values=self.values[mask])
+
+    def total(self):
+        """
+        Soma de todas as células, com as taxas derivadas
+        """
+        return self.rollup().iloc[0]
+
+    def rollup(self, *dimensions, dropna=True):
+        """
+        Soma as medidas pelas dimensões pedidas (nenhuma: total geral)
+
+        Returns:
+            DataFrame com uma linha por combinação observada (ordenada pelos códigos, como o groupby),
+            colunas das dimensões, medidas e taxas derivadas
+        """
+        axes = [DIMENSIONS.index(dimension) for dimension in dimensions]
+        sizes = [len(self.labels[dimension]) for dimension in dimensions]
+        if self.dense is not None:
+            other = tuple(i for i in range(len(DIMENSIONS)) if i not in axes)
+            summed = self.dense.sum(axis=other)
+            # sum mantém os eixos restantes na ordem original; reordena para a ordem pedida
+            summed = summed.transpose([sorted(axes).index(axis) for axis in axes] + [len(axes)])
+            flat = summed.reshape(-1, len(MEASURES))
+            cells = np.flatnonzero(flat[:, MEASURES.index("linhas")] > 0)
+            sums = flat[cells]
+        elif not axes:
+            cells = np.zeros(1 if len(self.values) else 0, dtype=np.int64)
+            sums = self.values.sum(axis=0, keepdims=True)[:len(cells)]
+        else:
+            key = np.ravel_multi_index(tuple(self.coords[:, axis] for axis in axes), sizes)
+            if np.prod(sizes) <= 10 * max(len(key), 1):
+                counts = np.bincount(key, weights=self.values[:, MEASURES.index("linhas")], minlength=int(np.prod(sizes)))
+                cells = np.flatnonzero(counts > 0)
+                sums = np.column_stack([
+                    np.bincount(key, weights=self.values[:, m], minlength=int(np.prod(sizes)))[cells]
+                    for m in range(len(MEASURES))
+                ])
+            else:
+                cells, inverse = np.unique(key, return_inverse=True)
+                sums = np.column_stack([np.bincount(inverse, weights=self.values[:, m]) for m in range(len(MEASURES))])
+
+        frame = pd.DataFrame(sums, columns=MEASURES)
+        if axes:
+            coordinates = np.unravel_index(cells, sizes)
+            for position, (dimension, codes) in enumerate(zip(dimensions, coordinates)):
+                frame.insert(position, dimension, np.asarray(self.labels[dimension], dtype=object)[codes])
+            if dropna:
+                frame = frame.dropna(subset=list(dimensions)).reset_index(drop=True)
+        return derive_rates(frame)
+
+    @classmethod
+    def from_frame(cls, df, dense_max_cells=DENSE_MAX_CELLS):
+        """
+        Agrega o DataFrame consolidado em um cubo (denso se couber em dense_max_cells células)
+        """
+        keys = {
+            "uf": df["uf"],
+            "regiao": df["uf"].map(REGION_MAP),
+            "tipo_cliente": client_type(df["cliente"]),
+            "porte": df["porte"],
+            "modalidade": df["modalidade"],
+            "ocupacao": df["ocupacao"],
+            "cnae_secao": df["cnae_secao"],
+            "data_base": month_index(df["data_base"])
+        }
+        labels = {}
+        codes = []
+        for dimension in DIMENSIONS:
+            dimension_codes, dimension_labels = _factorize(keys[dimension])
+            codes.append(dimension_codes)
+            labels[dimension] = dimension_labels
+        sizes = [len(labels[dimension]) for dimension in DIMENSIONS]
+
+        # Valores ausentes somam zero, como no groupby
+        columns = [df[m].to_numpy(dtype=float, na_value=0.0) for m in MEASURES[:5]]
+        inadimplida, carteira, vencer = columns[0], columns[1], columns[4]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            projection = np.where(carteira > 0, vencer * (inadimplida / carteira), 0.0)
+        columns += [projection, np.ones(len(df))]
+
+        # Uma chave por combinação de códigos; factorize (hash) evita ordenar as linhas
+        key = np.ravel_multi_index(tuple(codes), sizes)
+        inverse, cells = pd.factorize(key)
+        values = np.column_stack([np.bincount(inverse, weights=column, minlength=len(cells)) for column in columns])
+
+        if np.prod(sizes) <= dense_max_cells:
+            dense = np.zeros((int(np.prod(sizes)), len(MEASURES)))
+            dense[cells] = values
+            return cls(labels, dense=dense.reshape(*sizes, len(MEASURES)))
+        coords = np.column_stack(np.unravel_index(cells, sizes)).astype(np.int32)
+        return cls(labels, coords=coords, values=values)
+
+def get_cube(df):
+    """
+    Retorna o cubo do DataFrame do cache (uma montagem por snapshot ou por DataFrame de sessão)
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0]() is df):
+            return cached[1]
+
+    cube = build_cube(df)
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (reference, cube)
+    return cube
+
+@traced("build_cube")
+def build_cube(df):
+    return Cube.from_frame(df)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Monta o cubo do snapshot atual e mede as operações de slice e rollup")
+    parser.add_argument("--repeticoes", type=int, default=100)
+    args = parser.parse_args()
+
+    from snapshot import current_snapshot_id, open_snapshot
+
+    snapshot_id = current_snapshot_id()
+    if snapshot_id is None:
+        raise SystemExit("Nenhum snapshot publicado (python snapshot.py refresh)")
+    df = open_snapshot(snapshot_id)
+
+    start = time.perf_counter()
+    cube = build_cube(df)
+    storage = "denso" if cube.dense is not None else "esparso"
+    print(f"Cubo {storage} com {cube.cells:,} células (forma {cube.shape}) montado em {time.perf_counter() - start:.2f}s")
+
+    latest = cube.labels["data_base"][-1]
+    operations = {
+        "slice(data_base, tipo_cliente='PF')": lambda: cube.slice(data_base=latest, tipo_cliente="PF"),
+        "slice(data_base).rollup('regiao')": lambda: cube.slice(data_base=latest).rollup("regiao"),
+        "rollup('uf')": lambda: cube.rollup("uf"),
+        "rollup('tipo_cliente', 'porte')": lambda: cube.rollup("tipo_cliente", "porte")
+    }
+    for name, operation in operations.items():
+        start = time.perf_counter()
+        for _ in range(args.repeticoes):
+            operation()
+        print(f"{name:<45} {(time.perf_counter() - start) / args.repeticoes * 1e6:10.1f} µs")
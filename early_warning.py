@@ -0,0 +1,358 @@
+# Alertas precoces: saltos anormais da taxa de inadimplência e do índice de ativo problemático
+#
+# Cada segmento (uf x modalidade x porte x tipo de cliente) é comparado com o próprio histórico por
+# dois critérios calculados como operações NumPy sobre a matriz meses x segmentos:
+#   - z-score robusto: (valor - mediana) / (1,4826 * MAD) sobre os últimos EARLY_WARNING_WINDOW meses
+#   - EWMA: desvio do valor em relação à média móvel exponencial, em desvios-padrão exponenciais
+# Um alerta exige os dois acima dos limites. O estado (janela, EWMA e variância por segmento) é
+# gravado em disco, então a chegada de um novo mês processa apenas esse mês. O estado guarda também
+# a assinatura de cada mês processado (linhas e somas); se os dados mudarem (mês reprocessado,
+# outra fonte ou dados sintéticos), as assinaturas não batem e o estado é recalculado do início.
+#
+# Variáveis de ambiente:
+#   EARLY_WARNING=0                     desativa os alertas nos insights
+#   EARLY_WARNING_WINDOW=12             meses da janela do z-score robusto
+#   EARLY_WARNING_LAMBDA=0.3            peso do mês atual na EWMA
+#   EARLY_WARNING_Z=3.5                 limite do z-score robusto
+#   EARLY_WARNING_EWMA=3.0              limite do desvio em relação à EWMA
+#   EARLY_WARNING_MIN_CARTEIRA=1000000  carteira ativa mínima do segmento para alertar
+#   EARLY_WARNING_DIR=.early_warning    diretório do estado incremental
+#
+# Uso:
+#   python early_warning.py               (processa os meses novos do snapshot atual)
+#   python early_warning.py --completo    (recalcula o estado desde o primeiro mês)
+import argparse
+import os
+import threading
+import time
+import warnings
+import weakref
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from forecast import SEGMENT_COLUMNS, segment_matrix
+from timeseries import month_index
+from tracing import span
+
+load_dotenv()
+
+EARLY_WARNING_ENABLED = os.getenv("EARLY_WARNING", "1") != "0"
+WINDOW = int(os.getenv("EARLY_WARNING_WINDOW", "12"))
+EWMA_LAMBDA = float(os.getenv("EARLY_WARNING_LAMBDA", "0.3"))
+Z_LIMIT = float(os.getenv("EARLY_WARNING_Z", "3.5"))
+EWMA_LIMIT = float(os.getenv("EARLY_WARNING_EWMA", "3.0"))
+MIN_CARTEIRA = float(os.getenv("EARLY_WARNING_MIN_CARTEIRA", "1000000"))
+MIN_HISTORY = 6
+STATE_DIR = os.getenv("EARLY_WARNING_DIR", ".early_warning")
+
+METRICS = ["taxa_inadimplencia", "indice_ativo_problematico"]
+SUM_COLUMNS = ["soma_carteira_inadimplida_arrastada", "soma_ativo_problematico", "soma_carteira_ativa"]
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+# Sessões do Streamlit são threads do mesmo processo: uma atualização do estado em disco por vez
+_state_lock = threading.Lock()
+
+class EarlyWarningState:
+    """
+    Estado incremental por segmento: janela dos últimos meses, EWMA, variância exponencial e meses vistos
+
+    Arrays com eixo (métrica, segmento); a janela tem eixo (mês, métrica, segmento).
+    """
+    def __init__(self, segments, last_month=None, window=None, ewma=None, ewvar=None, seen=None, carteira=None):
+        self.segments = list(segments)
+        count = len(self.segments)
+        self.last_month = last_month
+        self.window = window if window is not None else np.full((WINDOW, len(METRICS), count), np.nan)
+        self.ewma = ewma if ewma is not None else np.full((len(METRICS), count), np.nan)
+        self.ewvar = ewvar if ewvar is not None else np.zeros((len(METRICS), count))
+        self.seen = seen if seen is not None else np.zeros(count, dtype=int)
+        self.carteira = carteira if carteira is not None else np.zeros(count)
+        self.signatures = {}
+        self.scores = None
+
+    def matches(self, signatures):
+        """
+        Indica se os meses já processados têm as mesmas assinaturas nos dados atuais
+
+        Params:
+            signatures: {mês AAAA-MM: (linhas, inadimplida, carteira)} de month_signatures
+        """
+        if self.last_month is None:
+            return True
+        processed = {month for month in signatures if pd.Period(month, freq="M") <= self.last_month}
+        return processed == set(self.signatures) and all(self.signatures[month] == signatures[month] for month in processed)
+
+    def extend(self, segments):
+        """
+        Acrescenta segmentos que aparecem pela primeira vez, sem histórico
+        """
+        known = set(self.segments)
+        new = [segment for segment in segments if segment not in known]
+        if not new:
+            return
+        self.segments += new
+        pad = len(new)
+        self.window = np.concatenate([self.window, np.full((WINDOW, len(METRICS), pad), np.nan)], axis=2)
+        self.ewma = np.concatenate([self.ewma, np.full((len(METRICS), pad), np.nan)], axis=1)
+        self.ewvar = np.concatenate([self.ewvar, np.zeros((len(METRICS), pad))], axis=1)
+        self.seen = np.concatenate([self.seen, np.zeros(pad, dtype=int)])
+        self.carteira = np.concatenate([self.carteira, np.zeros(pad)])
+
+    def update(self, month, values, carteira):
+        """
+        Pontua o mês contra o histórico e incorpora-o ao estado
+
+        Params:
+            month: pd.Period do mês processado
+            values: array (métrica, segmento) com as taxas do mês (NaN sem carteira)
+            carteira: array (segmento,) com a carteira ativa do mês
+        """
+        with warnings.catch_warnings():
+            # Segmentos sem histórico geram fatias só com NaN na mediana
+            warnings.simplefilter("ignore", RuntimeWarning)
+            median = np.nanmedian(self.window, axis=0)
+            mad = np.nanmedian(np.abs(self.window - median), axis=0) * 1.4826
+            robust_z = np.where(mad > 0, (values - median) / mad, np.nan)
+            deviation = values - self.ewma
+            ewma_z = np.where(self.ewvar > 0, deviation / np.sqrt(self.ewvar), np.nan)
+
+        self.scores = {
+            "mes": month,
+            "valor": values,
+            "mediana": median,
+            "z_robusto": robust_z,
+            "ewma": self.ewma.copy(),
+            "z_ewma": ewma_z,
+            "historico": self.seen.copy()
+        }
+
+        observed = ~np.isnan(values)
+        first = observed & np.isnan(self.ewma)
+        update = observed & ~first
+        self.ewma = np.where(first, values, self.ewma)
+        self.ewvar = np.where(update, (1 - EWMA_LAMBDA) * (self.ewvar + EWMA_LAMBDA * deviation ** 2), self.ewvar)
+        self.ewma = np.where(update, self.ewma + EWMA_LAMBDA * deviation, self.ewma)
+        self.window = np.concatenate([self.window[1:], values[None]], axis=0)
+        self.seen = self.seen + observed.any(axis=0)
+        self.carteira = carteira
+        self.last_month = month
+
+    def alerts(self):
+        """
+        Alertas do último mês processado, do maior para o menor z-score robusto
+
+        Returns:
+            DataFrame com colunas de segmento, métrica, mes, valor, mediana, z_robusto, ewma, z_ewma e carteira_ativa
+        """
+        if self.scores is None:
+            return pd.DataFrame()
+        scores = self.scores
+        eligible = (scores["historico"] >= MIN_HISTORY) & (self.carteira >= MIN_CARTEIRA)
+        frames = []
+        for index, metric in enumerate(METRICS):
+            flagged = eligible & (scores["z_robusto"][index] >= Z_LIMIT) & (scores["z_ewma"][index] >= EWMA_LIMIT)
+            positions = np.flatnonzero(flagged)
+            if len(positions) == 0:
+                continue
+            frame = pd.DataFrame([self.segments[i] for i in positions], columns=SEGMENT_COLUMNS)
+            frame["metrica"] = metric
+            frame["mes"] = str(scores["mes"])
+            for column in ["valor", "mediana", "z_robusto", "ewma", "z_ewma"]:
+                frame[column] = scores[column][index][positions]
+            frame["carteira_ativa"] = self.carteira[positions]
+            frames.append(frame)
+        if not frames:
+            return pd.DataFrame(columns=SEGMENT_COLUMNS + ["metrica", "mes", "valor", "mediana", "z_robusto", "ewma", "z_ewma", "carteira_ativa"])
+        return pd.concat(frames, ignore_index=True).sort_values("z_robusto", ascending=False, ignore_index=True)
+
+    def save(self, path):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp.npz"
+        # As pontuações do último mês vão junto para que os alertas sejam servidos sem reprocessá-lo
+        scores = {f"score_{name}": value for name, value in (self.scores or {}).items() if name != "mes"}
+        np.savez(
+            tmp_path,
+            segments=np.array(["|".join(segment) for segment in self.segments]),
+            last_month=np.array(str(self.last_month)),
+            signature_months=np.array(list(self.signatures), dtype=str),
+            signature_values=np.array(list(self.signatures.values()), dtype=float).reshape(-1, 3),
+            window=self.window, ewma=self.ewma, ewvar=self.ewvar, seen=self.seen, carteira=self.carteira,
+            **scores
+        )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            if data["window"].shape[0] != WINDOW:
+                raise ValueError("Estado gravado com outra janela; use --completo")
+            state = cls(
+                [tuple(segment.split("|")) for segment in data["segments"]],
+                pd.Period(str(data["last_month"]), freq="M"),
+                data["window"], data["ewma"], data["ewvar"], data["seen"], data["carteira"]
+            )
+            if "signature_months" in data.files:
+                state.signatures = {
+                    str(month): (int(values[0]), float(values[1]), float(values[2]))
+                    for month, values in zip(data["signature_months"], data["signature_values"])
+                }
+            scores = {name[len("score_"):]: data[name] for name in data.files if name.startswith("score_")}
+            if scores:
+                state.scores = {"mes": state.last_month, **scores}
+            return state
+
+def _monthly_rates(df):
+    """
+    Matrizes meses x segmentos das métricas e da carteira ativa
+
+    Returns:
+        Tupla (segmentos, meses, array (mês, métrica, segmento), array (mês, segmento) da carteira)
+    """
+    inadimplida, problematico, carteira = segment_matrix(df, SUM_COLUMNS)
+    segments = [tuple(str(value) for value in segment) for segment in inadimplida.columns]
+    ativa = carteira.to_numpy(dtype=float)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        divisor = np.where(ativa > 0, ativa, np.nan)
+        rates = np.stack([
+            inadimplida.to_numpy(dtype=float) / divisor * 100,
+            problematico.to_numpy(dtype=float) / divisor * 100
+        ], axis=1)
+    return segments, inadimplida.index, rates, ativa
+
+def month_signatures(df, month=None):
+    """
+    Assinatura de cada mês do DataFrame: linhas e somas da carteira inadimplida e da carteira ativa
+
+    Returns:
+        Dicionário {AAAA-MM: (linhas, inadimplida, carteira)}
+    """
+    month = month_index(df["data_base"]) if month is None else month
+    keys = month.astype(str).to_numpy()
+    sums = df[["soma_carteira_inadimplida_arrastada", "soma_carteira_ativa"]].groupby(keys).sum()
+    counts = pd.Series(keys).value_counts()
+    return {
+        key: (int(counts[key]), round(float(row.iloc[0]), 2), round(float(row.iloc[1]), 2))
+        for key, row in sums.iterrows() if key != "NaT"
+    }
+
+def scan(df, state=None):
+    """
+    Processa os meses do DataFrame posteriores ao estado (todos, sem estado) e retorna o estado atualizado
+
+    Meses já incorporados ao estado não são reagregados: apenas as linhas dos meses novos entram no groupby.
+    """
+    with span("early_warning_scan") as s:
+        if state is not None and state.last_month is not None:
+            month = month_index(df["data_base"])
+            df = df[(month > state.last_month).to_numpy()]
+            if df.empty:
+                s.set_attribute("early_warning.meses", 0)
+                return state
+        segments, months, rates, carteira = _monthly_rates(df)
+        if state is None:
+            state = EarlyWarningState(segments)
+        state.extend(segments)
+        # Alinha as colunas do mês à ordem dos segmentos do estado
+        positions = {segment: i for i, segment in enumerate(state.segments)}
+        order = np.array([positions[segment] for segment in segments], dtype=int)
+        for t, month in enumerate(months):
+            values = np.full((len(METRICS), len(state.segments)), np.nan)
+            values[:, order] = rates[t]
+            month_carteira = np.zeros(len(state.segments))
+            month_carteira[order] = carteira[t]
+            state.update(month, values, month_carteira)
+        state.signatures.update(month_signatures(df))
+        s.set_attribute("early_warning.meses", len(months))
+        s.set_attribute("early_warning.segmentos", len(state.segments))
+        return state
+
+def _state_path(directory=STATE_DIR):
+    return os.path.join(directory, f"estado-w{WINDOW}.npz")
+
+def get_alerts(df, directory=STATE_DIR):
+    """
+    Alertas do último mês do DataFrame, em cache por snapshot, atualizando o estado gravado em disco
+
+    Returns:
+        DataFrame de EarlyWarningState.alerts
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0]() is df):
+            return cached[1]
+
+    path = _state_path(directory)
+    month = month_index(df["data_base"])
+    latest = month.max()
+    # Leitura, varredura e gravação juntas: outra sessão lê o estado já atualizado em vez de refazê-lo
+    with _state_lock:
+        state = EarlyWarningState.load(path) if os.path.exists(path) else None
+        if state is not None and not state.matches(month_signatures(df, month)):
+            # Dados diferentes dos que geraram o estado (mês reprocessado, outra fonte): recalcula do início
+            print("Estado dos alertas precoces não corresponde aos dados; recalculando desde o primeiro mês")
+            state = None
+        processed = state.last_month if state is not None else None
+        state = scan(df, state)
+        if state.last_month != processed:
+            state.save(path)
+    alerts = state.alerts() if state.last_month == latest else pd.DataFrame()
+
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (reference, alerts)
+    return alerts
+
+def format_alerts(alerts, top=5):
+    """
+    Linhas em markdown com os principais alertas para os insights
+    """
+    labels = {"taxa_inadimplencia": "taxa de inadimplência", "indice_ativo_problematico": "ativo problemático/carteira"}
+    lines = []
+    for _, row in alerts.head(top).iterrows():
+        lines.append(
+            f"- **{row['uf']} / {row['modalidade']} / {row['porte']} ({row['tipo_cliente']})**: "
+            f"{labels[row['metrica']]} em {row['valor']:.2f}% contra mediana de {row['mediana']:.2f}% "
+            f"(z robusto {row['z_robusto']:.1f}, carteira R$ {row['carteira_ativa']:,.2f})"
+        )
+    return lines
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Atualiza o estado dos alertas precoces e lista os alertas do último mês")
+    parser.add_argument("--completo", action="store_true", help="Recalcula o estado desde o primeiro mês")
+    parser.add_argument("--top", type=int, default=20, help="Alertas exibidos")
+    args = parser.parse_args()
+
+    from snapshot import current_snapshot_id, open_snapshot
+
+    snapshot_id = current_snapshot_id()
+    if snapshot_id is None:
+        from pipeline import connect_to_db, load_data
+
+        engine = connect_to_db()
+        if engine is None:
+            raise SystemExit("Nenhum snapshot publicado e não foi possível conectar ao banco de dados.")
+        df = load_data(engine)
+        engine.dispose()
+    else:
+        df = open_snapshot(snapshot_id)
+
+    path = _state_path()
+    state = None if args.completo or not os.path.exists(path) else EarlyWarningState.load(path)
+    if state is not None and not state.matches(month_signatures(df)):
+        print("Estado gravado não corresponde aos dados; recalculando desde o primeiro mês")
+        state = None
+    processed = state.last_month if state is not None else None
+    start = time.perf_counter()
+    state = scan(df, state)
+    state.save(path)
+    print(f"Estado até {state.last_month} ({len(state.segments)} segmentos; antes: {processed}) "
+          f"atualizado em {time.perf_counter() - start:.2f}s")
+    alerts = state.alerts()
+    print(f"{len(alerts)} alertas em {state.last_month}")
+    for line in format_alerts(alerts, args.top):
+        print(line)
@@ -0,0 +1,301 @@
+# Previsão de inadimplência por segmento (uf x modalidade x porte x tipo de cliente)
+#
+# O histórico mensal de data_base é agregado em uma matriz meses x segmentos da carteira inadimplida
+# e cada segmento recebe um modelo de suavização exponencial (Holt com tendência amortecida, do
+# statsmodels). Os milhares de segmentos são divididos em lotes e ajustados em paralelo em um pool
+# de processos; cada lote recebe só a fatia numpy das suas séries. O resultado fica em cache por
+# versão dos dados (o snapshot ou, para dados lidos do banco, uma assinatura do DataFrame), em
+# memória e em disco, e é usado pelos insights e pelas perguntas de PREVISÃO. Cada versão é ajustada
+# uma única vez: novas sessões sobre os mesmos dados leem o cache em vez de reajustar os modelos.
+#
+# Variáveis de ambiente:
+#   FORECAST=1               ativa a previsão nos insights e nas respostas (desativada por padrão)
+#   FORECAST_HORIZON=3       meses previstos
+#   FORECAST_WORKERS=n       processos do pool (padrão: núcleos da máquina)
+#   FORECAST_BATCH=250       segmentos por lote enviado ao pool
+#   FORECAST_MIN_HISTORY=6   meses mínimos para ajustar o modelo (abaixo disso, repete o último valor)
+#   FORECAST_DIR=.forecasts  diretório do cache em disco (um arquivo parquet por versão dos dados)
+#
+# Uso:
+#   python forecast.py                  (ajusta os dados atuais e grava o cache)
+#   python forecast.py --top 20 --workers 8
+import argparse
+import hashlib
+import multiprocessing
+import os
+import threading
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+from insights import client_type
+from timeseries import month_index, match_values
+from tracing import span
+
+load_dotenv()
+
+FORECAST_ENABLED = os.getenv("FORECAST", "0") == "1"
+FORECAST_HORIZON = int(os.getenv("FORECAST_HORIZON", "3"))
+FORECAST_WORKERS = int(os.getenv("FORECAST_WORKERS", "0")) or os.cpu_count() or 1
+FORECAST_BATCH = int(os.getenv("FORECAST_BATCH", "250"))
+MIN_HISTORY = int(os.getenv("FORECAST_MIN_HISTORY", "6"))
+FORECAST_DIR = os.getenv("FORECAST_DIR", ".forecasts")
+
+SEGMENT_COLUMNS = ["uf", "modalidade", "porte", "tipo_cliente"]
+
+_cache = {}
+_cache_lock = threading.Lock()
+_build_lock = threading.Lock()
+_MAX_CACHED = 4
+
+def _fit_batch(values, horizon, min_history):
+    """
+    Ajusta um modelo por coluna da matriz meses x segmentos (executado nos processos do pool)
+
+    Returns:
+        Tupla (previsões horizonte x segmentos, erro quadrático médio por segmento, método por segmento)
+    """
+    from statsmodels.tsa.holtwinters import ExponentialSmoothing
+
+    forecasts = np.zeros((horizon, values.shape[1]))
+    rmse = np.full(values.shape[1], np.nan)
+    methods = []
+    for column in range(values.shape[1]):
+        series = values[:, column]
+        # Descarta os meses anteriores à primeira observação do segmento
+        observed = np.flatnonzero(series)
+        if len(observed) == 0:
+            methods.append("zero")
+            continue
+        series = series[observed[0]:]
+        if len(series) < min_history or np.ptp(series) == 0:
+            forecasts[:, column] = series[-1]
+            methods.append("ultimo_valor")
+            continue
+        try:
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                fit = ExponentialSmoothing(
+                    series, trend="add", damped_trend=True, initialization_method="estimated"
+                ).fit()
+            forecasts[:, column] = np.clip(fit.forecast(horizon), 0, None)
+            rmse[column] = np.sqrt(fit.sse / len(series))
+            methods.append("holt")
+        except Exception:
+            forecasts[:, column] = series[-1]
+            methods.append("ultimo_valor")
+    return forecasts, rmse, methods
+
+def segment_matrix(df, columns=("soma_carteira_inadimplida_arrastada", "soma_carteira_ativa")):
+    """
+    Agrega colunas de soma por mês e segmento
+
+    Returns:
+        Tupla com um DataFrame meses x segmentos por coluna (padrão: inadimplida e carteira ativa),
+        com a grade mensal completa
+    """
+    month = month_index(df["data_base"]).rename("mes")
+    months = pd.period_range(month.min(), month.max(), freq="M")
+    if len(months) == 0:
+        raise ValueError("Nenhuma data_base válida para a previsão")
+    keys = [df["uf"], df["modalidade"], df["porte"], client_type(df["cliente"]).rename("tipo_cliente")]
+    grouped = df[list(columns)].groupby([month, *keys], observed=True).sum()
+    matrices = []
+    for column in columns:
+        matrix = grouped[column].unstack(SEGMENT_COLUMNS)
+        matrices.append(matrix.reindex(months).fillna(0.0))
+    return tuple(matrices)
+
+def build_forecasts(df, horizon=FORECAST_HORIZON, workers=FORECAST_WORKERS, batch_size=FORECAST_BATCH):
+    """
+    Ajusta os modelos de todos os segmentos em lotes distribuídos pelo pool de processos
+
+    Params:
+        df: DataFrame com os dados consolidados (todo o histórico de data_base)
+        horizon: meses previstos
+        workers: processos do pool (1 ajusta no próprio processo)
+        batch_size: segmentos por lote
+
+    Returns:
+        DataFrame com um segmento por linha: colunas de segmento, mes_base, inadimplida e carteira_ativa
+        do último mês, previsao_m1..previsao_mN, previsao (último mês do horizonte), variacao_pct,
+        taxa_prevista, rmse e metodo
+    """
+    with span("build_forecasts", **{"forecast.horizon": horizon, "forecast.workers": workers}) as s:
+        inadimplida, carteira = segment_matrix(df)
+        values = inadimplida.to_numpy(dtype=float)
+        batches = [values[:, i:i + batch_size] for i in range(0, values.shape[1], batch_size)]
+        s.set_attribute("forecast.segmentos", values.shape[1])
+        s.set_attribute("forecast.lotes", len(batches))
+
+        if workers > 1 and len(batches) > 1:
+            # spawn: o processo pai pode ter threads (Streamlit, uvicorn), que não sobrevivem a um fork
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(batches)), mp_context=context) as executor:
+                results = list(executor.map(_fit_batch, batches, [horizon] * len(batches), [MIN_HISTORY] * len(batches)))
+        else:
+            results = [_fit_batch(batch, horizon, MIN_HISTORY) for batch in batches]
+
+        forecasts = np.hstack([r[0] for r in results]) if results else np.zeros((horizon, 0))
+        result = inadimplida.columns.to_frame(index=False)
+        result["mes_base"] = str(inadimplida.index[-1])
+        result["inadimplida"] = values[-1]
+        result["carteira_ativa"] = carteira.to_numpy(dtype=float)[-1]
+        for step in range(horizon):
+            result[f"previsao_m{step + 1}"] = forecasts[step]
+        result["previsao"] = forecasts[-1]
+        result["variacao_pct"] = (result["previsao"] / result["inadimplida"].replace(0, np.nan) - 1) * 100
+        result["taxa_prevista"] = result["previsao"] / result["carteira_ativa"].replace(0, np.nan) * 100
+        result["rmse"] = np.concatenate([r[1] for r in results]) if results else []
+        result["metodo"] = [method for r in results for method in r[2]]
+        for column in SEGMENT_COLUMNS:
+            result[column] = result[column].astype(str)
+        s.set_attribute("forecast.ajustados", int((result["metodo"] == "holt").sum()))
+        return result
+
+def data_version(df):
+    """
+    Versão dos dados: o snapshot ou, sem snapshot, uma assinatura do DataFrame (linhas, meses e somas)
+
+    Duas sessões que carregam os mesmos dados do banco têm a mesma versão e compartilham o cache.
+    """
+    snapshot_id = df.attrs.get("snapshot_id")
+    if snapshot_id:
+        return snapshot_id
+    months = sorted(str(value) for value in pd.unique(df["data_base"].astype(str)))
+    sums = [float(df[column].sum()) for column in ["soma_carteira_inadimplida_arrastada", "soma_carteira_ativa"]]
+    signature = f"{len(df)}|{'|'.join(months)}|{sums[0]:.6f}|{sums[1]:.6f}"
+    return "dados-" + hashlib.sha1(signature.encode("utf-8")).hexdigest()[:16]
+
+def _cache_path(version, directory=FORECAST_DIR):
+    return os.path.join(directory, f"{version}-h{FORECAST_HORIZON}.parquet")
+
+def get_forecasts(df):
+    """
+    Previsões do DataFrame a partir do cache (memória, depois disco) ou ajustadas uma única vez
+
+    O cache é indexado pela versão dos dados (data_version) e gravado em FORECAST_DIR, reaproveitado
+    pelas demais sessões e processos.
+    """
+    version = data_version(df)
+    with _cache_lock:
+        cached = _cache.get(version)
+        if cached is not None:
+            return cached
+
+    # Um único ajuste por processo: as demais sessões esperam e usam o cache
+    with _build_lock:
+        with _cache_lock:
+            cached = _cache.get(version)
+            if cached is not None:
+                return cached
+        path = _cache_path(version)
+        if os.path.exists(path):
+            forecasts = pd.read_parquet(path)
+        else:
+            forecasts = build_forecasts(df)
+            os.makedirs(FORECAST_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            forecasts.to_parquet(tmp_path, index=False)
+            os.replace(tmp_path, path)
+
+        with _cache_lock:
+            if len(_cache) >= _MAX_CACHED:
+                _cache.pop(next(iter(_cache)))
+            _cache[version] = forecasts
+    return forecasts
+
+def summarize_forecasts(forecasts, by):
+    """
+    Soma os segmentos pelas colunas `by` e recalcula a variação e a taxa prevista
+
+    Returns:
+        DataFrame com inadimplida, previsao, carteira_ativa, variacao, variacao_pct e taxa_prevista
+    """
+    summary = forecasts.groupby(by)[["inadimplida", "previsao", "carteira_ativa"]].sum().reset_index()
+    summary["variacao"] = summary["previsao"] - summary["inadimplida"]
+    summary["variacao_pct"] = (summary["previsao"] / summary["inadimplida"].replace(0, np.nan) - 1) * 100
+    summary["taxa_prevista"] = summary["previsao"] / summary["carteira_ativa"].replace(0, np.nan) * 100
+    return summary
+
+def _segment_label(row):
+    return " / ".join(str(row[column]) for column in SEGMENT_COLUMNS)
+
+def describe_forecast(question, forecasts, top=8):
+    """
+    Texto com a previsão dos segmentos citados na pergunta, para o contexto da resposta
+
+    Sem segmentos reconhecidos, descreve o total, PF x PJ e os segmentos com maior aumento previsto.
+    """
+    candidates = {column: forecasts[column].unique() for column in SEGMENT_COLUMNS}
+    targets = match_values(question, candidates)
+    selected = forecasts
+    for column in SEGMENT_COLUMNS:
+        values = [value for dimension, value in targets if dimension == column]
+        if values:
+            selected = selected[selected[column].isin(values)]
+
+    horizon = sum(column.startswith("previsao_m") for column in forecasts.columns)
+    base_month = forecasts["mes_base"].iloc[0] if len(forecasts) else "-"
+    filters = ", ".join(f"{dimension} = {value}" for dimension, value in targets) or "todos os segmentos"
+    text = f"PREVISÃO DA CARTEIRA INADIMPLIDA - {horizon} meses a partir de {base_month} ({filters})\n"
+    if selected.empty:
+        return text + "Nenhum segmento encontrado para os filtros da pergunta.\n"
+
+    current, predicted = selected["inadimplida"].sum(), selected["previsao"].sum()
+    carteira = selected["carteira_ativa"].sum()
+    text += f"Inadimplida atual: R$ {current:,.2f}"
+    text += f" ({current / carteira * 100:.2f}% da carteira)\n" if carteira else "\n"
+    for step in range(1, horizon + 1):
+        text += f"Mês +{step}: R$ {selected[f'previsao_m{step}'].sum():,.2f}\n"
+    if current:
+        text += f"Variação prevista no horizonte: {(predicted / current - 1) * 100:+.2f}%\n"
+    fitted = (selected["metodo"] == "holt").mean() * 100
+    text += f"Segmentos: {len(selected)} ({fitted:.0f}% com modelo ajustado; os demais repetem o último valor)\n"
+
+    if not targets:
+        text += "\nPor tipo de cliente:\n"
+        for _, row in summarize_forecasts(selected, "tipo_cliente").iterrows():
+            text += f"- {row['tipo_cliente']}: R$ {row['inadimplida']:,.2f} -> R$ {row['previsao']:,.2f} ({row['variacao_pct']:+.2f}%)\n"
+
+    growth = selected.assign(variacao=selected["previsao"] - selected["inadimplida"])
+    text += "\nSegmentos com maior aumento previsto (R$):\n"
+    for _, row in growth.nlargest(top, "variacao").iterrows():
+        if row["variacao"] <= 0:
+            break
+        text += (f"- {_segment_label(row)}: R$ {row['inadimplida']:,.2f} -> R$ {row['previsao']:,.2f} "
+                 f"(taxa prevista {row['taxa_prevista']:.2f}%)\n")
+    return text
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Ajusta a previsão por segmento dos dados atuais e grava o cache")
+    parser.add_argument("--workers", type=int, default=FORECAST_WORKERS, help="Processos do pool")
+    parser.add_argument("--lote", type=int, default=FORECAST_BATCH, help="Segmentos por lote")
+    parser.add_argument("--top", type=int, default=10, help="Segmentos com maior aumento previsto exibidos")
+    args = parser.parse_args()
+
+    from snapshot import current_snapshot_id, open_snapshot
+
+    snapshot_id = current_snapshot_id()
+    if snapshot_id is None:
+        from pipeline import connect_to_db, load_data
+
+        engine = connect_to_db()
+        if engine is None:
+            raise SystemExit("Nenhum snapshot publicado e não foi possível conectar ao banco de dados.")
+        df = load_data(engine)
+        engine.dispose()
+    else:
+        df = open_snapshot(snapshot_id)
+
+    start = time.perf_counter()
+    forecasts = build_forecasts(df, workers=args.workers, batch_size=args.lote)
+    elapsed = time.perf_counter() - start
+    # Grava o cache da versão dos dados lida pelas sessões (snapshot ou assinatura do banco)
+    os.makedirs(FORECAST_DIR, exist_ok=True)
+    forecasts.to_parquet(_cache_path(data_version(df)), index=False)
+    print(f"{len(forecasts)} segmentos ajustados em {elapsed:.1f}s com {args.workers} processos")
+    print(forecasts["metodo"].value_counts().to_string())
+    print(describe_forecast("", forecasts, top=args.top))
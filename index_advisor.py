@@ -0,0 +1,279 @@
+# Recomendação de índices para a tabela consolidada a partir das consultas geradas registradas
+#
+# Lê as consultas executadas (registro de query_log.py ou spans execute_dynamic_query de tracing.py), extrai as
+# colunas de filtro por igualdade, de intervalo e de agrupamento, pondera cada formato de consulta
+# pela frequência e pela latência total e recomenda:
+#   - índices compostos (igualdade -> intervalo -> agrupamento) por formato de consulta
+#   - índices parciais quando um mesmo valor domina o filtro de uma coluna (ex.: o mês mais recente)
+# Consultas roteadas para as tabelas de agregados (rollups.py) não usam a tabela consolidada e são ignoradas.
+#
+# Uso:
+#   python index_advisor.py                                   recomenda a partir de traces/spans.jsonl
+#   python index_advisor.py --registro                        recomenda a partir do registro de consultas
+#   python index_advisor.py --db-url sqlite:///local.db --criar  cria os índices e compara o EXPLAIN
+import argparse
+import json
+import re
+from collections import Counter, defaultdict
+import numpy as np
+from sqlalchemy import create_engine, inspect, text
+from rollups import BASE_TABLE, DIMENSIONS, MEASURES
+from sql_guard import clean_sql, mask_sql, explain_estimate
+from sql_repair import fingerprint
+from tracing import TRACE_FILE, load_spans
+from query_log import QUERY_LOG_DB, load_log
+
+COLUMNS = DIMENSIONS + MEASURES
+MAX_INDEX_COLUMNS = 4
+# Fração mínima das consultas que filtram a coluna com o mesmo valor para sugerir índice parcial
+PARTIAL_SHARE = 0.5
+CLAUSE_END = r"\b(group\s+by|order\s+by|having|limit|union)\b|$"
+
+def load_workload(path=TRACE_FILE):
+    """
+    Consultas bem-sucedidas na tabela consolidada com a duração de cada execução
+
+    Returns:
+        Lista de dicionários {"sql", "duration_ms"}
+    """
+    workload = []
+    for item in load_spans(path):
+        if item["name"] != "execute_dynamic_query" or item["error"]:
+            continue
+        attributes = item["attributes"]
+        if attributes.get("db.rollup") or not attributes.get("db.statement"):
+            continue
+        workload.append({"sql": clean_sql(attributes["db.statement"]), "duration_ms": item["duration_ms"]})
+    return workload
+
+def load_workload_from_log(path=QUERY_LOG_DB):
+    """
+    Mesmo formato de load_workload, a partir do registro de consultas (latência da etapa execute)
+    """
+    log = load_log(path)
+    log = log[log["erro"].isna() & log["rollup"].isna() & log["sql_executado"].notna() & log["execute_ms"].notna()]
+    return [{"sql": clean_sql(sql), "duration_ms": ms} for sql, ms in zip(log["sql_executado"], log["execute_ms"])]
+
+def _clause(masked_lower, start_keyword):
+    match = re.search(rf"\b{start_keyword}\b", masked_lower)
+    if match is None:
+        return None, None
+    end = re.search(CLAUSE_END, masked_lower[match.end():])
+    return match.end(), match.end() + end.start()
+
+def analyze_query(sql):
+    """
+    Extrai as colunas usadas em filtros e agrupamentos da consulta
+
+    Returns:
+        Dicionário com "equality", "range", "group_by" (listas de colunas) e "equality_values"
+        ({coluna: literal} para filtros coluna = 'valor')
+    """
+    masked = mask_sql(sql).lower()
+    result = {"equality": [], "range": [], "group_by": [], "equality_values": {}}
+    if not re.search(rf"\b{BASE_TABLE}\b", masked):
+        return result
+
+    start, end = _clause(masked, "where")
+    if start is not None:
+        where = masked[start:end]
+        for column in COLUMNS:
+            for match in re.finditer(rf"\b{column}\s*(=|in\b|>=|<=|<>|!=|>|<|between\b|like\b|ilike\b)", where):
+                operator = match.group(1)
+                if operator in ("=", "in"):
+                    if column not in result["equality"]:
+                        result["equality"].append(column)
+                    if operator == "=":
+                        # O literal é lido da consulta original, nas mesmas posições do texto mascarado
+                        literal = re.match(r"\s*('(?:[^']|'')*')", sql[start + match.end():])
+                        if literal:
+                            result["equality_values"][column] = literal.group(1)
+                elif operator not in ("<>", "!=") and column not in result["range"]:
+                    result["range"].append(column)
+
+    start, end = _clause(masked, r"group\s+by")
+    if start is not None:
+        group = masked[start:end]
+        result["group_by"] = [c for c in COLUMNS if re.search(rf"\b{c}\b", group)]
+
+    result["range"] = [c for c in result["range"] if c not in result["equality"]]
+    return result
+
+def _cardinalities(engine):
+    counts = {}
+    with engine.connect() as conn:
+        for column in DIMENSIONS:
+            counts[column] = conn.execute(text(f"SELECT COUNT(DISTINCT {column}) FROM {BASE_TABLE}")).scalar()
+    return counts
+
+def _existing_indexes(engine):
+    return [tuple(index["column_names"]) for index in inspect(engine).get_indexes(BASE_TABLE)]
+
+def _index_name(columns, partial=None):
+    name = "idx_inad_" + "_".join(columns)
+    if partial:
+        column, literal = partial
+        value = re.sub(r"\W+", "_", literal.strip("'")).strip("_").lower()
+        name += f"_{column}_{value}"
+    return name[:63]
+
+def recommend_indexes(workload, engine=None):
+    """
+    Agrupa as consultas por formato e recomenda índices compostos e parciais
+
+    Com engine, ordena as colunas de igualdade pela cardinalidade (mais seletiva primeiro) e
+    descarta recomendações cobertas por índices existentes.
+
+    Returns:
+        Lista de recomendações ordenadas pelo tempo total das consultas atendidas
+    """
+    shapes = {}
+    for entry in workload:
+        key = fingerprint(entry["sql"])
+        shape = shapes.setdefault(key, {"sql": entry["sql"], "durations": [], **analyze_query(entry["sql"])})
+        shape["durations"].append(entry["duration_ms"])
+
+    cardinality = _cardinalities(engine) if engine is not None else {}
+    existing = _existing_indexes(engine) if engine is not None else []
+
+    # Quantas consultas filtram cada coluna e com quais valores
+    value_counts = defaultdict(Counter)
+    for shape in shapes.values():
+        for column, literal in shape["equality_values"].items():
+            value_counts[column][literal] += len(shape["durations"])
+
+    candidates = {}
+    for shape in shapes.values():
+        if not (shape["equality"] or shape["range"]):
+            continue
+        equality = sorted(shape["equality"], key=lambda c: -cardinality.get(c, 0))
+        tail = shape["range"] + [c for c in shape["group_by"] if c not in equality and c not in shape["range"]]
+        partial = None
+        for column in equality:
+            literal = shape["equality_values"].get(column)
+            total = sum(value_counts[column].values())
+            if literal is None or not total or value_counts[column][literal] / total < PARTIAL_SHARE:
+                continue
+            if len(equality) > 1 or tail:
+                # O valor dominante sai das colunas do índice e vira o predicado do índice parcial
+                partial = (column, literal)
+                equality = [c for c in equality if c != column]
+            break
+        columns = tuple((equality + [c for c in tail if c not in equality])[:MAX_INDEX_COLUMNS])
+        if not columns:
+            continue
+
+        key = (columns, partial)
+        candidate = candidates.setdefault(key, {"columns": columns, "partial": partial, "queries": 0,
+                                                "total_ms": 0.0, "durations": [], "examples": []})
+        candidate["queries"] += len(shape["durations"])
+        candidate["total_ms"] += sum(shape["durations"])
+        candidate["durations"].extend(shape["durations"])
+        if len(candidate["examples"]) < 3:
+            candidate["examples"].append(shape["sql"])
+
+    # Um índice cujo prefixo já é outro candidato (com o mesmo predicado) absorve o menor
+    for key, candidate in list(candidates.items()):
+        if key not in candidates:
+            continue
+        for other_key, other in candidates.items():
+            if other_key != key and other["partial"] == candidate["partial"] \
+                    and len(other["columns"]) > len(candidate["columns"]) \
+                    and other["columns"][:len(candidate["columns"])] == candidate["columns"]:
+                other["queries"] += candidate["queries"]
+                other["total_ms"] += candidate["total_ms"]
+                other["durations"].extend(candidate["durations"])
+                del candidates[key]
+                break
+
+    recommendations = []
+    for candidate in candidates.values():
+        covered = candidate["partial"] is None and any(
+            index[:len(candidate["columns"])] == candidate["columns"] for index in existing
+        )
+        if covered:
+            continue
+        name = _index_name(candidate["columns"], candidate["partial"])
+        ddl = f"CREATE INDEX IF NOT EXISTS {name} ON {BASE_TABLE} ({', '.join(candidate['columns'])})"
+        if candidate["partial"]:
+            ddl += f" WHERE {candidate['partial'][0]} = {candidate['partial'][1]}"
+        recommendations.append({
+            "nome": name,
+            "ddl": ddl,
+            "colunas": list(candidate["columns"]),
+            "parcial": candidate["partial"],
+            "consultas": candidate["queries"],
+            "tempo_total_ms": candidate["total_ms"],
+            "p95_ms": float(np.percentile(candidate["durations"], 95)),
+            "exemplos": candidate["examples"]
+        })
+    return sorted(recommendations, key=lambda r: -r["tempo_total_ms"])
+
+def explain_summary(engine, sql):
+    """
+    Custo estimado (PostgreSQL) ou plano resumido (SQLite) da consulta
+    """
+    with engine.connect() as conn:
+        if conn.dialect.name == "postgresql":
+            cost, rows = explain_estimate(conn, sql)
+            return {"custo": cost, "linhas": rows}
+        if conn.dialect.name == "sqlite":
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            return {"plano": " | ".join(row[-1] for row in plan)}
+    return {}
+
+def apply_recommendations(engine, recommendations):
+    """
+    Cria os índices recomendados e retorna o EXPLAIN das consultas de exemplo antes e depois
+    """
+    before = {r["nome"]: [explain_summary(engine, sql) for sql in r["exemplos"]] for r in recommendations}
+    with engine.begin() as conn:
+        for recommendation in recommendations:
+            print(f"Criando {recommendation['nome']}...")
+            conn.execute(text(recommendation["ddl"]))
+        conn.execute(text(f"ANALYZE {BASE_TABLE}"))
+    report = []
+    for recommendation in recommendations:
+        after = [explain_summary(engine, sql) for sql in recommendation["exemplos"]]
+        for sql, plan_before, plan_after in zip(recommendation["exemplos"], before[recommendation["nome"]], after):
+            report.append({"indice": recommendation["nome"], "sql": sql, "antes": plan_before, "depois": plan_after})
+    return report
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recomenda índices a partir das consultas geradas registradas")
+    parser.add_argument("--arquivo", default=TRACE_FILE, help="Arquivo de spans (tracing.py)")
+    parser.add_argument("--registro", action="store_true", help="Usa o registro de consultas (query_log.py) em vez dos spans")
+    parser.add_argument("--db-url", help="Banco local ou de homologação para cardinalidades, índices existentes e EXPLAIN")
+    parser.add_argument("--criar", action="store_true", help="Cria os índices recomendados no banco de --db-url")
+    parser.add_argument("--top", type=int, default=5, help="Quantidade de índices recomendados")
+    parser.add_argument("--saida", help="Arquivo JSON com recomendações e comparação do EXPLAIN")
+    args = parser.parse_args()
+
+    if args.criar and not args.db_url:
+        # Criação explícita apenas em banco informado na linha de comando, nunca no de produção do .env
+        raise SystemExit("--criar exige --db-url de um banco local ou de homologação")
+
+    engine = create_engine(args.db_url) if args.db_url else None
+    source = QUERY_LOG_DB if args.registro else args.arquivo
+    workload = load_workload_from_log() if args.registro else load_workload(args.arquivo)
+    print(f"{len(workload)} consultas na tabela consolidada em {source}")
+    recommendations = recommend_indexes(workload, engine)[:args.top]
+
+    for r in recommendations:
+        print(f"\n{r['ddl']}")
+        print(f"  {r['consultas']} consultas | tempo total {r['tempo_total_ms']:.0f} ms | p95 {r['p95_ms']:.0f} ms")
+
+    output = {"recomendacoes": recommendations}
+    if args.criar and recommendations:
+        output["explain"] = apply_recommendations(engine, recommendations)
+        for item in output["explain"]:
+            print(f"\n[{item['indice']}] {item['sql'][:100]}")
+            print(f"  antes:  {item['antes']}")
+            print(f"  depois: {item['depois']}")
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(output, f, ensure_ascii=False, indent=2)
+        print(f"\nRelatório gravado em {args.saida}")
+    if engine is not None:
+        engine.dispose()
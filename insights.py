@@ -1,79 +1,87 @@
 import pandas as pd
-import numpy as np
+from tracing import traced
+from profiling import mark_section, profile_if_requested
 
-import pandas as pd
-import numpy as np
+REGION_MAP = {
+    'AC': 'Norte', 'AM': 'Norte', 'AP': 'Norte', 'PA': 'Norte', 'RO': 'Norte', 'RR': 'Norte', 'TO': 'Norte',
+    'AL': 'Nordeste', 'BA': 'Nordeste', 'CE': 'Nordeste', 'MA': 'Nordeste', 'PB': 'Nordeste',
+    'PE': 'Nordeste', 'PI': 'Nordeste', 'RN': 'Nordeste', 'SE': 'Nordeste',
+    'GO': 'Centro-Oeste', 'MT': 'Centro-Oeste', 'MS': 'Centro-Oeste', 'DF': 'Centro-Oeste',
+    'SP': 'Sudeste', 'RJ': 'Sudeste', 'MG': 'Sudeste', 'ES': 'Sudeste',
+    'PR': 'Sul', 'RS': 'Sul', 'SC': 'Sul'
+}
+
+def client_type(cliente):
+    """
+    Tipo de cliente (PF ou PJ) a partir da coluna cliente
+    """
+    return cliente.apply(lambda x: 'PF' if 'Física' in str(x) else 'PJ')
+
+MONTH_NAMES = [
+    'janeiro', 'fevereiro', 'março', 'abril', 'maio', 'junho',
+    'julho', 'agosto', 'setembro', 'outubro', 'novembro', 'dezembro'
+]
+DEFAULT_PERIOD = pd.Period('2024-12', freq='M')
+
+def period_labels(period):
+    """
+    Rótulos do período usados nos títulos: (DEZEMBRO 2024, DEZ/2024, dezembro de 2024)
+    """
+    name = MONTH_NAMES[period.month - 1]
+    return f"{name.upper()} {period.year}", f"{name[:3].upper()}/{period.year}", f"{name} de {period.year}"
 
-def generate_advanced_insights(df):
+@traced("generate_advanced_insights")
+@profile_if_requested("insights")
+def generate_advanced_insights(df, forecasts=None, period=None, alerts=None, cube=None):
     """
-    Gera insights detalhados sobre inadimplência a partir de dados consolidados de dezembro de 2024
+    Gera insights detalhados sobre inadimplência a partir de dados consolidados de um mês (padrão: dezembro de 2024)
     
     Params:
-        df: DataFrame com dados consolidados de inadimplência
+        df: DataFrame com dados consolidados de inadimplência (pode ser None quando cube é informado)
+        forecasts: previsões por segmento de forecast.get_forecasts (opcional)
+        period: mês analisado, como pd.Period ou texto AAAA-MM (opcional)
+        alerts: alertas precoces de early_warning.get_alerts (opcional)
+        cube: cubo já montado (cube.Cube), em vez de agregar o df (opcional)
     
     Returns:
         String com insights formatados
     """
-    # Filtrar apenas dados de dezembro de 2024
-    df['data_base'] = pd.to_datetime(df['data_base'], format='%d/%m/%Y', errors='coerce')
-    df = df[(df['data_base'].dt.month == 12) & (df['data_base'].dt.year == 2024)].copy()
-    
-    if df.empty:
-        return "Nenhum dado disponível para dezembro de 2024."
+    # Import local: cube.py importa REGION_MAP e client_type deste módulo
+    from cube import get_cube
 
-    # Preparar dados - mapear regiões
-    df['regiao'] = df['uf'].map({
-        'AC': 'Norte', 'AM': 'Norte', 'AP': 'Norte', 'PA': 'Norte', 'RO': 'Norte', 'RR': 'Norte', 'TO': 'Norte',
-        'AL': 'Nordeste', 'BA': 'Nordeste', 'CE': 'Nordeste', 'MA': 'Nordeste', 'PB': 'Nordeste', 
-        'PE': 'Nordeste', 'PI': 'Nordeste', 'RN': 'Nordeste', 'SE': 'Nordeste',
-        'GO': 'Centro-Oeste', 'MT': 'Centro-Oeste', 'MS': 'Centro-Oeste', 'DF': 'Centro-Oeste',
-        'SP': 'Sudeste', 'RJ': 'Sudeste', 'MG': 'Sudeste', 'ES': 'Sudeste',
-        'PR': 'Sul', 'RS': 'Sul', 'SC': 'Sul'
-    })
-    
-    # Calcular taxa de inadimplência
-    df['taxa_inadimplencia'] = (df['soma_carteira_inadimplida_arrastada'] / df['soma_carteira_ativa'] * 100).fillna(0)
-    
-    # Calcular índice de ativo problemático
-    df['indice_ativo_problematico'] = (df['soma_ativo_problematico'] / df['soma_carteira_ativa'] * 100).fillna(0)
-    
-    # Calcular projeção de inadimplência em 90 dias
-    df['projecao_inadimplencia_90d'] = np.where(
-        df['soma_carteira_ativa'] > 0,
-        df['soma_a_vencer_ate_90_dias'] * (df['soma_carteira_inadimplida_arrastada'] / df['soma_carteira_ativa']),
-        0
-    )
-    
-    # Calcular indicador de reestruturação
-    df['indicador_reestruturacao'] = df['soma_ativo_problematico'] - df['soma_carteira_inadimplida_arrastada']
+    period = pd.Period(period, freq='M') if period is not None else DEFAULT_PERIOD
+    title_label, short_label, long_label = period_labels(period)
+
+    # Filtrar apenas dados do período: todas as seções são rollups do cubo, sem groupby sobre as linhas
+    mark_section("0. filtro do período")
+    cube = (cube if cube is not None else get_cube(df)).slice(data_base=period)
     
-    # Determinar tipo de cliente
-    df['tipo_cliente'] = df['cliente'].apply(lambda x: 'PF' if 'Física' in str(x) else 'PJ')
+    if cube.cells == 0:
+        return f"Nenhum dado disponível para {long_label}."
     
-    # Preparar insights detalhados para dezembro de 2024
-    insights = "# ANÁLISE ESTRATÉGICA DE INADIMPLÊNCIA BANCÁRIA - DEZEMBRO 2024\n\n"
+    # Preparar insights detalhados para o período
+    insights = f"# ANÁLISE ESTRATÉGICA DE INADIMPLÊNCIA BANCÁRIA - {title_label}\n\n"
     
     # 1. VISÃO GERAL
-    insights += "## 1. VISÃO GERAL DO CENÁRIO DE INADIMPLÊNCIA (DEZ/2024)\n\n"
+    mark_section("1. visão geral")
+    insights += f"## 1. VISÃO GERAL DO CENÁRIO DE INADIMPLÊNCIA ({short_label})\n\n"
     
-    total_inadimplencia = df['soma_carteira_inadimplida_arrastada'].sum()
-    total_ativo_problematico = df['soma_ativo_problematico'].sum()
-    total_carteira = df['soma_carteira_ativa'].sum()
+    total = cube.total()
+    total_inadimplencia = total['soma_carteira_inadimplida_arrastada']
+    total_ativo_problematico = total['soma_ativo_problematico']
+    total_carteira = total['soma_carteira_ativa']
     taxa_global = (total_inadimplencia / total_carteira * 100) if total_carteira > 0 else 0
     
     insights += f"- **Carteira Total**: R$ {total_carteira:,.2f}\n"
     insights += f"- **Total Inadimplido**: R$ {total_inadimplencia:,.2f} ({taxa_global:.2f}% da carteira total)\n"
     insights += f"- **Ativos Problemáticos**: R$ {total_ativo_problematico:,.2f}\n"
-    insights += f"- **Total de Operações**: {df['soma_numero_de_operacoes'].sum():,.0f}\n"
+    insights += f"- **Total de Operações**: {total['soma_numero_de_operacoes']:,.0f}\n"
     
     # 2. ANÁLISE REGIONAL
-    insights += "\n## 2. PANORAMA REGIONAL DE INADIMPLÊNCIA (DEZ/2024)\n\n"
+    mark_section("2. regional")
+    insights += f"\n## 2. PANORAMA REGIONAL DE INADIMPLÊNCIA ({short_label})\n\n"
     
-    region_summary = df.groupby('regiao').agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_numero_de_operacoes': 'sum'
-    }).reset_index()
+    region_summary = cube.rollup('regiao')
     
     region_summary['percentual_inadimplencia'] = region_summary['soma_carteira_inadimplida_arrastada'] / total_inadimplencia * 100
     region_summary['taxa_inadimplencia'] = region_summary['soma_carteira_inadimplida_arrastada'] / region_summary['soma_carteira_ativa'] * 100
@@ -86,12 +94,10 @@ def generate_advanced_insights(df):
         insights += f"- **Número de Operações**: {row['soma_numero_de_operacoes']:,.0f}\n\n"
     
     # 3. ANÁLISE POR ESTADO
-    insights += "\n## 3. ESTADOS COM MAIOR ÍNDICE DE INADIMPLÊNCIA (DEZ/2024)\n\n"
+    mark_section("3. estados")
+    insights += f"\n## 3. ESTADOS COM MAIOR ÍNDICE DE INADIMPLÊNCIA ({short_label})\n\n"
     
-    state_summary = df.groupby('uf').agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum'
-    }).reset_index()
+    state_summary = cube.rollup('uf')
     
     state_summary['percentual_total'] = state_summary['soma_carteira_inadimplida_arrastada'] / total_inadimplencia * 100
     state_summary['taxa_inadimplencia'] = state_summary['soma_carteira_inadimplida_arrastada'] / state_summary['soma_carteira_ativa'] * 100
@@ -107,13 +113,10 @@ def generate_advanced_insights(df):
         insights += f"(R$ {row['soma_carteira_inadimplida_arrastada']:,.2f})\n"
     
     # 4. ANÁLISE SETORIAL (CNAE)
-    insights += "\n## 4. SETORES ECONÔMICOS E INADIMPLÊNCIA (DEZ/2024)\n\n"
+    mark_section("4. setores cnae")
+    insights += f"\n## 4. SETORES ECONÔMICOS E INADIMPLÊNCIA ({short_label})\n\n"
     
-    cnae_summary = df.groupby('cnae_secao').agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_numero_de_operacoes': 'sum'
-    }).reset_index()
+    cnae_summary = cube.rollup('cnae_secao')
     
     cnae_summary['percentual_total'] = cnae_summary['soma_carteira_inadimplida_arrastada'] / total_inadimplencia * 100
     cnae_summary['taxa_inadimplencia'] = cnae_summary['soma_carteira_inadimplida_arrastada'] / cnae_summary['soma_carteira_ativa'] * 100
@@ -128,17 +131,11 @@ def generate_advanced_insights(df):
         insights += f"- **{row['cnae_secao']}**: {row['taxa_inadimplencia']:.2f}% "
         insights += f"(R$ {row['soma_carteira_inadimplida_arrastada']:,.2f})\n"
     
-    # 5. COMPARATIVO PESSOA FÍSICA VS PESSOA JURÍDICA (DEZ/2024)
-    insights += "\n## 5. COMPARATIVO PESSOA FÍSICA VS PESSOA JURÍDICA (DEZ/2024)\n\n"
+    # 5. COMPARATIVO PESSOA FÍSICA VS PESSOA JURÍDICA
+    mark_section("5. pf vs pj")
+    insights += f"\n## 5. COMPARATIVO PESSOA FÍSICA VS PESSOA JURÍDICA ({short_label})\n\n"
     
-    client_type_summary = df.groupby('tipo_cliente').agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_numero_de_operacoes': 'sum',
-        'soma_ativo_problematico': 'sum',
-        'soma_a_vencer_ate_90_dias': 'sum',
-        'projecao_inadimplencia_90d': 'sum'
-    }).reset_index()
+    client_type_summary = cube.rollup('tipo_cliente')
     
     client_type_summary['taxa_inadimplencia'] = (client_type_summary['soma_carteira_inadimplida_arrastada'] / client_type_summary['soma_carteira_ativa'] * 100).fillna(0)
     client_type_summary['media_por_operacao'] = (client_type_summary['soma_carteira_inadimplida_arrastada'] / client_type_summary['soma_numero_de_operacoes']).fillna(0)
@@ -156,13 +153,9 @@ def generate_advanced_insights(df):
         insights += f"- **Projeção Inadimplência 90 Dias**: R$ {row['projecao_inadimplencia_90d']:,.2f} (Risco: {row['risco_90d_percentual']:.2f}%)\n\n"
     
     # 5.1 Distribuição por Porte
+    mark_section("5.1 porte")
     insights += "### Distribuição por Porte:\n"
-    size_summary = df.groupby(['tipo_cliente', 'porte']).agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_ativo_problematico': 'sum',
-        'soma_numero_de_operacoes': 'sum'
-    }).reset_index()
+    size_summary = cube.rollup('tipo_cliente', 'porte')
     
     size_summary['taxa_inadimplencia'] = (size_summary['soma_carteira_inadimplida_arrastada'] / size_summary['soma_carteira_ativa'] * 100).fillna(0)
     size_summary['indice_problematico'] = (size_summary['soma_ativo_problematico'] / size_summary['soma_carteira_ativa'] * 100).fillna(0)
@@ -175,12 +168,9 @@ def generate_advanced_insights(df):
         insights += "\n"
     
     # 5.2 Modalidades de Crédito por Tipo de Cliente
+    mark_section("5.2 modalidades por tipo")
     insights += "### Modalidades de Crédito com Maior Inadimplência:\n"
-    modality_summary_client = df.groupby(['tipo_cliente', 'modalidade']).agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_numero_de_operacoes': 'sum'
-    }).reset_index()
+    modality_summary_client = cube.rollup('tipo_cliente', 'modalidade')
     
     modality_summary_client['taxa_inadimplencia'] = (modality_summary_client['soma_carteira_inadimplida_arrastada'] / modality_summary_client['soma_carteira_ativa'] * 100).fillna(0)
     modality_summary_client['percentual_inadimplencia'] = (modality_summary_client['soma_carteira_inadimplida_arrastada'] / total_inadimplencia * 100).fillna(0)
@@ -198,13 +188,10 @@ def generate_advanced_insights(df):
         insights += "\n"
     
     # 6. ANÁLISE POR MODALIDADE GERAL
-    insights += "\n## 6. MODALIDADES DE CRÉDITO E INADIMPLÊNCIA (DEZ/2024)\n\n"
+    mark_section("6. modalidades")
+    insights += f"\n## 6. MODALIDADES DE CRÉDITO E INADIMPLÊNCIA ({short_label})\n\n"
     
-    modality_summary = df.groupby('modalidade').agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_numero_de_operacoes': 'sum'
-    }).reset_index()
+    modality_summary = cube.rollup('modalidade')
     
     modality_summary['taxa_inadimplencia'] = modality_summary['soma_carteira_inadimplida_arrastada'] / modality_summary['soma_carteira_ativa'] * 100
     modality_summary['percentual_total'] = modality_summary['soma_carteira_inadimplida_arrastada'] / total_inadimplencia * 100
@@ -220,13 +207,10 @@ def generate_advanced_insights(df):
         insights += f"(R$ {row['soma_carteira_inadimplida_arrastada']:,.2f})\n"
     
     # 7. ANÁLISE POR OCUPAÇÃO (PF)
-    insights += "\n## 7. INADIMPLÊNCIA POR OCUPAÇÃO - PESSOA FÍSICA (DEZ/2024)\n\n"
+    mark_section("7. ocupações")
+    insights += f"\n## 7. INADIMPLÊNCIA POR OCUPAÇÃO - PESSOA FÍSICA ({short_label})\n\n"
     
-    occupation_summary = df[df['tipo_cliente'] == 'PF'].groupby('ocupacao').agg({
-        'soma_carteira_inadimplida_arrastada': 'sum',
-        'soma_carteira_ativa': 'sum',
-        'soma_numero_de_operacoes': 'sum'
-    }).reset_index()
+    occupation_summary = cube.slice(tipo_cliente='PF').rollup('ocupacao')
     
     occupation_summary['taxa_inadimplencia'] = occupation_summary['soma_carteira_inadimplida_arrastada'] / occupation_summary['soma_carteira_ativa'] * 100
     occupation_summary['media_por_operacao'] = occupation_summary['soma_carteira_inadimplida_arrastada'] / occupation_summary['soma_numero_de_operacoes']
@@ -243,13 +227,10 @@ def generate_advanced_insights(df):
         insights += f"(Volume: R$ {row['soma_carteira_inadimplida_arrastada']:,.2f})\n"
     
     # 8. PROJEÇÕES E RISCO FUTURO
-    insights += "\n## 8. PROJEÇÃO DE INADIMPLÊNCIA EM 90 DIAS (DEZ/2024)\n\n"
+    mark_section("8. projeção 90d")
+    insights += f"\n## 8. PROJEÇÃO DE INADIMPLÊNCIA EM 90 DIAS ({short_label})\n\n"
     
-    projection_summary = df.groupby(['tipo_cliente', 'porte']).agg({
-        'projecao_inadimplencia_90d': 'sum',
-        'soma_a_vencer_ate_90_dias': 'sum',
-        'soma_carteira_inadimplida_arrastada': 'sum'
-    }).reset_index()
+    projection_summary = cube.rollup('tipo_cliente', 'porte')
     
     projection_summary['risco_percentual'] = projection_summary['projecao_inadimplencia_90d'] / projection_summary['soma_a_vencer_ate_90_dias'] * 100
     projection_summary['aumento_previsto'] = projection_summary['projecao_inadimplencia_90d'] / projection_summary['soma_carteira_inadimplida_arrastada'] * 100
@@ -259,14 +240,26 @@ def generate_advanced_insights(df):
         insights += f"- **{row['tipo_cliente']} - {row['porte']}**: R$ {row['projecao_inadimplencia_90d']:,.2f} "
         insights += f"(Risco: {row['risco_percentual']:.2f}%, Aumento Previsto: {row['aumento_previsto']:.2f}%)\n"
     
+    # 8.1 Previsão pelos modelos de séries temporais por segmento
+    if forecasts is not None and not forecasts.empty:
+        from forecast import summarize_forecasts
+
+        horizon = sum(column.startswith("previsao_m") for column in forecasts.columns)
+        insights += f"\n### Previsão por Modelo de Séries Temporais ({horizon} meses a partir de {forecasts['mes_base'].iloc[0]}):\n"
+        for _, row in summarize_forecasts(forecasts, ['tipo_cliente', 'porte']).sort_values('previsao', ascending=False).head(8).iterrows():
+            insights += f"- **{row['tipo_cliente']} - {row['porte']}**: R$ {row['inadimplida']:,.2f} -> R$ {row['previsao']:,.2f} "
+            insights += f"(Variação: {row['variacao_pct']:+.2f}%, Taxa Prevista: {row['taxa_prevista']:.2f}%)\n"
+        insights += "\n### Segmentos com Maior Aumento Previsto:\n"
+        growth = forecasts.assign(variacao=forecasts['previsao'] - forecasts['inadimplida'])
+        for _, row in growth.nlargest(5, 'variacao').iterrows():
+            insights += f"- **{row['uf']} / {row['modalidade']} / {row['porte']}**: R$ {row['inadimplida']:,.2f} -> R$ {row['previsao']:,.2f} "
+            insights += f"(+R$ {row['variacao']:,.2f})\n"
+    
     # 9. REESTRUTURAÇÃO DE DÍVIDAS
-    insights += "\n## 9. ANÁLISE DE REESTRUTURAÇÃO DE DÍVIDAS (DEZ/2024)\n\n"
+    mark_section("9. reestruturação")
+    insights += f"\n## 9. ANÁLISE DE REESTRUTURAÇÃO DE DÍVIDAS ({short_label})\n\n"
     
-    restructuring_summary = df.groupby(['tipo_cliente', 'porte']).agg({
-        'indicador_reestruturacao': 'sum',
-        'soma_ativo_problematico': 'sum',
-        'soma_carteira_inadimplida_arrastada': 'sum'
-    }).reset_index()
+    restructuring_summary = cube.rollup('tipo_cliente', 'porte')
     
     restructuring_summary['percentual_reestruturacao'] = restructuring_summary['indicador_reestruturacao'] / restructuring_summary['soma_ativo_problematico'] * 100
     
@@ -277,7 +270,8 @@ def generate_advanced_insights(df):
             insights += f"({row['percentual_reestruturacao']:.2f}% dos ativos problemáticos)\n"
     
     # 10. RECOMENDAÇÕES ESTRATÉGICAS
-    insights += "\n## 10. RECOMENDAÇÕES ESTRATÉGICAS (DEZ/2024)\n\n"
+    mark_section("10. recomendações")
+    insights += f"\n## 10. RECOMENDAÇÕES ESTRATÉGICAS ({short_label})\n\n"
     
     insights += "### Ações Recomendadas por Segmento de Risco:\n"
     
@@ -296,9 +290,17 @@ def generate_advanced_insights(df):
     for _, row in top_modality_risk.iterrows():
         insights += f"- **{row['modalidade']}**: Revisar critérios de aprovação e limites de crédito\n"
     
+    # Alertas precoces: segmentos com salto anormal em relação ao próprio histórico
+    if alerts is not None and not alerts.empty:
+        from early_warning import format_alerts
+
+        insights += f"\n#### Alertas Precoces ({alerts['mes'].iloc[0]}):\n"
+        insights += "\n".join(format_alerts(alerts)) + "\n"
+    
     # Conclusão
-    insights += "\n## CONCLUSÃO EXECUTIVA (DEZ/2024)\n\n"
-    insights += f"- A taxa global de inadimplência em dezembro de 2024 está em **{taxa_global:.2f}%** da carteira total\n"
+    mark_section("conclusão")
+    insights += f"\n## CONCLUSÃO EXECUTIVA ({short_label})\n\n"
+    insights += f"- A taxa global de inadimplência em {long_label} está em **{taxa_global:.2f}%** da carteira total\n"
     insights += "- Aproximadamente **{:.2f}%** do volume inadimplido está concentrado na região {}\n".format(
         region_summary.iloc[0]['percentual_inadimplencia'], 
         region_summary.iloc[0]['regiao']
@@ -319,6 +321,9 @@ def generate_advanced_insights(df):
     insights += "1. Revisar políticas de crédito para os setores e modalidades de maior risco\n"
     insights += "2. Monitorar de perto as regiões com altas taxas de inadimplência\n"
     insights += "3. Avaliar estratégias de reestruturação para os segmentos com ativos problemáticos elevados\n"
-    insights += "4. Implementar alertas precoces baseados nas projeções de 90 dias\n"
+    if alerts is not None and not alerts.empty:
+        insights += f"4. Investigar os {len(alerts)} segmentos em alerta precoce, começando por {alerts.iloc[0]['uf']} / {alerts.iloc[0]['modalidade']}\n"
+    else:
+        insights += "4. Implementar alertas precoces baseados nas projeções de 90 dias\n"
     
     return insights
\ No newline at end of file
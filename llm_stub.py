@@ -0,0 +1,81 @@
+# Respostas roteirizadas para substituir o LLM em benchmarks e testes de carga
+#
+# Reconhece os prompts usados em pipeline.py (classificação de intenção e geração de SQL)
+# e devolve respostas determinísticas; qualquer outro prompt recebe uma resposta textual fixa.
+import re
+from langchain_core.messages import AIMessage
+from langchain_core.runnables import RunnableLambda
+
+TABLE_NAME = "table_agg_inad_consolidado"
+
+CANNED_SQL = {
+    "COMPARAÇÃO": (
+        f"SELECT cliente, SUM(soma_carteira_inadimplida_arrastada) AS inadimplencia, "
+        f"SUM(soma_carteira_ativa) AS carteira FROM {TABLE_NAME} "
+        f"WHERE data_base = '31/12/2024' GROUP BY cliente"
+    ),
+    "RANKING": (
+        f"SELECT uf, SUM(soma_carteira_inadimplida_arrastada) AS inadimplencia FROM {TABLE_NAME} "
+        f"WHERE data_base = '31/12/2024' GROUP BY uf ORDER BY inadimplencia DESC LIMIT 5"
+    ),
+    "ESPECÍFICO": (
+        f"SELECT SUM(soma_carteira_inadimplida_arrastada) AS inadimplencia, SUM(soma_carteira_ativa) AS carteira "
+        f"FROM {TABLE_NAME} WHERE data_base = '31/12/2024' AND uf = 'SP'"
+    ),
+    "TENDÊNCIA": (
+        f"SELECT data_base, SUM(soma_carteira_inadimplida_arrastada) AS inadimplencia FROM {TABLE_NAME} "
+        f"GROUP BY data_base ORDER BY data_base"
+    ),
+    "PREVISÃO": (
+        f"SELECT data_base, SUM(soma_carteira_inadimplida_arrastada) AS inadimplencia FROM {TABLE_NAME} "
+        f"GROUP BY data_base ORDER BY data_base"
+    ),
+    "GERAL": f"SELECT SUM(soma_carteira_inadimplida_arrastada) AS inadimplencia FROM {TABLE_NAME}"
+}
+
+ANSWER_TEXT = (
+    "Com base nos dados de dezembro de 2024, a inadimplência total é de R$ 1.234.567,89, "
+    "concentrada principalmente na região Sudeste e nas modalidades de cartão de crédito. "
+    "Recomenda-se acompanhar a evolução mensal e os segmentos com maior taxa de inadimplência."
+)
+
+def classify_locally(question):
+    """
+    Classificação por palavras-chave equivalente às categorias numéricas do prompt de intenção
+    """
+    text = question.lower()
+    if re.search(r"\bcompar|\bversus\b|\bvs\b|\bentre\b", text):
+        return "1"
+    if re.search(r"\bmaior|\bmenor|\btop\b|\bprincipa|\branking|\bmais\b|\bmenos\b", text):
+        return "2"
+    if re.search(r"previs|proje[cç]|futur|pr[oó]xim[oa]s? (meses|trimestre|ano)", text):
+        return "6"
+    if re.search(r"evolu|tend[eê]ncia|ao longo|hist[oó]ric|cresc", text):
+        return "4"
+    if re.search(r"\bvalor|\bquanto|\bem [A-Z]{2}\b|\bs[aã]o paulo|\brio de janeiro", question, flags=re.IGNORECASE):
+        return "3"
+    return "5"
+
+def scripted_response(system_text, user_text, answer_text=ANSWER_TEXT):
+    """
+    Escolhe a resposta roteirizada a partir do texto do prompt de sistema e da pergunta
+    """
+    if "classifique a intenção" in system_text:
+        return classify_locally(user_text)
+    if "especialista em SQL" in system_text:
+        match = re.search(r"classificada como: ([A-ZÇÃÊÍ]+)", system_text)
+        intent = match.group(1) if match else "GERAL"
+        return CANNED_SQL.get(intent, CANNED_SQL["GERAL"])
+    return answer_text
+
+def _respond(prompt_value):
+    messages = prompt_value.to_messages() if hasattr(prompt_value, "to_messages") else [prompt_value]
+    system_text = "\n".join(m.content for m in messages if getattr(m, "type", "") == "system")
+    user_text = messages[-1].content if messages else ""
+    return AIMessage(content=scripted_response(system_text, user_text))
+
+def get_stub_llm():
+    """
+    LLM local compatível com `prompt | llm` que responde sem chamadas de rede
+    """
+    return RunnableLambda(_respond)
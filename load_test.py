@@ -0,0 +1,190 @@
+# Teste de carga com N sessões simultâneas do chatbot
+#
+# Cada sessão reproduz o que uma aba do Streamlit faz: carrega o DataFrame próprio (como
+# st.session_state.df), gera os insights e envia uma sequência de perguntas pelo pipeline.
+# Usa um banco local (ex.: SQLite gerado por synthetic_data.py) e o LLM local de mock_llm_server.py.
+#
+# Uso:
+#   python synthetic_data.py 1000000 --sqlite local.db
+#   python mock_llm_server.py --perfil deepseek &
+#   LLM_BASE_URL=http://127.0.0.1:8008 python load_test.py --db-url sqlite:///local.db --sessoes 20
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import psutil
+from sqlalchemy import create_engine
+from insights import generate_advanced_insights
+from pipeline import get_llm_client, load_data, answer_question
+
+# Mistura de perguntas por peso: RANKING é a intenção mais comum no uso real
+QUESTION_MIX = [
+    ("Qual estado com maior inadimplência e quais os valores devidos?", 5),
+    ("Em qual modalidade existe maior inadimplência?", 4),
+    ("Quais os 5 principais estados em taxa de inadimplência?", 3),
+    ("Compare a inadimplência entre PF e PJ", 3),
+    ("Qual ocupação entre PF possui maior inadimplência?", 2),
+    ("Qual o principal porte de cliente com inadimplência entre PF?", 2),
+    ("Qual o valor de inadimplência em São Paulo?", 2),
+    ("Como evoluiu a inadimplência ao longo de 2024?", 2),
+    ("Qual a previsão de inadimplência para os próximos meses?", 1),
+    ("Quais são os principais riscos de inadimplência no Brasil?", 1)
+]
+
+STAGES = ["connect", "load", "insights", "classify", "structured", "timeseries", "forecast", "period_insights", "sql_gen", "execute", "sql_repair", "answer", "total"]
+
+class StageRecorder:
+    """
+    Acumula latências por etapa de todas as sessões (thread-safe)
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {stage: [] for stage in STAGES}
+        self.errors = 0
+
+    def add(self, stage, seconds):
+        with self.lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    def add_error(self):
+        with self.lock:
+            self.errors += 1
+
+    def summary(self):
+        rows = {}
+        for stage, values in self.samples.items():
+            if not values:
+                continue
+            arr = np.array(values) * 1000
+            rows[stage] = {
+                "n": len(values),
+                "p50_ms": float(np.percentile(arr, 50)),
+                "p95_ms": float(np.percentile(arr, 95)),
+                "p99_ms": float(np.percentile(arr, 99)),
+                "max_ms": float(arr.max())
+            }
+        return rows
+
+def run_session(session_id, db_url, llm, questions_per_session, think_time, recorder, shared_df=None):
+    """
+    Simula uma sessão: conexão, carga própria dos dados, insights e perguntas em sequência
+    """
+    rng = random.Random(session_id)
+    questions = [q for q, _ in QUESTION_MIX]
+    weights = [w for _, w in QUESTION_MIX]
+
+    start = time.perf_counter()
+    engine = create_engine(db_url)
+    with engine.connect():
+        pass
+    recorder.add("connect", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    df = shared_df if shared_df is not None else load_data(engine)
+    recorder.add("load", time.perf_counter() - start)
+
+    start = time.perf_counter()
+    insights = generate_advanced_insights(df)
+    recorder.add("insights", time.perf_counter() - start)
+
+    answered = 0
+    for _ in range(questions_per_session):
+        question = rng.choices(questions, weights=weights)[0]
+        try:
+            result = answer_question(question, llm, df, insights, engine=engine, session_id=f"carga-{session_id}")
+            for stage, seconds in result["timings"].items():
+                recorder.add(stage, seconds)
+            answered += 1
+        except Exception as e:
+            print(f"[sessão {session_id}] erro: {e}")
+            recorder.add_error()
+        if think_time:
+            time.sleep(rng.uniform(0, 2 * think_time))
+
+    engine.dispose()
+    # Mantém o DataFrame vivo até o fim do teste, como st.session_state mantém por sessão
+    return answered, df
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga com sessões simultâneas do chatbot")
+    parser.add_argument("--db-url", required=True, help="URL SQLAlchemy do banco local (ex.: sqlite:///local.db)")
+    parser.add_argument("--sessoes", type=int, default=10, help="Número de sessões simultâneas")
+    parser.add_argument("--perguntas", type=int, default=5, help="Perguntas por sessão")
+    parser.add_argument("--pausa", type=float, default=1.0, help="Tempo médio de reflexão entre perguntas (s)")
+    parser.add_argument("--rampa", type=float, default=5.0, help="Segundos para iniciar todas as sessões")
+    parser.add_argument("--df-compartilhado", action="store_true",
+                        help="Carrega os dados uma vez e compartilha entre sessões (como o snapshot Arrow)")
+    parser.add_argument("--saida", help="Arquivo JSON com o relatório")
+    args = parser.parse_args()
+
+    process = psutil.Process()
+    llm = get_llm_client()
+    recorder = StageRecorder()
+
+    shared_df = None
+    if args.df_compartilhado:
+        engine = create_engine(args.db_url)
+        shared_df = load_data(engine)
+        engine.dispose()
+
+    rss_start = process.memory_info().rss
+    rss_peak = rss_start
+    stop_sampling = threading.Event()
+
+    def sample_rss():
+        nonlocal rss_peak
+        while not stop_sampling.is_set():
+            rss_peak = max(rss_peak, process.memory_info().rss)
+            stop_sampling.wait(0.2)
+
+    sampler = threading.Thread(target=sample_rss, daemon=True)
+    sampler.start()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.sessoes) as executor:
+        futures = []
+        for session_id in range(args.sessoes):
+            futures.append(executor.submit(
+                run_session, session_id, args.db_url, llm, args.perguntas, args.pausa, recorder, shared_df
+            ))
+            if args.rampa and args.sessoes > 1:
+                time.sleep(args.rampa / (args.sessoes - 1))
+        results = [f.result() for f in futures]
+    elapsed = time.perf_counter() - start
+
+    rss_end = process.memory_info().rss
+    stop_sampling.set()
+    sampler.join()
+
+    answered = sum(r[0] for r in results)
+    report = {
+        "sessoes": args.sessoes,
+        "perguntas_respondidas": answered,
+        "erros": recorder.errors,
+        "duracao_s": elapsed,
+        "vazao_perguntas_s": answered / elapsed if elapsed else 0.0,
+        "rss_inicial_mb": rss_start / 1e6,
+        "rss_final_mb": rss_end / 1e6,
+        "rss_pico_mb": rss_peak / 1e6,
+        "rss_por_sessao_mb": (rss_end - rss_start) / 1e6 / args.sessoes,
+        "etapas": recorder.summary()
+    }
+    del results
+
+    print(f"\nSessões: {args.sessoes} | perguntas: {answered} | erros: {recorder.errors} | duração: {elapsed:.1f}s")
+    print(f"Vazão: {report['vazao_perguntas_s']:.2f} perguntas/s")
+    print(f"RSS: {report['rss_inicial_mb']:.0f} MB -> {report['rss_final_mb']:.0f} MB "
+          f"(pico {report['rss_pico_mb']:.0f} MB, {report['rss_por_sessao_mb']:.1f} MB/sessão)")
+    print(pd.DataFrame(report["etapas"]).T.round(1).to_string())
+
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"Relatório gravado em {args.saida}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# Servidor local compatível com a API de chat completions da OpenAI/DeepSeek
+#
+# Substitui https://api.deepseek.com em benchmarks e testes de carga. O chatbot passa a usá-lo
+# definindo LLM_BASE_URL (lido por get_llm_client em pipeline.py):
+#
+#   python mock_llm_server.py --perfil deepseek --porta 8008
+#   LLM_BASE_URL=http://127.0.0.1:8008 streamlit run chatbot.py
+#
+# Os perfis controlam tempo até o primeiro token, tokens por segundo e taxa de erros; as
+# respostas para os prompts de intenção e SQL vêm de llm_stub.py ou de um arquivo de roteiro.
+import argparse
+import asyncio
+import json
+import random
+import re
+import time
+import uuid
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from llm_stub import scripted_response
+
+# ttft: segundos até o primeiro token | tps: tokens por segundo | erro: fração de requisições com falha
+PROFILES = {
+    "instantaneo": {"ttft": 0.0, "tps": 0, "erro": 0.0, "jitter": 0.0},
+    "rapido": {"ttft": 0.05, "tps": 300, "erro": 0.0, "jitter": 0.1},
+    "deepseek": {"ttft": 0.8, "tps": 35, "erro": 0.01, "jitter": 0.3},
+    "instavel": {"ttft": 2.0, "tps": 15, "erro": 0.10, "jitter": 0.5}
+}
+
+config = {"perfil": dict(PROFILES["rapido"]), "roteiro": []}
+
+app = FastAPI(title="Mock LLM Inadimplinha")
+
+def _tokenize(text):
+    # Aproximação de tokens: palavras com o espaço seguinte, suficiente para simular o streaming
+    return re.findall(r"\S+\s*", text) or [text]
+
+def _estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+def _delay(base):
+    jitter = config["perfil"]["jitter"]
+    return max(0.0, base * (1 + random.uniform(-jitter, jitter)))
+
+def _pick_response(messages):
+    system_text = "\n".join(m.get("content") or "" for m in messages if m.get("role") == "system")
+    user_text = next((m.get("content") or "" for m in reversed(messages) if m.get("role") == "user"), "")
+    full_text = system_text + "\n" + user_text
+    # Regras do arquivo de roteiro têm prioridade sobre as respostas padrão
+    for rule in config["roteiro"]:
+        if re.search(rule["padrao"], full_text, flags=re.IGNORECASE):
+            return rule["resposta"]
+    return scripted_response(system_text, user_text)
+
+def _error_response():
+    status = random.choice([429, 500, 503])
+    return JSONResponse(
+        status_code=status,
+        content={"error": {"message": f"Erro simulado ({status})", "type": "mock_error", "code": status}}
+    )
+
+def _usage(prompt_text, completion_text):
+    prompt_tokens = _estimate_tokens(prompt_text)
+    completion_tokens = _estimate_tokens(completion_text)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+
+@app.get("/models")
+@app.get("/v1/models")
+async def list_models():
+    return {"object": "list", "data": [{"id": "deepseek-chat", "object": "model", "owned_by": "mock"}]}
+
+@app.post("/chat/completions")
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "deepseek-chat")
+    profile = config["perfil"]
+
+    if random.random() < profile["erro"]:
+        await asyncio.sleep(_delay(profile["ttft"]))
+        return _error_response()
+
+    content = _pick_response(messages)
+    tokens = _tokenize(content)
+    prompt_text = "".join(m.get("content") or "" for m in messages)
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    token_interval = 1.0 / profile["tps"] if profile["tps"] else 0.0
+
+    if not body.get("stream"):
+        await asyncio.sleep(_delay(profile["ttft"]) + token_interval * len(tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": _usage(prompt_text, content)
+        }
+
+    include_usage = (body.get("stream_options") or {}).get("include_usage", False)
+
+    def chunk(delta, finish_reason=None):
+        return {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+        }
+
+    async def event_stream():
+        await asyncio.sleep(_delay(profile["ttft"]))
+        yield f"data: {json.dumps(chunk({'role': 'assistant', 'content': ''}))}\n\n"
+        for token in tokens:
+            yield f"data: {json.dumps(chunk({'content': token}), ensure_ascii=False)}\n\n"
+            if token_interval:
+                await asyncio.sleep(_delay(token_interval))
+        yield f"data: {json.dumps(chunk({}, 'stop'))}\n\n"
+        if include_usage:
+            usage_chunk = chunk({})
+            usage_chunk["choices"] = []
+            usage_chunk["usage"] = _usage(prompt_text, content)
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+def load_script(path):
+    """
+    Carrega um roteiro JSON: lista de {"padrao": regex, "resposta": texto}, avaliadas em ordem
+    """
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Servidor LLM local compatível com chat completions")
+    parser.add_argument("--perfil", choices=list(PROFILES), default="rapido")
+    parser.add_argument("--ttft", type=float, help="Segundos até o primeiro token (sobrepõe o perfil)")
+    parser.add_argument("--tps", type=float, help="Tokens por segundo (0 = sem atraso entre tokens)")
+    parser.add_argument("--erro", type=float, help="Fração de requisições que falham com 429/500/503")
+    parser.add_argument("--roteiro", help="Arquivo JSON com respostas roteirizadas")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--porta", type=int, default=8008)
+    args = parser.parse_args()
+
+    config["perfil"] = dict(PROFILES[args.perfil])
+    for key in ("ttft", "tps", "erro"):
+        if getattr(args, key) is not None:
+            config["perfil"][key] = getattr(args, key)
+    if args.roteiro:
+        config["roteiro"] = load_script(args.roteiro)
+
+    print(f"Mock LLM em http://{args.host}:{args.porta} com perfil {config['perfil']}")
+    uvicorn.run(app, host=args.host, port=args.porta, log_level="warning")
@@ -0,0 +1,293 @@
+# Insights de vários períodos gerados em uma única execução, em paralelo, com artefatos por período
+#
+# O histórico é agregado uma única vez no cubo (cube.py); cada processo do pool recebe só a fatia do
+# cubo de um mês, bem menor que as linhas, e gera o texto de generate_advanced_insights e o resumo
+# por dimensão daquele mês com rollups. Cada período vira um arquivo JSON em
+# INSIGHTS_DIR/<snapshot>/AAAA-MM.json, lido pelo chatbot nas perguntas que comparam períodos
+# ("compare com o ano passado") sem recalcular nada.
+#
+# Variáveis de ambiente:
+#   INSIGHTS_DIR=.insights   diretório dos artefatos
+#   INSIGHTS_WORKERS=n       processos do pool (padrão: núcleos da máquina)
+#
+# Uso:
+#   python period_insights.py                          (todos os meses do snapshot atual)
+#   python period_insights.py --inicio 2023-01 --fim 2024-12 --workers 4
+#   python period_insights.py --listar
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import pandas as pd
+from dotenv import load_dotenv
+from cube import get_cube
+from insights import MONTH_NAMES, generate_advanced_insights
+from timeseries import normalize_text, match_values
+from tracing import span
+
+load_dotenv()
+
+INSIGHTS_DIR = os.getenv("INSIGHTS_DIR", ".insights")
+INSIGHTS_WORKERS = int(os.getenv("INSIGHTS_WORKERS", "0")) or os.cpu_count() or 1
+
+SUMMARY_DIMENSIONS = ["regiao", "uf", "tipo_cliente", "porte", "modalidade", "cnae_secao", "ocupacao"]
+SUMMARY_COLUMNS = {
+    "inadimplida": "soma_carteira_inadimplida_arrastada",
+    "carteira_ativa": "soma_carteira_ativa",
+    "ativo_problematico": "soma_ativo_problematico",
+    "operacoes": "soma_numero_de_operacoes",
+    "projecao_90d": "projecao_inadimplencia_90d"
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def summarize_period(cube):
+    """
+    Somas do mês no total e por dimensão, com a taxa de inadimplência
+
+    Params:
+        cube: fatia do cubo com um único mês
+
+    Returns:
+        Dicionário {"total": {medida: valor}, dimensão: {valor: {medida: valor}}}
+    """
+    def records(frame, dimension=None):
+        frame = frame.rename(columns={v: k for k, v in SUMMARY_COLUMNS.items()})
+        frame.index = frame[dimension].astype(str) if dimension else ["total"]
+        frame = frame[list(SUMMARY_COLUMNS) + ["taxa_inadimplencia"]]
+        # NaN vira None para o JSON
+        return {
+            index: {measure: None if pd.isna(value) else float(value) for measure, value in row.items()}
+            for index, row in frame.to_dict(orient="index").items()
+        }
+
+    summary = {"total": records(cube.rollup())["total"]}
+    for dimension in SUMMARY_DIMENSIONS:
+        summary[dimension] = records(cube.rollup(dimension), dimension)
+    return summary
+
+def _build_period(period, cube):
+    """
+    Insights e resumo de um mês (executado nos processos do pool)
+    """
+    start = time.perf_counter()
+    return {
+        "periodo": period,
+        "linhas": int(cube.total()["linhas"]),
+        "insights": generate_advanced_insights(None, period=period, cube=cube),
+        "resumo": summarize_period(cube),
+        "duracao_s": time.perf_counter() - start
+    }
+
+def artifacts_key(df):
+    """
+    Subdiretório dos artefatos: o snapshot do DataFrame ou "atual" para dados lidos do banco
+    """
+    return df.attrs.get("snapshot_id") or "atual"
+
+def _write_artifact(artifact, directory):
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{artifact['periodo']}.json")
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(artifact, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+def build_period_insights(df, start=None, end=None, workers=INSIGHTS_WORKERS, directory=INSIGHTS_DIR):
+    """
+    Gera os insights de todos os meses disponíveis (ou do intervalo pedido) e grava um artefato por mês
+
+    Params:
+        df: DataFrame com os dados consolidados (todo o histórico de data_base)
+        start, end: primeiro e último mês (AAAA-MM), inclusivos (opcionais)
+        workers: processos do pool (1 gera no próprio processo)
+        directory: diretório base dos artefatos
+
+    Returns:
+        Dicionário {AAAA-MM: artefato}
+    """
+    target = os.path.join(directory, artifacts_key(df))
+    with span("build_period_insights", **{"insights.workers": workers}) as s:
+        # Pré-processamento compartilhado: o cubo agrega o histórico completo em uma única passada
+        cube = get_cube(df)
+        start = pd.Period(start, freq="M") if start else None
+        end = pd.Period(end, freq="M") if end else None
+        partitions = [
+            (str(period), cube.slice(data_base=period)) for period in cube.labels["data_base"]
+            if not pd.isna(period) and (start is None or period >= start) and (end is None or period <= end)
+        ]
+        s.set_attribute("insights.periodos", len(partitions))
+        if not partitions:
+            raise ValueError("Nenhum período disponível no intervalo pedido")
+
+        artifacts = {}
+        if workers > 1 and len(partitions) > 1:
+            # spawn: o processo pai pode ter threads (Streamlit, uvicorn), que não sobrevivem a um fork
+            context = multiprocessing.get_context("spawn")
+            with ProcessPoolExecutor(max_workers=min(workers, len(partitions)), mp_context=context) as executor:
+                futures = [executor.submit(_build_period, period, partition) for period, partition in partitions]
+                for future in as_completed(futures):
+                    artifact = future.result()
+                    _write_artifact(artifact, target)
+                    artifacts[artifact["periodo"]] = artifact
+        else:
+            for period, partition in partitions:
+                artifact = _build_period(period, partition)
+                _write_artifact(artifact, target)
+                artifacts[period] = artifact
+
+    with _cache_lock:
+        _cache.pop(target, None)
+    return dict(sorted(artifacts.items()))
+
+def load_period_artifacts(key, directory=INSIGHTS_DIR):
+    """
+    Artefatos gravados para o snapshot (ou "atual"), em cache até o diretório mudar
+
+    Returns:
+        Dicionário {AAAA-MM: artefato}, vazio se nada foi gerado
+    """
+    target = os.path.join(directory, key)
+    try:
+        modified = os.stat(target).st_mtime_ns
+    except FileNotFoundError:
+        return {}
+    with _cache_lock:
+        cached = _cache.get(target)
+        if cached is not None and cached[0] == modified:
+            return cached[1]
+
+    artifacts = {}
+    for name in sorted(os.listdir(target)):
+        if name.endswith(".json"):
+            with open(os.path.join(target, name), encoding="utf-8") as f:
+                artifact = json.load(f)
+            artifacts[artifact["periodo"]] = artifact
+    with _cache_lock:
+        _cache[target] = (modified, artifacts)
+    return artifacts
+
+def is_period_comparison(question):
+    """
+    Indica se a pergunta compara o mesmo recorte em dois períodos
+    """
+    text = normalize_text(question)
+    return bool(
+        re.search(r"ano (passado|anterior)|mes (passado|anterior)|mesmo (mes|periodo)|periodo anterior", text)
+        or len(set(re.findall(r"\b20\d{2}\b", text))) >= 2
+    )
+
+def _comparison_periods(question, available):
+    """
+    Par de meses (anterior, atual) comparados, a partir dos meses e anos citados na pergunta
+    """
+    text = normalize_text(question)
+    latest = pd.Period(available[-1], freq="M")
+    months = [i + 1 for i, name in enumerate(MONTH_NAMES) if re.search(rf"\b{normalize_text(name)}\b", text)]
+    years = sorted({int(y) for y in re.findall(r"\b(20\d{2})\b", text)})
+    month = months[0] if months else latest.month
+
+    if len(years) >= 2:
+        return pd.Period(year=years[0], month=month, freq="M"), pd.Period(year=years[-1], month=month, freq="M")
+    current = pd.Period(year=years[0], month=month, freq="M") if years else (
+        pd.Period(year=latest.year, month=month, freq="M") if months else latest
+    )
+    if re.search(r"mes (passado|anterior)", text):
+        return current - 1, current
+    return current - 12, current
+
+def _format_change(before, after, measure):
+    if before is None or after is None:
+        return "-"
+    if measure == "taxa_inadimplencia":
+        return f"{before:.2f}% -> {after:.2f}% ({after - before:+.2f} p.p.)"
+    change = f" ({(after / before - 1) * 100:+.2f}%)" if before else ""
+    if measure == "operacoes":
+        return f"{before:,.0f} -> {after:,.0f}{change}"
+    return f"R$ {before:,.2f} -> R$ {after:,.2f}{change}"
+
+def describe_period_comparison(question, artifacts, top=8):
+    """
+    Texto comparando dois meses a partir dos artefatos, para o contexto da resposta
+
+    Returns:
+        Texto ou None se algum dos meses não tiver artefato gerado
+    """
+    if not artifacts:
+        return None
+    previous, current = _comparison_periods(question, sorted(artifacts))
+    before, after = artifacts.get(str(previous)), artifacts.get(str(current))
+    if before is None or after is None:
+        return None
+
+    candidates = {dimension: list(after["resumo"][dimension]) for dimension in SUMMARY_DIMENSIONS}
+    targets = match_values(question, candidates)
+    text = f"COMPARAÇÃO ENTRE PERÍODOS - {previous.strftime('%m/%Y')} x {current.strftime('%m/%Y')}\n"
+
+    text += "\nTotal:\n"
+    for measure in ["inadimplida", "taxa_inadimplencia", "carteira_ativa", "ativo_problematico", "operacoes"]:
+        text += f"- {measure}: {_format_change(before['resumo']['total'][measure], after['resumo']['total'][measure], measure)}\n"
+
+    for dimension, value in targets:
+        old, new = before["resumo"][dimension].get(value), after["resumo"][dimension].get(value)
+        if old is None or new is None:
+            continue
+        text += f"\n{dimension} = {value}:\n"
+        for measure in ["inadimplida", "taxa_inadimplencia", "carteira_ativa"]:
+            text += f"- {measure}: {_format_change(old[measure], new[measure], measure)}\n"
+
+    # Sem recorte citado, as dimensões mais usadas nas comparações
+    for dimension in ([] if targets else ["tipo_cliente", "regiao", "modalidade"]):
+        rows = [
+            (value, before["resumo"][dimension].get(value), values)
+            for value, values in after["resumo"][dimension].items()
+        ]
+        rows = sorted((r for r in rows if r[1] is not None), key=lambda r: -(r[2]["inadimplida"] or 0))[:top]
+        text += f"\nInadimplência por {dimension}:\n"
+        for value, old, new in rows:
+            text += f"- {value}: {_format_change(old['inadimplida'], new['inadimplida'], 'inadimplida')}, "
+            text += f"taxa {_format_change(old['taxa_inadimplencia'], new['taxa_inadimplencia'], 'taxa_inadimplencia')}\n"
+    return text
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera os insights de vários meses em paralelo e grava os artefatos por período")
+    parser.add_argument("--inicio", help="Primeiro mês (AAAA-MM)")
+    parser.add_argument("--fim", help="Último mês (AAAA-MM)")
+    parser.add_argument("--workers", type=int, default=INSIGHTS_WORKERS, help="Processos do pool")
+    parser.add_argument("--dir", default=INSIGHTS_DIR, help="Diretório dos artefatos")
+    parser.add_argument("--listar", action="store_true", help="Lista os artefatos gravados e sai")
+    args = parser.parse_args()
+
+    from snapshot import current_snapshot_id, open_snapshot
+
+    snapshot_id = current_snapshot_id()
+    if args.listar:
+        key = snapshot_id or "atual"
+        artifacts = load_period_artifacts(key, args.dir)
+        print(f"{len(artifacts)} períodos em {os.path.join(args.dir, key)}")
+        for period, artifact in artifacts.items():
+            print(f"  {period}: {artifact['linhas']:>10} linhas, gerado em {artifact['duracao_s']:.2f}s")
+        raise SystemExit(0)
+
+    if snapshot_id is None:
+        from pipeline import connect_to_db, load_data
+
+        engine = connect_to_db()
+        if engine is None:
+            raise SystemExit("Nenhum snapshot publicado e não foi possível conectar ao banco de dados.")
+        df = load_data(engine)
+        engine.dispose()
+    else:
+        df = open_snapshot(snapshot_id)
+
+    start = time.perf_counter()
+    artifacts = build_period_insights(df, args.inicio, args.fim, workers=args.workers, directory=args.dir)
+    elapsed = time.perf_counter() - start
+    serial = sum(artifact["duracao_s"] for artifact in artifacts.values())
+    print(f"{len(artifacts)} períodos gerados em {elapsed:.1f}s com {args.workers} processos "
+          f"(soma dos tempos por período: {serial:.1f}s)")
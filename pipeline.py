@@ -0,0 +1,510 @@
+import streamlit as st
+from langchain_openai import ChatOpenAI
+from langchain_core.prompts import ChatPromptTemplate
+import httpx
+import pandas as pd
+import time
+import os
+from dotenv import load_dotenv
+from sqlalchemy import create_engine
+from urllib.parse import quote_plus
+from tracing import span, traced, stream_llm
+from token_usage import TokenUsageHandler, usage_scope
+from sql_guard import run_guarded_query, SQLGuardError
+from schema_catalog import get_schema_prompt
+from sql_repair import execute_with_repair
+from rollups import route_query
+from query_log import log_question
+from timeseries import get_timeseries, describe_trend
+from forecast import FORECAST_ENABLED, get_forecasts, describe_forecast
+from period_insights import artifacts_key, load_period_artifacts, is_period_comparison, describe_period_comparison
+from structured_query import answer_structured
+from bitmap_index import query_frame
+
+load_dotenv()
+
+api_key = os.getenv("API_KEY")
+
+# LLM_BASE_URL permite apontar para o servidor local de mock_llm_server.py em testes e benchmarks
+llm_base_url = os.getenv("LLM_BASE_URL", "https://api.deepseek.com")
+llm_model = os.getenv("LLM_MODEL", "deepseek-chat")
+
+TABLE_NAME = "table_agg_inad_consolidado"
+# Intenções que tentam a consulta estruturada antes de gerar SQL
+STRUCTURED_INTENTS = ["RANKING", "COMPARAÇÃO", "ESPECÍFICO"]
+
+# Um único handler por processo registra os tokens de todas as chamadas
+token_usage_handler = TokenUsageHandler()
+
+def get_llm_client():
+    return ChatOpenAI(
+        api_key=api_key or "mock",
+        base_url=llm_base_url,
+        model=llm_model,
+        http_client=httpx.Client(verify=False),
+        stream_usage=True,
+        callbacks=[token_usage_handler]
+    )
+
+@traced("connect_to_db")
+def connect_to_db():
+    try:
+        # Verificar se está rodando no Streamlit Cloud (usando st.secrets) ou localmente (usando os.getenv)
+        if "STREAMLIT_CLOUD" in os.environ:  # Variável fictícia, ajustaremos a lógica
+            print("Rodando no Streamlit Cloud, usando st.secrets")
+            host = st.secrets["SERVER"]
+            database = st.secrets["DATABASE"]
+            username = st.secrets["USERNAME"]
+            password = st.secrets["PASSWORD"]
+            port = st.secrets["PORT"]
+        else:
+            print("Rodando localmente, usando variáveis do .env")
+            host = os.getenv("SERVER")
+            database = os.getenv("DATABASE")
+            username = os.getenv("USERNAME")
+            password = os.getenv("PASSWORD")
+            port = os.getenv("PORT")
+
+        # Validar os valores
+        if not all([host, database, username, password, port]):
+            error_msg = "Uma ou mais variáveis de conexão com o banco não estão definidas"
+            print(error_msg)
+            if hasattr(st, "error"):
+                st.error(error_msg)
+            raise ValueError(error_msg)
+
+        # Codificar a senha para lidar com caracteres especiais
+        encoded_password = quote_plus(password)
+
+        # String de conexão com senha codificada
+        connection_string = f"postgresql+psycopg2://{username}:{encoded_password}@{host}:{port}/{database}"
+
+        # Criar engine do SQLAlchemy
+        engine = create_engine(connection_string)
+
+        # Testar a conexão
+        with engine.connect() as connection:
+            success_msg = "Conexão com o banco de dados estabelecida com sucesso!"
+            print(success_msg)
+
+        return engine
+
+    except Exception as e:
+        error_msg = f"Erro ao conectar ao banco de dados: {e}"
+        print(error_msg)
+        if hasattr(st, "error"):
+            st.error(error_msg)
+        return None
+
+def load_data(engine, table=TABLE_NAME):
+    """
+    Carrega a tabela consolidada completa do banco para um DataFrame
+    """
+    query = f"SELECT * FROM {table}"
+    with span("load_data", **{"db.table": table}) as s:
+        df = pd.read_sql(query, engine)
+        s.set_attribute("db.rows", len(df))
+    return df
+
+@traced("classify_user_intent")
+def classify_user_intent(prompt, llm):
+    """
+    Classifica a intenção do usuário para determinar o tipo de consulta necessária
+    """
+    intent_prompt = ChatPromptTemplate.from_messages([
+        ("system", """
+        Analise a pergunta do usuário sobre inadimplência e classifique a intenção em uma das seguintes categorias:
+        1. COMPARAÇÃO - Perguntas que comparam diferentes aspectos (ex: "Compare PF e PJ")
+        2. RANKING - Perguntas sobre "maior", "menor", "top", etc. (ex: "Qual estado com maior inadimplência?")
+        3. ESPECÍFICO - Perguntas sobre um atributo específico (ex: "Valor de inadimplência em São Paulo")
+        4. TENDÊNCIA - Perguntas sobre evolução temporal (ex: "Como evoluiu a inadimplência")
+        5. GERAL - Perguntas gerais sobre inadimplência
+        6. PREVISÃO - Perguntas sobre valores futuros (ex: "Qual a previsão de inadimplência para os próximos meses?")
+
+        Responda apenas com o número da categoria mais adequada (1, 2, 3, 4, 5 ou 6).
+        """),
+        ("human", "{input}")
+    ])
+
+    intent_chain = intent_prompt | llm
+    intent_result = stream_llm(intent_chain, {"input": prompt}, "llm.classify")
+
+    # Extrair apenas o número da classificação
+    intent_number = ''.join(filter(str.isdigit, intent_result.content[:2]))
+
+    intent_mapping = {
+        "1": "COMPARAÇÃO",
+        "2": "RANKING",
+        "3": "ESPECÍFICO",
+        "4": "TENDÊNCIA",
+        "5": "GERAL",
+        "6": "PREVISÃO"
+    }
+
+    return intent_mapping.get(intent_number, "GERAL")
+
+@traced("generate_dynamic_query")
+def generate_dynamic_query(intent, prompt, llm, table_name=TABLE_NAME, engine=None):
+    """
+    Gera uma consulta SQL dinâmica com base na intenção do usuário e na pergunta
+
+    As colunas descritas no prompt vêm do catálogo do esquema do banco (schema_catalog)
+    """
+    schema = get_schema_prompt(engine, table_name)
+    query_prompt = ChatPromptTemplate.from_messages([
+        ("system", f"""
+        Você é um especialista em SQL que transforma perguntas sobre inadimplência em consultas SQL precisas.
+
+        {schema}
+
+        A intenção do usuário foi classificada como: {intent}
+
+        Com base nesta intenção e na pergunta abaixo, gere uma consulta SQL que retorne os dados necessários.
+        Para consultas de RANKING, use ORDER BY e LIMIT.
+        Para consultas de COMPARAÇÃO, use GROUP BY para os itens comparados.
+        Para consultas ESPECÍFICAS, use filtros WHERE adequados.
+        Para consultas de TENDÊNCIA, considere agrupamentos por períodos.
+        Para consultas de PREVISÃO, retorne o histórico mensal agrupado por data_base.
+
+        IMPORTANTE: Retorne APENAS o código SQL, sem explicações ou comentários.
+        """),
+        ("human", "{input}")
+    ])
+
+    query_chain = query_prompt | llm
+    sql_result = stream_llm(query_chain, {"input": prompt}, "llm.sql_gen")
+
+    # Limpar a resposta para garantir que seja apenas SQL
+
+    sql_query = sql_result.content.strip()
+    if sql_query.startswith("```sql"):
+        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
+
+    return sql_query
+
+@traced("repair_dynamic_query")
+def repair_dynamic_query(prompt, failed_query, error, llm, table_name=TABLE_NAME, engine=None):
+    """
+    Pede ao LLM uma versão corrigida da consulta a partir do erro retornado pelo banco
+    """
+    schema = get_schema_prompt(engine, table_name)
+    repair_prompt = ChatPromptTemplate.from_messages([
+        ("system", f"""
+        Você é um especialista em SQL. A consulta abaixo falhou no banco e precisa ser corrigida.
+
+        {schema}
+
+        Corrija a consulta mantendo o objetivo da pergunta do usuário.
+        IMPORTANTE: Retorne APENAS o código SQL, sem explicações ou comentários.
+        """),
+        ("human", "Pergunta: {input}\n\nConsulta:\n{query}\n\nErro do banco:\n{error}")
+    ])
+
+    repair_chain = repair_prompt | llm
+    sql_result = stream_llm(repair_chain, {"input": prompt, "query": failed_query, "error": error}, "llm.sql_repair")
+
+    sql_query = sql_result.content.strip()
+    if sql_query.startswith("```sql"):
+        sql_query = sql_query.replace("```sql", "").replace("```", "").strip()
+
+    return sql_query
+
+def execute_dynamic_query(dynamic_query, df, engine=None):
+    """
+    Executa a consulta dinâmica no banco (quando há engine) ou pelo caminho legado sobre o DataFrame,
+    com os filtros simples resolvidos pelos índices de bitmap (bitmap_index)
+
+    No banco, a consulta é roteada para a menor tabela de agregados que a responde (rollups) e
+    passa pela proteção de sql_guard (somente leitura, LIMIT, custo e timeout).
+    """
+    with span("execute_dynamic_query", **{"db.statement": dynamic_query}) as s:
+        if engine is not None:
+            routed_query, rollup = route_query(dynamic_query, engine)
+            s.set_attribute("db.rollup", rollup)
+            results = run_guarded_query(routed_query, engine)
+            results.attrs["rollup"] = rollup
+        elif hasattr(df, 'con'):
+            results = pd.read_sql(dynamic_query, df.con)
+        elif "SELECT" not in dynamic_query.upper():
+            # Filtros == / in sobre as dimensões saem dos bitmaps do DataFrame; o restante vai para df.query
+            results = query_frame(df, dynamic_query)
+        else:
+            results = pd.read_sql(dynamic_query, create_engine("sqlite:///:memory:"), params={})
+        s.set_attribute("db.rows", len(results))
+    return results
+
+def run_dynamic_query(prompt, dynamic_query, df, llm, engine=None, timings=None, query_info=None):
+    """
+    Executa a consulta dinâmica (com correção pelo LLM no banco) e retorna o resultado ou o texto de fallback
+    """
+    if query_info is None:
+        query_info = {}
+
+    # No banco, erros são devolvidos ao LLM para correção
+    start = time.perf_counter()
+    repair_time = 0.0
+
+    def repair(failed_query, error):
+        nonlocal repair_time
+        repair_start = time.perf_counter()
+        try:
+            return repair_dynamic_query(prompt, failed_query, error, llm, engine=engine)
+        finally:
+            repair_time += time.perf_counter() - repair_start
+
+    try:
+        dynamic_results, dynamic_query = execute_with_repair(
+            dynamic_query,
+            lambda query: execute_dynamic_query(query, df, engine),
+            repair if engine is not None else None
+        )
+        query_info.update({
+            "sql_executado": dynamic_query,
+            "rollup": dynamic_results.attrs.get("rollup"),
+            "linhas": len(dynamic_results)
+        })
+    except SQLGuardError as e:
+        print(f"Consulta dinâmica rejeitada: {e}")
+        query_info["erro"] = str(e)
+        dynamic_results = "Não foi possível gerar resultados dinâmicos específicos."
+    except Exception as e:
+        print(f"Erro ao executar consulta dinâmica: {e}")
+        query_info["erro"] = str(e)[:500]
+        # Fallback para insights estáticos
+        dynamic_results = "Não foi possível gerar resultados dinâmicos específicos."
+    if timings is not None:
+        timings["execute"] = time.perf_counter() - start - repair_time
+        if repair_time:
+            timings["sql_repair"] = repair_time
+
+    return dynamic_results
+
+def process_question_with_insights(prompt, intent, dynamic_query, df, insights, llm, engine=None, timings=None,
+                                   query_info=None, dynamic_results=None):
+    """
+    Processa a pergunta usando insights estáticos e dados dinâmicos da consulta
+
+    Se `timings` for informado, registra nele o tempo de execução da consulta em "execute" e o das
+    correções pelo LLM em "sql_repair". Se `query_info` for informado, registra nele a consulta
+    executada ("sql_executado"), o agregado usado ("rollup"), as linhas retornadas e o erro.
+    Com `dynamic_results` já calculados (consulta estruturada, séries de tendência, previsão por segmento, comparação entre períodos), a consulta não é executada.
+    """
+    if query_info is None:
+        query_info = {}
+    if dynamic_results is None:
+        dynamic_results = run_dynamic_query(prompt, dynamic_query, df, llm, engine, timings, query_info)
+
+    # Preparar o contexto combinado
+    processing_prompt = ChatPromptTemplate.from_messages([
+        ("system", f"""
+        Você é um especialista em análise de inadimplência no Brasil.
+
+        A pergunta do usuário foi classificada como: {intent}
+
+        Responda à pergunta usando estas duas fontes de informação:
+
+        1. INSIGHTS PRÉ-CALCULADOS:
+        {insights}
+
+        2. RESULTADOS DINÂMICOS DA CONSULTA:
+        {dynamic_results}
+
+        Priorize os resultados dinâmicos pois são mais relevantes para a pergunta específica.
+        Use os insights pré-calculados para complementar sua resposta com contexto adicional.
+
+        Formate os valores em reais (R$) com duas casas decimais e separadores de milhar.
+        Seja conciso e direto, destacando os pontos mais relevantes para a pergunta do usuário.
+        """),
+        ("human", "{input}")
+    ])
+
+    processing_chain = processing_prompt | llm
+    response = stream_llm(processing_chain, {"input": prompt}, "llm.answer")
+
+    return response.content
+
+def build_trend_context(prompt, df):
+    """
+    Contexto da pergunta de tendência a partir das séries mensais (em cache por snapshot)
+
+    Returns:
+        Texto com as séries ou None se não for possível montá-las (o fluxo segue pelo SQL dinâmico)
+    """
+    try:
+        return describe_trend(prompt, get_timeseries(df))
+    except Exception as e:
+        print(f"Erro ao montar as séries de tendência: {e}")
+        return None
+
+def build_forecast_context(prompt, df):
+    """
+    Contexto da pergunta de previsão a partir dos modelos por segmento (em cache por snapshot)
+
+    Returns:
+        Texto com a previsão ou None se ela estiver desativada ou falhar (o fluxo segue pelo SQL dinâmico)
+    """
+    if not FORECAST_ENABLED:
+        return None
+    try:
+        return describe_forecast(prompt, get_forecasts(df))
+    except Exception as e:
+        print(f"Erro ao montar a previsão por segmento: {e}")
+        return None
+
+def build_period_context(prompt, df):
+    """
+    Contexto da comparação entre períodos a partir dos artefatos gravados por period_insights.py
+
+    Returns:
+        Texto com a comparação ou None se os meses pedidos não tiverem artefato (o fluxo segue pelo SQL dinâmico)
+    """
+    try:
+        return describe_period_comparison(prompt, load_period_artifacts(artifacts_key(df)))
+    except Exception as e:
+        print(f"Erro ao montar a comparação entre períodos: {e}")
+        return None
+
+def build_structured_context(prompt, df, llm, query_info):
+    """
+    Contexto da pergunta pelo caminho estruturado (agregados pré-calculados e índice de rankings)
+
+    Returns:
+        Texto com o resultado ou None se a pergunta não couber no formato (o fluxo segue pelo SQL dinâmico)
+    """
+    try:
+        text, query = answer_structured(prompt, df, llm)
+    except Exception as e:
+        print(f"Erro na consulta estruturada: {e}")
+        return None
+    if query is not None:
+        query_info["rollup"] = "structured"
+        print(f"Consulta estruturada: {query}")
+    return text
+
+def build_general_chain(llm):
+    """
+    Cria a cadeia padrão usada para perguntas gerais, respondidas apenas com os insights
+    """
+    prompt_template = ChatPromptTemplate.from_messages([
+        ("system", (
+            "Você é um especialista em análise de inadimplência no Brasil. "
+            "Responda a pergunta do usuário com base nos dados reais de dezembro de 2024 da tabela 'table_agg_inad_consolidado', "
+            "usando os insights detalhados abaixo como fonte principal. "
+            "Os insights foram gerados a partir dos dados reais do banco e contêm valores totais e análises segmentadas. "
+            "Extraia a resposta diretamente dos insights quando possível, sem inventar valores. "
+            "Se a pergunta não for respondida pelos insights ou se os insights indicarem que não há dados, "
+            "informe que os dados de dezembro de 2024 não estão disponíveis e sugira verificar a fonte. "
+            "Formate os valores em reais (R$) com duas casas decimais e separadores de milhar. "
+            "Inclua informações adicionais relevantes sobre inadimplência quando apropriado.\n\n"
+            "Insights gerados:\n{insights}"
+        )),
+        ("human", "{input}")
+    ])
+
+    return prompt_template | llm
+
+def answer_question(prompt, llm, df, insights, conversation=None, engine=None, question_id=None, session_id=None):
+    """
+    Executa o fluxo completo de uma pergunta (classificação, SQL dinâmico e resposta)
+
+    Params:
+        prompt: pergunta do usuário
+        llm: cliente LLM retornado por get_llm_client
+        df: DataFrame com os dados consolidados
+        insights: texto gerado por generate_advanced_insights
+        conversation: cadeia com histórico usada para perguntas gerais (opcional)
+        engine: engine do SQLAlchemy onde a consulta dinâmica é executada (opcional)
+        question_id: identificador usado para correlacionar os spans da pergunta (opcional)
+        session_id: sessão usada na contabilização de tokens (opcional)
+
+    Returns:
+        Dicionário com intenção, SQL gerado, resposta e tempos de cada etapa em segundos
+
+    Cada pergunta respondida é gravada no registro de consultas (query_log).
+    """
+    with span("answer_question", question_id=question_id) as question_span, \
+            usage_scope(session_id=session_id, question_id=question_id) as usage:
+        timings = {}
+        query_info = {}
+        dynamic_query = None
+
+        # Classificar a intenção do usuário
+        start = time.perf_counter()
+        intent = classify_user_intent(prompt, llm)
+        timings["classify"] = time.perf_counter() - start
+        print(f"Intenção classificada como: {intent}")
+        question_span.set_attribute("intent", intent)
+        usage["intent"] = intent
+
+        if intent != "GERAL":
+            # Tendências, previsões, comparações entre períodos e consultas estruturadas usam resultados pré-calculados, sem gerar SQL
+            precomputed_context = None
+            if intent == "TENDÊNCIA" and df is not None:
+                start = time.perf_counter()
+                precomputed_context = build_trend_context(prompt, df)
+                if precomputed_context is not None:
+                    timings["timeseries"] = time.perf_counter() - start
+            elif intent == "PREVISÃO" and df is not None:
+                start = time.perf_counter()
+                precomputed_context = build_forecast_context(prompt, df)
+                if precomputed_context is not None:
+                    timings["forecast"] = time.perf_counter() - start
+            elif intent == "COMPARAÇÃO" and df is not None and is_period_comparison(prompt):
+                start = time.perf_counter()
+                precomputed_context = build_period_context(prompt, df)
+                if precomputed_context is not None:
+                    timings["period_insights"] = time.perf_counter() - start
+            if precomputed_context is None and intent in STRUCTURED_INTENTS and df is not None:
+                # Rankings, comparações e valores específicos: consulta estruturada em vez de SQL livre
+                start = time.perf_counter()
+                precomputed_context = build_structured_context(prompt, df, llm, query_info)
+                if precomputed_context is not None:
+                    timings["structured"] = time.perf_counter() - start
+
+            if precomputed_context is None:
+                # Gerar consulta dinâmica baseada na intenção
+                start = time.perf_counter()
+                dynamic_query = generate_dynamic_query(intent, prompt, llm, engine=engine)
+                timings["sql_gen"] = time.perf_counter() - start
+                print(f"Consulta dinâmica gerada: {dynamic_query}")
+
+            # Processar a pergunta com insights e resultados dinâmicos
+            start = time.perf_counter()
+            answer = process_question_with_insights(
+                prompt, intent, dynamic_query, df, insights, llm, engine=engine, timings=timings,
+                query_info=query_info, dynamic_results=precomputed_context
+            )
+            timings["answer"] = time.perf_counter() - start - timings.get("execute", 0.0) - timings.get("sql_repair", 0.0)
+        else:
+            # Para perguntas gerais, usar o fluxo padrão
+            start = time.perf_counter()
+            if conversation is not None:
+                response = stream_llm(
+                    conversation,
+                    {"input": prompt, "insights": insights},
+                    "llm.answer",
+                    config={"configurable": {"session_id": "default"}}
+                )
+            else:
+                response = stream_llm(build_general_chain(llm), {"input": prompt, "insights": insights}, "llm.answer")
+            answer = response.content
+            timings["answer"] = time.perf_counter() - start
+
+        timings["total"] = sum(timings.values())
+
+    log_question({
+        "question_id": question_id,
+        "session_id": session_id,
+        "pergunta": prompt,
+        "intent": intent,
+        "sql_gerado": dynamic_query,
+        "timings": timings,
+        **query_info
+    })
+
+    return {
+        "intent": intent,
+        "sql": dynamic_query,
+        "answer": answer,
+        "timings": timings
+    }
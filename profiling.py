@@ -0,0 +1,184 @@
+# Perfilamento sob demanda de uma execução do chatbot ou de uma geração de insights
+#
+# Ativação:
+#   PROFILE=rerun      perfila a primeira execução (rerun) de chatbot.main no processo
+#   PROFILE=insights   perfila a primeira chamada de generate_advanced_insights no processo
+#   ?profile=rerun ou ?profile=insights na URL do Streamlit perfila apenas aquela execução
+#   python profiling.py insights --linhas 1000000   perfila insights sobre dados sintéticos
+#
+# Saída em PROFILE_DIR (padrão profiles/), um conjunto de arquivos por captura:
+#   <rotulo>.prof        estatísticas do cProfile (snakeviz, pstats)
+#   <rotulo>.txt         top funções por tempo acumulado
+#   <rotulo>.folded      pilhas amostradas no formato collapsed (flamegraph.pl, speedscope)
+#   <rotulo>_alloc.txt   maiores alocações do tracemalloc entre o início e o fim
+#   <rotulo>_secoes.json tempo e memória por seção dos insights
+import argparse
+import cProfile
+import functools
+import io
+import json
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_MODE = os.getenv("PROFILE", "").strip().lower()
+
+_consumed = set()
+_active = threading.local()
+
+class StackSampler(threading.Thread):
+    """
+    Amostra a pilha de uma thread em intervalos fixos e acumula pilhas no formato collapsed
+    """
+    def __init__(self, target_thread_id, interval=0.005):
+        super().__init__(daemon=True)
+        self.target_thread_id = target_thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stop_event = threading.Event()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.target_thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+    def write_folded(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+def should_profile(kind, requested=None):
+    """
+    Indica se a próxima execução do tipo `kind` ("rerun" ou "insights") deve ser perfilada
+
+    Pedidos por variável de ambiente valem uma vez por processo; `requested` vem do parâmetro de URL.
+    """
+    if requested == kind:
+        return True
+    if PROFILE_MODE == kind and kind not in _consumed:
+        _consumed.add(kind)
+        return True
+    return False
+
+@contextmanager
+def profile_run(label):
+    """
+    Captura cProfile, amostras de pilha e tracemalloc do bloco e grava os arquivos em PROFILE_DIR
+    """
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    base = os.path.join(PROFILE_DIR, f"{label}_{time.strftime('%Y%m%d_%H%M%S')}")
+
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(25)
+    snapshot_start = tracemalloc.take_snapshot()
+    _active.sections = []
+    _active.current = None
+
+    sampler = StackSampler(threading.get_ident())
+    profiler = cProfile.Profile()
+    sampler.start()
+    start = time.perf_counter()
+    profiler.enable()
+    try:
+        yield base
+    finally:
+        profiler.disable()
+        elapsed = time.perf_counter() - start
+        sampler.stop()
+        _close_section()
+        snapshot_end = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+
+        profiler.dump_stats(base + ".prof")
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats("cumulative").print_stats(40)
+        with open(base + ".txt", "w", encoding="utf-8") as f:
+            f.write(f"Tempo total: {elapsed:.3f}s | pico de memória: {peak / 1e6:.1f} MB\n\n")
+            f.write(stream.getvalue())
+
+        sampler.write_folded(base + ".folded")
+
+        with open(base + "_alloc.txt", "w", encoding="utf-8") as f:
+            for stat in snapshot_end.compare_to(snapshot_start, "lineno")[:30]:
+                f.write(f"{stat}\n")
+
+        if _active.sections:
+            with open(base + "_secoes.json", "w", encoding="utf-8") as f:
+                json.dump(_active.sections, f, ensure_ascii=False, indent=2)
+        _active.sections = None
+        print(f"Perfil gravado em {base}.* ({elapsed:.3f}s)")
+
+def _close_section():
+    current = getattr(_active, "current", None)
+    if current is None:
+        return
+    name, start, mem_start = current
+    current_mem, peak = tracemalloc.get_traced_memory()
+    _active.sections.append({
+        "secao": name,
+        "tempo_s": time.perf_counter() - start,
+        "memoria_liquida_mb": (current_mem - mem_start) / 1e6,
+        "pico_mb": peak / 1e6
+    })
+    _active.current = None
+
+def mark_section(name):
+    """
+    Encerra a seção anterior e inicia outra; sem perfilamento ativo não faz nada
+    """
+    if getattr(_active, "sections", None) is None:
+        return
+    _close_section()
+    tracemalloc.reset_peak()
+    _active.current = (name, time.perf_counter(), tracemalloc.get_traced_memory()[0])
+
+def profile_if_requested(kind):
+    """
+    Decorador que perfila a função quando PROFILE pede este tipo de captura (uma vez por processo)
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if getattr(_active, "sections", None) is None and should_profile(kind):
+                with profile_run(kind):
+                    return fn(*args, **kwargs)
+            return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Perfila generate_advanced_insights sobre dados sintéticos ou um parquet")
+    parser.add_argument("alvo", choices=["insights"])
+    parser.add_argument("--linhas", type=int, default=1_000_000)
+    parser.add_argument("--parquet", help="Usa um arquivo parquet em vez de gerar dados sintéticos")
+    args = parser.parse_args()
+
+    import pandas as pd
+    from insights import generate_advanced_insights
+    from synthetic_data import generate_synthetic_data
+
+    df = pd.read_parquet(args.parquet) if args.parquet else generate_synthetic_data(args.linhas)
+    with profile_run("insights"):
+        generate_advanced_insights(df)
@@ -0,0 +1,284 @@
+# Registro persistente das perguntas e consultas geradas, com repetição da carga para comparar desempenho
+#
+# Cada pergunta respondida por answer_question grava uma linha (somente inserções) em um banco
+# SQLite local: pergunta, intenção, SQL gerado e executado, agregado usado, linhas retornadas e a
+# latência de cada etapa. As etapas principais (STAGES) também ficam em colunas de consultas; todas
+# as chaves de timings, inclusive as que o pipeline acrescentar depois, vão para a tabela etapas. O
+# esquema é criado uma vez por processo e as gravações reaproveitam a mesma conexão. O comando
+# replay reexecuta as consultas registradas contra qualquer banco (URL do SQLAlchemy), com ou sem o
+# roteamento para as tabelas de agregados, e grava as latências como uma execução nomeada; o comando
+# comparar mostra a distribuição de latências de duas execuções.
+#
+# Variáveis de ambiente:
+#   QUERY_LOG=0          desativa o registro
+#   QUERY_LOG_DB=caminho banco SQLite do registro (padrão usage/query_log.db)
+#
+# Uso:
+#   python query_log.py replay --db-url sqlite:///local.db --rotulo sqlite-base
+#   python query_log.py replay --db-url postgresql+psycopg2://... --rollups --rotulo pg-rollups
+#   python query_log.py comparar sqlite-base pg-rollups
+#   python query_log.py listar
+import argparse
+import json
+import os
+import sqlite3
+import threading
+import time
+from dotenv import load_dotenv
+
+load_dotenv()
+
+QUERY_LOG_ENABLED = os.getenv("QUERY_LOG", "1") != "0"
+QUERY_LOG_DB = os.getenv("QUERY_LOG_DB", os.path.join("usage", "query_log.db"))
+STAGES = ["classify", "sql_gen", "execute", "sql_repair", "answer", "total"]
+
+_lock = threading.Lock()
+_initialized = set()
+_connections = {}
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS consultas (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT,
+    question_id TEXT,
+    session_id TEXT,
+    pergunta TEXT,
+    intent TEXT,
+    sql_gerado TEXT,
+    sql_executado TEXT,
+    rollup TEXT,
+    linhas INTEGER,
+    erro TEXT,
+    {", ".join(f"{stage}_ms REAL" for stage in STAGES)}
+);
+CREATE TABLE IF NOT EXISTS etapas (
+    consulta_id INTEGER,
+    etapa TEXT,
+    duracao_ms REAL
+);
+CREATE INDEX IF NOT EXISTS idx_etapas_consulta ON etapas (consulta_id);
+CREATE TABLE IF NOT EXISTS replays (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    rotulo TEXT,
+    timestamp TEXT,
+    backend TEXT,
+    consulta_id INTEGER,
+    sql TEXT,
+    rollup TEXT,
+    linhas INTEGER,
+    duracao_ms REAL,
+    erro TEXT
+);
+"""
+
+def _connect(path=QUERY_LOG_DB, check_same_thread=True):
+    # O esquema só é criado na primeira conexão do processo a cada banco
+    if path not in _initialized:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, check_same_thread=check_same_thread)
+    if path not in _initialized:
+        conn.executescript(SCHEMA)
+        _initialized.add(path)
+    return conn
+
+def _writer(path):
+    # Conexão de gravação compartilhada entre as threads; o uso é serializado por _lock
+    conn = _connections.get(path)
+    if conn is None:
+        conn = _connections[path] = _connect(path, check_same_thread=False)
+    return conn
+
+def log_question(record, path=QUERY_LOG_DB):
+    """
+    Grava uma pergunta respondida no registro
+
+    Params:
+        record: dicionário com question_id, session_id, pergunta, intent, sql_gerado, sql_executado,
+            rollup, linhas, erro e timings ({etapa: segundos}); todas as etapas vão para a tabela etapas
+    """
+    if not QUERY_LOG_ENABLED:
+        return
+    timings = record.get("timings") or {}
+    values = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        **{key: record.get(key) for key in
+           ["question_id", "session_id", "pergunta", "intent", "sql_gerado", "sql_executado", "rollup", "linhas", "erro"]},
+        **{f"{stage}_ms": timings[stage] * 1000 if stage in timings else None for stage in STAGES}
+    }
+    columns = ", ".join(values)
+    placeholders = ", ".join(f":{key}" for key in values)
+    try:
+        with _lock:
+            conn = _writer(path)
+            with conn:
+                consulta_id = conn.execute(f"INSERT INTO consultas ({columns}) VALUES ({placeholders})", values).lastrowid
+                conn.executemany(
+                    "INSERT INTO etapas (consulta_id, etapa, duracao_ms) VALUES (?, ?, ?)",
+                    [(consulta_id, stage, seconds * 1000) for stage, seconds in timings.items()]
+                )
+    except sqlite3.Error as e:
+        # O registro nunca deve impedir a resposta ao usuário
+        print(f"Erro ao gravar o registro de consultas: {e}")
+
+def load_log(path=QUERY_LOG_DB, table="consultas"):
+    import pandas as pd
+
+    conn = _connect(path)
+    try:
+        return pd.read_sql(f"SELECT * FROM {table}", conn)
+    finally:
+        conn.close()
+
+def replay(engine, label, use_rollups=False, limit=None, since=None, path=QUERY_LOG_DB):
+    """
+    Reexecuta as consultas registradas com sucesso e grava a latência de cada uma sob `label`
+
+    As consultas passam pela mesma proteção da aplicação (sql_guard); com use_rollups, também pelo
+    roteamento para as tabelas de agregados.
+
+    Returns:
+        Lista de durações em milissegundos das consultas executadas
+    """
+    from rollups import route_query
+    from sql_guard import run_guarded_query
+
+    conn = _connect(path)
+    query = "SELECT id, sql_executado FROM consultas WHERE erro IS NULL AND sql_executado IS NOT NULL"
+    params = []
+    if since:
+        query += " AND timestamp >= ?"
+        params.append(since)
+    query += " ORDER BY id"
+    if limit:
+        query += f" LIMIT {int(limit)}"
+    workload = conn.execute(query, params).fetchall()
+
+    backend = engine.url.render_as_string(hide_password=True)
+    durations = []
+    rows = []
+    for consulta_id, sql in workload:
+        rollup = None
+        start = time.perf_counter()
+        try:
+            if use_rollups:
+                sql, rollup = route_query(sql, engine)
+            result = run_guarded_query(sql, engine)
+            error, lines = None, len(result)
+        except Exception as e:
+            error, lines = str(e)[:500], None
+        duration = (time.perf_counter() - start) * 1000
+        if error is None:
+            durations.append(duration)
+        rows.append((label, time.strftime("%Y-%m-%dT%H:%M:%S"), backend, consulta_id, sql, rollup, lines, duration, error))
+
+    with conn:
+        conn.executemany(
+            "INSERT INTO replays (rotulo, timestamp, backend, consulta_id, sql, rollup, linhas, duracao_ms, erro) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows
+        )
+    conn.close()
+    print(f"Replay '{label}': {len(durations)} de {len(workload)} consultas executadas em {backend}")
+    return durations
+
+def _distribution(values):
+    import numpy as np
+
+    arr = np.array(values)
+    return {
+        "n": len(arr),
+        "media_ms": float(arr.mean()),
+        "p50_ms": float(np.percentile(arr, 50)),
+        "p95_ms": float(np.percentile(arr, 95)),
+        "p99_ms": float(np.percentile(arr, 99)),
+        "max_ms": float(arr.max())
+    }
+
+def compare_runs(label_a, label_b, threshold=1.2, path=QUERY_LOG_DB):
+    """
+    Compara a distribuição de latências de duas execuções e lista as consultas que pioraram
+
+    O rótulo "registro" usa a latência de execução gravada pela própria aplicação.
+
+    Returns:
+        Dicionário com as distribuições, a razão das medianas e as regressões por consulta
+    """
+    conn = _connect(path)
+
+    def run(label):
+        if label == "registro":
+            return dict(conn.execute(
+                "SELECT id, execute_ms FROM consultas WHERE erro IS NULL AND execute_ms IS NOT NULL"
+            ).fetchall())
+        # Com várias repetições do mesmo rótulo, vale a última medição de cada consulta
+        return dict(conn.execute(
+            "SELECT consulta_id, duracao_ms FROM replays WHERE rotulo = ? AND erro IS NULL ORDER BY id", (label,)
+        ).fetchall())
+
+    a, b = run(label_a), run(label_b)
+    conn.close()
+    if not a or not b:
+        raise ValueError(f"Sem medições para {label_a if not a else label_b}")
+
+    dist_a, dist_b = _distribution(list(a.values())), _distribution(list(b.values()))
+    regressions = sorted(
+        ({"consulta_id": key, label_a: a[key], label_b: b[key], "razao": b[key] / a[key]}
+         for key in a.keys() & b.keys() if a[key] > 0 and b[key] / a[key] >= threshold),
+        key=lambda r: -r["razao"]
+    )
+    return {
+        label_a: dist_a,
+        label_b: dist_b,
+        "razao_p50": dist_b["p50_ms"] / dist_a["p50_ms"] if dist_a["p50_ms"] else None,
+        "razao_p95": dist_b["p95_ms"] / dist_a["p95_ms"] if dist_a["p95_ms"] else None,
+        "regressoes": regressions
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Registro de consultas e repetição da carga registrada")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    replay_parser = subparsers.add_parser("replay", help="Reexecuta as consultas registradas")
+    replay_parser.add_argument("--db-url", required=True, help="URL SQLAlchemy do banco de destino")
+    replay_parser.add_argument("--rotulo", required=True, help="Nome da execução para comparação")
+    replay_parser.add_argument("--rollups", action="store_true", help="Roteia para as tabelas de agregados")
+    replay_parser.add_argument("--limite", type=int, help="Máximo de consultas")
+    replay_parser.add_argument("--desde", help="Apenas consultas registradas a partir desta data (AAAA-MM-DD)")
+
+    compare_parser = subparsers.add_parser("comparar", help="Compara as latências de duas execuções")
+    compare_parser.add_argument("rotulo_a", help="Execução de referência (ou 'registro')")
+    compare_parser.add_argument("rotulo_b", help="Execução comparada")
+    compare_parser.add_argument("--limiar", type=float, default=1.2, help="Razão mínima para listar uma regressão")
+    compare_parser.add_argument("--saida", help="Arquivo JSON com a comparação")
+
+    subparsers.add_parser("listar", help="Lista as execuções de replay")
+    args = parser.parse_args()
+
+    if args.comando == "replay":
+        from sqlalchemy import create_engine
+
+        engine = create_engine(args.db_url)
+        durations = replay(engine, args.rotulo, use_rollups=args.rollups, limit=args.limite, since=args.desde)
+        if durations:
+            print(json.dumps(_distribution(durations), indent=2))
+        engine.dispose()
+    elif args.comando == "comparar":
+        report = compare_runs(args.rotulo_a, args.rotulo_b, args.limiar)
+        print(f"{'':<12}{args.rotulo_a:>16}{args.rotulo_b:>16}")
+        for key in ["n", "media_ms", "p50_ms", "p95_ms", "p99_ms", "max_ms"]:
+            print(f"{key:<12}{report[args.rotulo_a][key]:>16.1f}{report[args.rotulo_b][key]:>16.1f}")
+        print(f"\nRazão p50: {report['razao_p50']:.2f} | razão p95: {report['razao_p95']:.2f}")
+        print(f"{len(report['regressoes'])} consultas com razão >= {args.limiar}")
+        for regression in report["regressoes"][:10]:
+            print(f"  consulta {regression['consulta_id']}: {regression['razao']:.2f}x")
+        if args.saida:
+            with open(args.saida, "w", encoding="utf-8") as f:
+                json.dump(report, f, ensure_ascii=False, indent=2)
+    else:
+        conn = _connect()
+        for label, backend, count, first in conn.execute(
+            "SELECT rotulo, backend, COUNT(*), MIN(timestamp) FROM replays GROUP BY rotulo, backend ORDER BY MIN(id)"
+        ):
+            print(f"{label:<24}{count:>8} consultas  {first}  {backend}")
+        conn.close()
@@ -0,0 +1,243 @@
+# Índice de rankings pré-ordenados para as perguntas de RANKING
+#
+# Para o mês de referência (dezembro de 2024, ou o último mês disponível), guarda a ordenação
+# completa de cada dimensão x métrica (volume inadimplido, taxa, ativo problemático e
+# operações), no total e separada entre PF e PJ. A taxa só ordena valores com carteira ativa
+# acima do mínimo, como nos insights. O índice é montado uma vez por snapshot, com rollups do
+# cubo (cube.py); um top-k (ou os k menores) é uma fatia dos arrays já ordenados, O(k), sem SQL
+# gerado pelo LLM nem sort_values por pergunta.
+import re
+import threading
+import weakref
+import pandas as pd
+from cube import get_cube
+from insights import DEFAULT_PERIOD
+from timeseries import normalize_text
+from tracing import traced
+
+DIMENSIONS = ["uf", "regiao", "tipo_cliente", "porte", "modalidade", "ocupacao", "cnae_secao"]
+SEGMENTS = ["Todos", "PF", "PJ"]
+SUM_COLUMNS = {
+    "inadimplida": "soma_carteira_inadimplida_arrastada",
+    "carteira_ativa": "soma_carteira_ativa",
+    "ativo_problematico": "soma_ativo_problematico",
+    "operacoes": "soma_numero_de_operacoes"
+}
+METRICS = {
+    "volume": "inadimplida",
+    "taxa": "taxa_inadimplencia",
+    "ativo_problematico": "ativo_problematico",
+    "operacoes": "operacoes"
+}
+# Carteira mínima para entrar no ranking de taxa (mesmos cortes dos insights)
+MIN_CARTEIRA = {"ocupacao": 500000}
+DEFAULT_MIN_CARTEIRA = 1000000
+DEFAULT_K = 5
+
+DIMENSION_KEYWORDS = [
+    ("tipo_cliente", r"tipos? de cliente|pf ou pj|pj ou pf"),
+    ("ocupacao", r"ocupac|profiss"),
+    ("cnae_secao", r"setor|setores|cnae|atividade"),
+    ("modalidade", r"modalidade|produto|linha de credito"),
+    ("porte", r"\bporte"),
+    ("regiao", r"\bregi[ao]"),
+    ("uf", r"\bestados?\b|\bufs?\b")
+]
+# Medidas e operações sem coluna nos agregados (médias, prazos, contagem de clientes, variações no
+# tempo, faixas de vencimento): perguntas com esses termos seguem pelo SQL dinâmico
+UNSUPPORTED_PATTERN = re.compile(
+    r"\bmedi[ao]s?\b|\bmediana|\bdesvio|\bpercentil|\bticket|\bdias?\b|\batraso|\bprazo"
+    r"|\b(quant[oa]s|numero de|quantidade de|contagem de) (de )?(clientes|tomadores|contratos|pessoas|empresas)"
+    r"|\bclientes (existem|ha)\b|\bpor (cliente|operacao|contrato)\b"
+    r"|\bcresc|\bvaria|\baument|\bqueda|\bcai[ur]|\bredu[cz]|\bdiminu|\bevolu|\btendencia"
+    r"|\ba vencer|\bvencid|\b(acima|abaixo|mais|menos) de \d+"
+)
+METRIC_LABELS = {
+    "volume": "volume inadimplido",
+    "taxa": "taxa de inadimplência",
+    "ativo_problematico": "ativo problemático",
+    "operacoes": "número de operações"
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+
+class RankingIndex:
+    """
+    Ordenações por (segmento, dimensão, métrica): arrays de rótulos e valores em ordem decrescente
+    """
+    def __init__(self, period, orderings, stats):
+        self.period = period
+        self.orderings = orderings
+        self.stats = stats
+
+    def top(self, dimension, metric="volume", k=DEFAULT_K, ascending=False, segment="Todos"):
+        """
+        Os k maiores (ou menores, com ascending) valores da dimensão, em O(k)
+
+        Returns:
+            Lista de (rótulo, valor)
+        """
+        labels, values = self.orderings[(segment, dimension, metric)]
+        # Os menores são o fim da ordenação decrescente, percorrido de trás para frente
+        positions = slice(-1, -min(k, len(labels)) - 1, -1) if ascending else slice(0, k)
+        return list(zip(labels[positions], values[positions]))
+
+    def row(self, dimension, label, segment="Todos"):
+        """
+        Somas e taxa de um valor da dimensão no mês de referência
+        """
+        return self.stats[(segment, dimension)].loc[label]
+
+def _reference_period(months):
+    months = [month for month in months if not pd.isna(month)]
+    return DEFAULT_PERIOD if DEFAULT_PERIOD in months else max(months)
+
+@traced("build_ranking_index")
+def build_ranking_index(df, period=None):
+    """
+    Faz o rollup do mês de referência no cubo por dimensão e guarda as ordenações de cada métrica
+
+    Params:
+        df: DataFrame com os dados consolidados
+        period: mês de referência (padrão: dezembro de 2024, ou o último mês disponível)
+
+    Returns:
+        RankingIndex
+    """
+    cube = get_cube(df)
+    period = pd.Period(period, freq="M") if period is not None else _reference_period(cube.labels["data_base"])
+    part = cube.slice(data_base=period)
+    if part.cells == 0:
+        raise ValueError(f"Nenhum dado para {period}")
+
+    orderings = {}
+    stats = {}
+    for segment in SEGMENTS:
+        segment_cube = part if segment == "Todos" else part.slice(tipo_cliente=segment)
+        for dimension in DIMENSIONS:
+            grouped = segment_cube.rollup(dimension).set_index(dimension)
+            grouped.index = grouped.index.astype(str)
+            grouped = grouped[list(SUM_COLUMNS.values()) + ["taxa_inadimplencia"]].rename(columns={v: k for k, v in SUM_COLUMNS.items()})
+            stats[(segment, dimension)] = grouped
+            for metric, column in METRICS.items():
+                frame = grouped
+                if metric == "taxa":
+                    frame = grouped[grouped["carteira_ativa"] > MIN_CARTEIRA.get(dimension, DEFAULT_MIN_CARTEIRA)]
+                ordered = frame[column].dropna().sort_values(ascending=False, kind="stable")
+                orderings[(segment, dimension, metric)] = (ordered.index.to_numpy(), ordered.to_numpy())
+    return RankingIndex(period, orderings, stats)
+
+def get_ranking_index(df):
+    """
+    Retorna o índice do DataFrame do cache (uma montagem por snapshot ou por DataFrame de sessão)
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0]() is df):
+            return cached[1]
+
+    index = build_ranking_index(df)
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (reference, index)
+    return index
+
+def parse_dimension(text):
+    """
+    Dimensão pedida no texto normalizado ("por estado", "qual modalidade"), ou None
+    """
+    return next((name for name, pattern in DIMENSION_KEYWORDS if re.search(pattern, text)), None)
+
+def parse_metric(text):
+    """
+    Métrica citada no texto normalizado (padrão: volume inadimplido)
+
+    Returns:
+        Chave de METRICS, ou None se o texto pedir uma medida ou operação fora do vocabulário (UNSUPPORTED_PATTERN)
+    """
+    if UNSUPPORTED_PATTERN.search(text):
+        return None
+    if re.search(r"ativos? problematicos?", text):
+        return "ativo_problematico"
+    if re.search(r"operac", text):
+        return "operacoes"
+    if re.search(r"\btaxa|percentual|proporc|%", text):
+        return "taxa"
+    return "volume"
+
+def parse_order(text):
+    """
+    Sentido e tamanho do ranking pedidos no texto normalizado
+
+    Returns:
+        Tupla (ascending, k) ou None se o texto não pede ordenação
+    """
+    ranked = re.search(r"\b(maior|menor|mais|menos|top|principa|ranking|piores?|melhores?)", text)
+    number = re.search(r"\b(?:top|os|as)?\s*(\d{1,2})\s+(?:maiores|menores|principais|primeir|estados|ufs|regioes|modalidades|setores|ocupacoes|portes)", text) \
+        or re.search(r"\btop\s*(\d{1,2})\b", text)
+    if not ranked and not number:
+        return None
+    ascending = bool(re.search(r"\bmenor|\bmenos\b|\bpiores? desempenho|\bmais baix", text))
+    return ascending, int(number.group(1)) if number else DEFAULT_K
+
+def parse_ranking(question):
+    """
+    Extrai dimensão, métrica, k, sentido e segmento de uma pergunta de ranking
+
+    Returns:
+        Dicionário com dimension, metric, k, ascending e segment, ou None se a dimensão ou a métrica não
+        forem reconhecidas
+    """
+    text = normalize_text(question)
+    dimension = parse_dimension(text)
+    metric = parse_metric(text)
+    if dimension is None or metric is None:
+        return None
+    ascending, k = parse_order(text) or (False, DEFAULT_K)
+
+    segment = "Todos"
+    if dimension != "tipo_cliente":
+        if re.search(r"\b(pf|pessoas? fisicas?)\b", text):
+            segment = "PF"
+        elif re.search(r"\b(pj|pessoas? juridicas?|empresas)\b", text):
+            segment = "PJ"
+    return {"dimension": dimension, "metric": metric, "k": k, "ascending": ascending, "segment": segment}
+
+def _format(value, metric):
+    if metric == "taxa":
+        return f"{value:.2f}%"
+    if metric == "operacoes":
+        return f"{value:,.0f}"
+    return f"R$ {value:,.2f}"
+
+def format_ranking(index, dimension, metric="volume", k=DEFAULT_K, ascending=False, segment="Todos"):
+    """
+    Texto do ranking com as somas de cada posição, para o contexto da resposta
+    """
+    items = index.top(dimension, metric, k, ascending, segment)
+    order = "menores" if ascending else "maiores"
+    text = f"RANKING - {k} {order} valores de {dimension} por {METRIC_LABELS[metric]} ({index.period.strftime('%m/%Y')}"
+    text += f", {segment}" if segment != "Todos" else ""
+    if metric == "taxa":
+        text += f", carteira ativa acima de R$ {MIN_CARTEIRA.get(dimension, DEFAULT_MIN_CARTEIRA):,.0f}"
+    text += ")\n"
+    for position, (label, value) in enumerate(items, start=1):
+        row = index.row(dimension, label, segment)
+        text += (f"{position}. {label}: {_format(value, metric)} | inadimplida R$ {row['inadimplida']:,.2f} | "
+                 f"taxa {row['taxa_inadimplencia']:.2f}% | carteira R$ {row['carteira_ativa']:,.2f} | "
+                 f"operações {row['operacoes']:,.0f}\n")
+    return text
+
+def describe_ranking(question, index):
+    """
+    Texto do ranking pedido na pergunta ou None se a pergunta não puder ser mapeada no índice
+    """
+    parsed = parse_ranking(question)
+    if parsed is None:
+        return None
+    return format_ranking(index, **parsed)
@@ -0,0 +1,210 @@
+# Medição do tempo de parede dos reruns do chatbot antes e depois de uma mudança na interface
+#
+# Executa chatbot.py com o streamlit.testing (AppTest), sem navegador: uma carga da página e depois
+# cada pergunta de PERGUNTAS enviada pelo chat_input, medindo o tempo de cada execução. O banco é o
+# SQLite sintético de synthetic_data.py e o LLM é o roteirizado de llm_stub.py, então as duas versões
+# medidas veem os mesmos dados e as mesmas respostas. Com --revisao, a versão medida é a de outro
+# commit, em um git worktree temporário (ex.: o commit anterior à troca por fragmentos e recursos em
+# cache). Os spans da execução (tracing.py) são gravados junto: na versão com fragmentos, o navegador
+# reexecuta só ui.chat_fragment a cada mensagem, enquanto o AppTest sempre reexecuta o script
+# inteiro, então o tempo por mensagem do AppTest é um limite superior para a versão nova. Como a
+# resposta é exibida com o efeito de digitação (10 ms por caractere) nas duas versões, a comparação
+# também mostra o tempo de cada mensagem fora do span question, que é o custo do rerun em si.
+#
+# Uso:
+#   python rerun_bench.py medir --rotulo antes --revisao b2f7c30~1
+#   python rerun_bench.py medir --rotulo depois
+#   python rerun_bench.py comparar antes depois
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+RESULTS_DIR = os.getenv("RERUN_BENCH_DIR", os.path.join("usage", "rerun_bench"))
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+PERGUNTAS = [
+    "Qual estado com maior inadimplência e quais os valores devidos?",
+    "Compare a inadimplência entre PF e PJ",
+    "Em qual modalidade existe maior inadimplência?",
+    "Como evoluiu a inadimplência ao longo de 2024?",
+    "Qual o valor de inadimplência em São Paulo?",
+    "Quais são os principais riscos de inadimplência?"
+]
+# Spans resumidos na comparação (ausentes na versão antiga são ignorados)
+SPANS = ["ui.rerun", "ui.chat_fragment", "render_chat_history", "question", "ui.render", "load_data"]
+
+def _distribution(values):
+    values = sorted(values)
+    if not values:
+        return None
+    p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+    return {"n": len(values), "p50_ms": statistics.median(values), "p95_ms": p95, "max_ms": values[-1]}
+
+def _run_app(app_dir, db_url, rounds, timeout):
+    """
+    Mede as execuções do chatbot.py de app_dir no processo atual (chamado em um subprocesso por medir)
+
+    Returns:
+        Dicionário com os tempos da carga e de cada mensagem em milissegundos
+    """
+    sys.path.insert(0, app_dir)
+    os.chdir(app_dir)
+    from sqlalchemy import create_engine
+    from streamlit.testing.v1 import AppTest
+    import pipeline
+    from llm_stub import get_stub_llm
+
+    def connect_to_db():
+        # Mesmo custo de abertura e teste de conexão do connect_to_db real
+        engine = create_engine(db_url)
+        with engine.connect():
+            pass
+        return engine
+
+    # chatbot.py importa estes nomes de pipeline a cada execução do script
+    pipeline.connect_to_db = connect_to_db
+    pipeline.get_llm_client = get_stub_llm
+
+    at = AppTest.from_file(os.path.join(app_dir, "chatbot.py"), default_timeout=timeout)
+    start = time.perf_counter()
+    at.run()
+    load_ms = (time.perf_counter() - start) * 1000
+    if at.exception:
+        raise SystemExit(f"Falha na carga da página: {at.exception[0].message}")
+
+    messages = []
+    for _ in range(rounds):
+        for question in PERGUNTAS:
+            start = time.perf_counter()
+            at.chat_input[0].set_value(question).run()
+            messages.append((time.perf_counter() - start) * 1000)
+            if at.exception:
+                raise SystemExit(f"Falha na pergunta '{question}': {at.exception[0].message}")
+    return {"carga_ms": load_ms, "mensagens_ms": messages}
+
+def measure(label, revision=None, db_url=None, rows=200_000, rounds=3, timeout=120):
+    """
+    Mede a versão atual (ou a de `revision`) e grava o resultado em RESULTS_DIR/<label>.json
+
+    Params:
+        label: nome da medição usado em comparar
+        revision: commit a medir (padrão: a árvore atual)
+        db_url: banco com a tabela consolidada (padrão: SQLite sintético com `rows` linhas)
+        rounds: repetições da sequência de PERGUNTAS
+    """
+    os.makedirs(RESULTS_DIR, exist_ok=True)
+    results_dir = os.path.abspath(RESULTS_DIR)
+    workdir = tempfile.mkdtemp(prefix="rerun_bench_")
+    try:
+        if db_url is None:
+            from synthetic_data import write_sqlite
+
+            db_url = write_sqlite(os.path.join(workdir, "local.db"), rows)
+        app_dir = REPO_DIR
+        if revision:
+            app_dir = os.path.join(workdir, "arvore")
+            subprocess.run(["git", "-C", REPO_DIR, "worktree", "add", "--detach", app_dir, revision], check=True)
+
+        trace_file = os.path.join(workdir, "spans.jsonl")
+        env = dict(os.environ, TRACE_FILE=trace_file, TRACING="1", PROFILE="")
+        output = os.path.join(workdir, "medicao.json")
+        subprocess.run([
+            sys.executable, os.path.abspath(__file__), "_executar", app_dir, db_url, output,
+            "--repeticoes", str(rounds), "--timeout", str(timeout)
+        ], env=env, check=True)
+        with open(output, encoding="utf-8") as f:
+            result = json.load(f)
+
+        spans = {}
+        if os.path.exists(trace_file):
+            sys.path.insert(0, REPO_DIR)
+            from tracing import load_spans
+
+            for item in load_spans(trace_file):
+                if item["name"] in SPANS:
+                    spans.setdefault(item["name"], []).append(item["duration_ms"])
+        # Um span question por mensagem, na ordem das mensagens
+        result["fora_da_pergunta_ms"] = [
+            message - question for message, question in zip(result["mensagens_ms"], spans.get("question", []))
+        ]
+        result.update({"rotulo": label, "revisao": revision or "atual", "spans": spans})
+    finally:
+        if revision and os.path.exists(os.path.join(workdir, "arvore")):
+            subprocess.run(["git", "-C", REPO_DIR, "worktree", "remove", "--force", os.path.join(workdir, "arvore")])
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    path = os.path.join(results_dir, f"{label}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    messages = _distribution(result["mensagens_ms"])
+    overhead = _distribution(result["fora_da_pergunta_ms"])
+    print(f"{label}: carga {result['carga_ms']:.1f} ms | mensagem p50 {messages['p50_ms']:.1f} ms, "
+          f"p95 {messages['p95_ms']:.1f} ms ({messages['n']} mensagens)"
+          + (f" | fora da pergunta p50 {overhead['p50_ms']:.1f} ms, p95 {overhead['p95_ms']:.1f} ms" if overhead else "")
+          + f" -> {path}")
+    return result
+
+def compare(label_a, label_b):
+    """
+    Distribuições (n, p50, p95, máx) da carga, das mensagens e dos spans de duas medições
+    """
+    results = []
+    for label in [label_a, label_b]:
+        with open(os.path.join(RESULTS_DIR, f"{label}.json"), encoding="utf-8") as f:
+            results.append(json.load(f))
+    a, b = results
+
+    rows = [
+        ("mensagem (AppTest)", _distribution(a["mensagens_ms"]), _distribution(b["mensagens_ms"])),
+        ("fora da pergunta", _distribution(a["fora_da_pergunta_ms"]), _distribution(b["fora_da_pergunta_ms"]))
+    ]
+    for name in SPANS:
+        rows.append((name, _distribution(a["spans"].get(name, [])), _distribution(b["spans"].get(name, []))))
+
+    print(f"{'':<22}{label_a + ' p50':>14}{label_a + ' p95':>14}{label_b + ' p50':>14}{label_b + ' p95':>14}")
+    print(f"{'carga da página':<22}{a['carga_ms']:>14.1f}{'':>14}{b['carga_ms']:>14.1f}")
+    for name, dist_a, dist_b in rows:
+        cells = []
+        for dist in [dist_a, dist_b]:
+            cells += [f"{dist['p50_ms']:>14.1f}", f"{dist['p95_ms']:>14.1f}"] if dist else [f"{'-':>14}"] * 2
+        print(f"{name:<22}{''.join(cells)}")
+    return {"a": a, "b": b}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tempo de parede dos reruns do chatbot antes e depois de uma mudança")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    measure_parser = subparsers.add_parser("medir", help="Mede a versão atual ou a de um commit")
+    measure_parser.add_argument("--rotulo", required=True, help="Nome da medição")
+    measure_parser.add_argument("--revisao", help="Commit a medir (padrão: árvore atual)")
+    measure_parser.add_argument("--db-url", help="Banco com a tabela consolidada (padrão: SQLite sintético)")
+    measure_parser.add_argument("--linhas", type=int, default=200_000, help="Linhas do SQLite sintético")
+    measure_parser.add_argument("--repeticoes", type=int, default=3, help="Repetições da sequência de perguntas")
+    measure_parser.add_argument("--timeout", type=float, default=120)
+
+    compare_parser = subparsers.add_parser("comparar", help="Compara duas medições")
+    compare_parser.add_argument("rotulo_a")
+    compare_parser.add_argument("rotulo_b")
+
+    run_parser = subparsers.add_parser("_executar")
+    run_parser.add_argument("app_dir")
+    run_parser.add_argument("db_url")
+    run_parser.add_argument("saida")
+    run_parser.add_argument("--repeticoes", type=int, default=3)
+    run_parser.add_argument("--timeout", type=float, default=120)
+    args = parser.parse_args()
+
+    if args.comando == "medir":
+        measure(args.rotulo, args.revisao, args.db_url, args.linhas, args.repeticoes, args.timeout)
+    elif args.comando == "comparar":
+        compare(args.rotulo_a, args.rotulo_b)
+    else:
+        result = _run_app(args.app_dir, args.db_url, args.repeticoes, args.timeout)
+        with open(args.saida, "w", encoding="utf-8") as f:
+            json.dump(result, f)
@@ -0,0 +1,327 @@
+# Tabelas de agregados (rollups) mensais no banco e roteamento automático das consultas geradas
+#
+# Quase toda pergunta precisa de uma ou duas dimensões em uma única data_base, mas as consultas
+# geradas varrem a tabela consolidada no grão completo. Este módulo materializa, por mês, as somas
+# das medidas por cliente e uma dimensão (uf, modalidade, porte, cnae_secao, ocupacao) e reescreve
+# a consulta gerada para a menor tabela de agregados que consegue respondê-la com o mesmo resultado.
+#
+# A atualização é incremental por mês: só os meses novos ou cuja assinatura (linhas e soma da
+# carteira ativa) mudou na tabela consolidada são recalculados. Ao final, o refresh confere as
+# assinaturas de todos os agregados e grava na tabela de controle a versão da carga verificada. O job
+# de carga grava a versão da tabela consolidada (mark_base_loaded ou python rollups.py marcar-carga)
+# sempre que a altera; as consultas só são roteadas enquanto as duas versões forem iguais, sem
+# varrer a tabela consolidada no caminho da pergunta.
+#
+# Uso:
+#   python rollups.py marcar-carga         registra uma nova carga da tabela consolidada
+#   python rollups.py refresh              atualiza os meses alterados
+#   python rollups.py refresh --completo   recalcula todos os meses
+#   python rollups.py info                 mostra tabelas, meses e tamanhos
+#   python rollups.py rotear "SELECT ..."  mostra a reescrita de uma consulta
+import argparse
+import os
+import re
+import threading
+import time
+import uuid
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+from sql_guard import mask_sql
+from tracing import span
+
+load_dotenv()
+
+ROLLUPS_ENABLED = os.getenv("ROLLUPS", "1") != "0"
+ROLLUP_CACHE_TTL = float(os.getenv("ROLLUP_CACHE_TTL", "300"))
+BASE_TABLE = "table_agg_inad_consolidado"
+META_TABLE = "rollup_meses"
+CONTROL_TABLE = "rollup_controle"
+# Versão gravada pelo refresh quando o job de carga nunca marcou a tabela consolidada
+NO_MARKER = "sem-marcador"
+
+# Nome da tabela -> dimensões (além de data_base); cliente entra em todas porque filtros PF/PJ são os mais comuns
+ROLLUPS = {
+    "rollup_uf": ["cliente", "uf"],
+    "rollup_modalidade": ["cliente", "modalidade"],
+    "rollup_porte": ["cliente", "porte"],
+    "rollup_cnae_secao": ["cliente", "cnae_secao"],
+    "rollup_ocupacao": ["cliente", "ocupacao"]
+}
+
+MEASURES = [
+    "soma_numero_de_operacoes",
+    "soma_a_vencer_ate_90_dias",
+    "soma_carteira_ativa",
+    "soma_carteira_inadimplida_arrastada",
+    "soma_ativo_problematico"
+]
+
+DIMENSIONS = ["data_base", "uf", "cliente", "porte", "modalidade", "ocupacao", "cnae_secao"]
+
+_available = {}
+_available_lock = threading.Lock()
+# Uma única leitura das tabelas de controle por vez quando o cache expira
+_read_lock = threading.Lock()
+
+def _select_rollup(dimensions, where=""):
+    group = ", ".join(["data_base"] + dimensions)
+    sums = ", ".join(f"SUM({m}) AS {m}" for m in MEASURES)
+    return f"SELECT {group}, {sums} FROM {BASE_TABLE} {where} GROUP BY {group}"
+
+def _ensure_tables(conn):
+    existing = set(inspect(conn).get_table_names())
+    if META_TABLE not in existing:
+        conn.execute(text(
+            f"CREATE TABLE {META_TABLE} (rollup VARCHAR(64), data_base VARCHAR(10), base_linhas BIGINT, "
+            f"base_carteira DOUBLE PRECISION, linhas BIGINT, atualizado_em VARCHAR(19))"
+        ))
+    if CONTROL_TABLE not in existing:
+        conn.execute(text(f"CREATE TABLE {CONTROL_TABLE} (chave VARCHAR(16), versao VARCHAR(64), atualizado_em VARCHAR(19))"))
+    for name, dimensions in ROLLUPS.items():
+        if name not in existing:
+            # Cria com os tipos da tabela consolidada e sem linhas
+            conn.execute(text(f"CREATE TABLE {name} AS {_select_rollup(dimensions, 'WHERE 1 = 0')}"))
+            conn.execute(text(f"CREATE INDEX {name}_idx ON {name} (data_base, {', '.join(dimensions)})"))
+
+def _set_version(conn, key, version):
+    conn.execute(text(f"DELETE FROM {CONTROL_TABLE} WHERE chave = :chave"), {"chave": key})
+    if version is not None:
+        conn.execute(text(f"INSERT INTO {CONTROL_TABLE} VALUES (:chave, :versao, :atualizado_em)"), {
+            "chave": key, "versao": version, "atualizado_em": time.strftime("%Y-%m-%dT%H:%M:%S")
+        })
+
+def _versions(conn):
+    return dict(conn.execute(text(f"SELECT chave, versao FROM {CONTROL_TABLE}")).fetchall())
+
+def mark_base_loaded(engine, version=None):
+    """
+    Registra uma nova carga da tabela consolidada; os agregados deixam de ser usados até o próximo refresh
+
+    Deve ser chamada pelo job de carga sempre que a tabela consolidada for alterada.
+
+    Returns:
+        Versão registrada (a informada ou um identificador novo)
+    """
+    version = version or f"{time.strftime('%Y%m%dT%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    with engine.begin() as conn:
+        _ensure_tables(conn)
+        _set_version(conn, "base", version)
+    clear_cache()
+    return version
+
+def _month_signatures(conn):
+    rows = conn.execute(text(
+        f"SELECT data_base, COUNT(*), SUM(soma_carteira_ativa) FROM {BASE_TABLE} GROUP BY data_base"
+    )).fetchall()
+    return {r[0]: (int(r[1]), round(float(r[2] or 0), 2)) for r in rows}
+
+def refresh_rollups(engine, full=False, months=None):
+    """
+    Atualiza as tabelas de agregados recalculando apenas os meses alterados
+
+    Params:
+        engine: engine do SQLAlchemy com a tabela consolidada
+        full: recalcula todos os meses
+        months: lista de data_base a recalcular mesmo sem alteração
+
+    Returns:
+        Lista de meses recalculados
+    """
+    with span("rollups.refresh") as s:
+        with engine.begin() as conn:
+            _ensure_tables(conn)
+            # Lida antes das assinaturas: uma carga durante o refresh muda a versão e invalida a verificação
+            base_version = _versions(conn).get("base", NO_MARKER)
+            signatures = _month_signatures(conn)
+            stored = {}
+            for rollup, data_base, base_linhas, base_carteira in conn.execute(text(
+                f"SELECT rollup, data_base, base_linhas, base_carteira FROM {META_TABLE}"
+            )):
+                stored[(rollup, data_base)] = (int(base_linhas), round(float(base_carteira), 2))
+
+        refreshed = set()
+        for name, dimensions in ROLLUPS.items():
+            for data_base, signature in sorted(signatures.items()):
+                if not full and data_base not in (months or []) and stored.get((name, data_base)) == signature:
+                    continue
+                # Um mês por transação: leitores nunca veem o mês parcialmente recalculado
+                with engine.begin() as conn:
+                    params = {"data_base": data_base}
+                    conn.execute(text(f"DELETE FROM {name} WHERE data_base = :data_base"), params)
+                    inserted = conn.execute(text(
+                        f"INSERT INTO {name} {_select_rollup(dimensions, 'WHERE data_base = :data_base')}"
+                    ), params).rowcount
+                    conn.execute(text(f"DELETE FROM {META_TABLE} WHERE rollup = :rollup AND data_base = :data_base"),
+                                 {"rollup": name, **params})
+                    conn.execute(text(
+                        f"INSERT INTO {META_TABLE} VALUES (:rollup, :data_base, :base_linhas, :base_carteira, :linhas, :atualizado_em)"
+                    ), {
+                        "rollup": name, **params,
+                        "base_linhas": signature[0], "base_carteira": signature[1],
+                        "linhas": inserted, "atualizado_em": time.strftime("%Y-%m-%dT%H:%M:%S")
+                    })
+                refreshed.add(data_base)
+
+            # Meses removidos da tabela consolidada
+            removed = [data_base for (rollup, data_base) in stored if rollup == name and data_base not in signatures]
+            if removed:
+                with engine.begin() as conn:
+                    for data_base in removed:
+                        conn.execute(text(f"DELETE FROM {name} WHERE data_base = :data_base"), {"data_base": data_base})
+                        conn.execute(text(f"DELETE FROM {META_TABLE} WHERE rollup = :rollup AND data_base = :data_base"),
+                                     {"rollup": name, "data_base": data_base})
+
+        # Verificação completa, feita aqui e não por pergunta: todos os agregados com as assinaturas atuais
+        with engine.begin() as conn:
+            stored = {}
+            for rollup, data_base, base_linhas, base_carteira in conn.execute(text(
+                f"SELECT rollup, data_base, base_linhas, base_carteira FROM {META_TABLE}"
+            )):
+                stored.setdefault(rollup, {})[str(data_base)] = (int(base_linhas), round(float(base_carteira), 2))
+            # data_base pode vir como data da tabela consolidada e texto da tabela de controle
+            expected = {str(data_base): signature for data_base, signature in signatures.items()}
+            current = all(stored.get(name) == expected for name in ROLLUPS)
+            _set_version(conn, "rollups", base_version if current else None)
+            if not current:
+                print("Agregados não conferem com a tabela consolidada após o refresh; roteamento desativado")
+
+        s.set_attribute("rollups.meses", len(refreshed))
+    clear_cache()
+    return sorted(refreshed)
+
+def available_rollups(engine):
+    """
+    Retorna {tabela: linhas} das tabelas de agregados atualizadas, em cache por ROLLUP_CACHE_TTL segundos
+
+    Os agregados só são usados quando a versão verificada pelo último refresh é igual à versão da
+    carga da tabela consolidada (mark_base_loaded); uma carga sem refresh posterior, ou um refresh que
+    não conferiu, tira todos os agregados do roteamento. Lê apenas as tabelas de controle, nunca a
+    tabela consolidada. Sem as tabelas de controle (refresh nunca executado), retorna um dicionário vazio.
+    """
+    key = str(engine.url)
+    with _available_lock:
+        cached = _available.get(key)
+        if cached and time.monotonic() - cached[0] < ROLLUP_CACHE_TTL:
+            return cached[1]
+
+    with _read_lock:
+        # Outra thread pode ter lido enquanto esta esperava
+        with _available_lock:
+            cached = _available.get(key)
+            if cached and time.monotonic() - cached[0] < ROLLUP_CACHE_TTL:
+                return cached[1]
+
+        sizes = {}
+        try:
+            with engine.connect() as conn:
+                if {META_TABLE, CONTROL_TABLE} <= set(inspect(conn).get_table_names()):
+                    versions = _versions(conn)
+                    if "rollups" not in versions or versions["rollups"] != versions.get("base", NO_MARKER):
+                        print(f"Agregados desatualizados em relação a {BASE_TABLE}; consultas usam a tabela consolidada")
+                    else:
+                        for rollup, linhas in conn.execute(text(
+                            f"SELECT rollup, SUM(linhas) FROM {META_TABLE} GROUP BY rollup"
+                        )):
+                            if rollup in ROLLUPS:
+                                sizes[rollup] = int(linhas or 0)
+        except Exception as e:
+            print(f"Erro ao ler as tabelas de agregados: {e}")
+
+        with _available_lock:
+            _available[key] = (time.monotonic(), sizes)
+    return sizes
+
+def clear_cache():
+    with _available_lock:
+        _available.clear()
+
+def choose_rollup(query, sizes):
+    """
+    Escolhe a menor tabela de agregados que responde a consulta com o mesmo resultado
+
+    A consulta só é roteada quando lê apenas a tabela consolidada, usa somente colunas presentes no
+    agregado e cada medida aparece dentro de SUM(...): outras agregações (COUNT, AVG, MIN, MAX) ou
+    filtros sobre medidas dependem do grão original.
+
+    Returns:
+        Nome da tabela escolhida ou None
+    """
+    masked = mask_sql(query)
+    lower = masked.lower()
+    if len(re.findall(rf"\b{BASE_TABLE}\b", lower)) != 1 or re.search(r"\bjoin\b", lower):
+        return None
+    if re.search(r"\b(count|avg|min|max|stddev|variance|percentile_\w+|array_agg|string_agg)\s*\(", lower):
+        return None
+    if re.search(r"\bselect\s+(distinct\s+)?\*", lower):
+        return None
+    if '"' in masked:
+        # Identificadores entre aspas ficam mascarados e não seriam verificados
+        return None
+
+    for measure in MEASURES:
+        total = len(re.findall(rf"\b{measure}\b", lower))
+        summed = len(re.findall(rf"\bsum\s*\(\s*{measure}\s*\)", lower))
+        if total != summed:
+            return None
+
+    used = {d for d in DIMENSIONS if re.search(rf"\b{d}\b", lower)} - {"data_base"}
+    candidates = [name for name, dims in ROLLUPS.items() if name in sizes and used <= set(dims)]
+    if not candidates:
+        return None
+    return min(candidates, key=lambda name: sizes[name])
+
+def route_query(query, engine):
+    """
+    Reescreve a consulta para a menor tabela de agregados capaz de respondê-la
+
+    Returns:
+        Tupla (consulta, nome do agregado usado ou None)
+    """
+    if not ROLLUPS_ENABLED or engine is None:
+        return query, None
+    rollup = choose_rollup(query, available_rollups(engine))
+    if rollup is None:
+        return query, None
+    # Substitui a tabela apenas fora de literais (posições preservadas pelo mascaramento)
+    match = re.search(rf"\b{BASE_TABLE}\b", mask_sql(query), flags=re.IGNORECASE)
+    return query[:match.start()] + rollup + query[match.end():], rollup
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Tabelas de agregados mensais da tabela consolidada")
+    parser.add_argument("comando", choices=["marcar-carga", "refresh", "info", "rotear"])
+    parser.add_argument("consulta", nargs="?", help="Consulta SQL para o comando rotear")
+    parser.add_argument("--db-url", help="URL SQLAlchemy (padrão: conexão do .env)")
+    parser.add_argument("--completo", action="store_true", help="Recalcula todos os meses")
+    parser.add_argument("--meses", help="Meses a recalcular, separados por vírgula (ex.: 31/12/2024)")
+    parser.add_argument("--versao", help="Versão da carga para marcar-carga (padrão: data e identificador novo)")
+    args = parser.parse_args()
+
+    if args.db_url:
+        from sqlalchemy import create_engine
+        engine = create_engine(args.db_url)
+    else:
+        from pipeline import connect_to_db
+        engine = connect_to_db()
+        if engine is None:
+            raise SystemExit("Não foi possível conectar ao banco de dados.")
+
+    if args.comando == "marcar-carga":
+        print(f"Carga registrada: {mark_base_loaded(engine, args.versao)}")
+    elif args.comando == "refresh":
+        start = time.perf_counter()
+        months = [m.strip() for m in args.meses.split(",")] if args.meses else None
+        refreshed = refresh_rollups(engine, full=args.completo, months=months)
+        print(f"{len(refreshed)} meses recalculados em {time.perf_counter() - start:.1f}s")
+    elif args.comando == "info":
+        sizes = available_rollups(engine)
+        if not sizes:
+            print("Nenhuma tabela de agregados; execute python rollups.py refresh")
+        for name, rows in sorted(sizes.items(), key=lambda item: item[1]):
+            print(f"{name:<22}{', '.join(ROLLUPS[name]):<24}{rows:>12,} linhas")
+    else:
+        if not args.consulta:
+            raise SystemExit("Informe a consulta a rotear")
+        query, rollup = route_query(args.consulta, engine)
+        print(f"Agregado: {rollup or 'nenhum (tabela consolidada)'}")
+        print(query)
+    engine.dispose()
@@ -0,0 +1,146 @@
+# Catálogo do esquema da tabela consolidada usado nos prompts de geração de SQL
+#
+# As colunas e tipos vêm do próprio banco (sqlalchemy.inspect) e, para colunas textuais de baixa
+# cardinalidade, os valores distintos existentes (no PostgreSQL, lidos de pg_stats quando a tabela
+# foi analisada). O catálogo é montado uma vez por processo e reconstruído quando o snapshot atual
+# muda ou após SCHEMA_CATALOG_TTL segundos.
+import csv
+import os
+import threading
+import time
+from dotenv import load_dotenv
+from sqlalchemy import inspect, text
+from snapshot import current_snapshot_id
+
+load_dotenv()
+
+CATALOG_TTL = float(os.getenv("SCHEMA_CATALOG_TTL", "3600"))
+MAX_DISTINCT_VALUES = int(os.getenv("SCHEMA_CATALOG_MAX_VALUES", "30"))
+
+# Significado das colunas conhecidas; colunas novas aparecem no catálogo apenas com nome e tipo
+COLUMN_DESCRIPTIONS = {
+    "data_base": "mês de referência, texto no formato 'dd/mm/aaaa' (último dia do mês)",
+    "uf": "sigla do estado",
+    "cliente": "tipo de cliente",
+    "porte": "porte do cliente (faixa de renda para PF, tamanho para PJ)",
+    "modalidade": "modalidade da operação de crédito",
+    "ocupacao": "ocupação do cliente PF ('-' para PJ)",
+    "cnae_secao": "setor econômico (seção CNAE) do cliente PJ ('-' para PF)",
+    "soma_numero_de_operacoes": "quantidade de operações",
+    "soma_a_vencer_ate_90_dias": "valor a vencer em até 90 dias (R$)",
+    "soma_carteira_ativa": "carteira ativa (R$)",
+    "soma_carteira_inadimplida_arrastada": "valor inadimplido (R$)",
+    "soma_ativo_problematico": "ativo problemático (R$)"
+}
+
+SQL_HINTS = [
+    "Taxa de inadimplência = SUM(soma_carteira_inadimplida_arrastada) / SUM(soma_carteira_ativa).",
+    "Os dados são mensais: filtre data_base por um único mês (ex.: data_base = '31/12/2024') ao somar valores.",
+    "Para ordenar por data no PostgreSQL, converta data_base com TO_DATE(data_base, 'DD/MM/YYYY')."
+]
+
+_cache = {}
+_cache_lock = threading.Lock()
+
+def _is_text(column_type):
+    try:
+        return column_type.python_type is str
+    except NotImplementedError:
+        return "CHAR" in str(column_type).upper() or "TEXT" in str(column_type).upper()
+
+def _pg_stats_values(conn, table, column):
+    # Valores mais comuns coletados pelo ANALYZE; evita varrer a tabela inteira em bases grandes
+    row = conn.execute(text(
+        "SELECT n_distinct, most_common_vals::text FROM pg_stats "
+        "WHERE tablename = :table AND attname = :column"
+    ), {"table": table, "column": column}).fetchone()
+    if row is None or row[1] is None:
+        return None
+    n_distinct, values = row
+    if n_distinct is not None and (n_distinct < 0 or n_distinct > MAX_DISTINCT_VALUES):
+        return None
+    # most_common_vals vem como literal de array: {"a, b",c}
+    items = next(csv.reader([values[1:-1]], quotechar='"', escapechar="\\"))
+    return sorted(items)
+
+def _distinct_values(conn, table, column):
+    rows = conn.execute(text(
+        f'SELECT DISTINCT "{column}" FROM "{table}" WHERE "{column}" IS NOT NULL LIMIT {MAX_DISTINCT_VALUES + 1}'
+    )).fetchall()
+    if len(rows) > MAX_DISTINCT_VALUES:
+        return None
+    return sorted(str(r[0]) for r in rows)
+
+def build_catalog(engine, table):
+    """
+    Introspecta colunas, tipos e valores distintos das colunas textuais de baixa cardinalidade
+
+    Returns:
+        Lista de dicionários {"name", "type", "values"} na ordem da tabela
+    """
+    columns = inspect(engine).get_columns(table)
+    catalog = []
+    with engine.connect() as conn:
+        for column in columns:
+            entry = {"name": column["name"], "type": str(column["type"]), "values": None}
+            if _is_text(column["type"]):
+                values = None
+                if conn.dialect.name == "postgresql":
+                    values = _pg_stats_values(conn, table, column["name"])
+                if values is None and column["name"] != "data_base":
+                    values = _distinct_values(conn, table, column["name"])
+                entry["values"] = values
+            catalog.append(entry)
+    return catalog
+
+def render_catalog(catalog, table):
+    """
+    Texto compacto do catálogo para o prompt, uma linha por coluna
+    """
+    lines = [f"A tabela principal é '{table}' e contém as seguintes colunas:"]
+    for column in catalog:
+        line = f"- {column['name']} ({column['type']})"
+        description = COLUMN_DESCRIPTIONS.get(column["name"])
+        if description:
+            line += f": {description}"
+        if column["values"]:
+            line += " | valores: " + ", ".join(column["values"])
+        lines.append(line)
+    lines.extend(SQL_HINTS)
+    # O texto entra em um ChatPromptTemplate: chaves literais precisam ser escapadas
+    return "\n".join(lines).replace("{", "{{").replace("}", "}}")
+
+def get_schema_prompt(engine, table):
+    """
+    Retorna o catálogo renderizado do cache, reconstruindo-o quando o snapshot muda ou o TTL expira
+
+    Sem engine (ou se a introspecção falhar), usa apenas as colunas conhecidas de COLUMN_DESCRIPTIONS.
+    """
+    if engine is None:
+        return default_schema_prompt(table)
+
+    key = (str(engine.url), table)
+    version = current_snapshot_id()
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached and cached["version"] == version and time.monotonic() - cached["built_at"] < CATALOG_TTL:
+            return cached["prompt"]
+
+    try:
+        prompt = render_catalog(build_catalog(engine, table), table)
+    except Exception as e:
+        print(f"Erro ao montar o catálogo do esquema: {e}")
+        return cached["prompt"] if cached else default_schema_prompt(table)
+
+    with _cache_lock:
+        _cache[key] = {"version": version, "built_at": time.monotonic(), "prompt": prompt}
+    print(f"Catálogo do esquema de {table} atualizado (snapshot {version})")
+    return prompt
+
+def default_schema_prompt(table):
+    catalog = [{"name": name, "type": "", "values": None} for name in COLUMN_DESCRIPTIONS]
+    return render_catalog(catalog, table).replace(" ()", "")
+
+def clear_cache():
+    with _cache_lock:
+        _cache.clear()
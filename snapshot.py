@@ -0,0 +1,155 @@
+# Snapshot da tabela consolidada em arquivo Arrow IPC compartilhado entre processos
+#
+# O snapshot é gravado uma única vez (python snapshot.py refresh) e cada worker do Streamlit
+# ou uvicorn o abre via memory-map, de modo que N processos compartilham a mesma cópia física
+# dos dados pelo page cache do sistema operacional. O arquivo CURRENT aponta para o snapshot
+# ativo e é trocado atomicamente (os.replace) a cada atualização.
+import argparse
+import os
+import threading
+import time
+import pyarrow as pa
+import pyarrow.ipc as ipc
+from dotenv import load_dotenv
+
+load_dotenv()
+
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", ".snapshots")
+POINTER_FILE = "CURRENT"
+
+# Colunas textuais de baixa cardinalidade gravadas como dicionário (viram category no pandas)
+DICTIONARY_COLUMNS = ["data_base", "uf", "cliente", "porte", "modalidade", "ocupacao", "cnae_secao"]
+
+def write_snapshot(df, directory=SNAPSHOT_DIR, keep=3):
+    """
+    Grava o DataFrame como snapshot Arrow IPC sem compressão e publica-o como atual
+
+    Params:
+        df: DataFrame com os dados consolidados
+        directory: diretório compartilhado pelos workers
+        keep: quantidade de snapshots antigos mantidos em disco
+
+    Returns:
+        Identificador do snapshot publicado
+    """
+    os.makedirs(directory, exist_ok=True)
+    snapshot_id = f"snapshot-{time.strftime('%Y%m%d%H%M%S')}-{os.getpid()}"
+    final_path = os.path.join(directory, f"{snapshot_id}.arrow")
+    tmp_path = final_path + ".tmp"
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for column in DICTIONARY_COLUMNS:
+        if column not in table.column_names:
+            continue
+        field_type = table.schema.field(column).type
+        if pa.types.is_string(field_type) or pa.types.is_large_string(field_type):
+            index = table.column_names.index(column)
+            table = table.set_column(index, column, table.column(column).dictionary_encode())
+
+    # Sem compressão: os buffers precisam estar no formato final para o memory-map ser zero-copy
+    with pa.OSFile(tmp_path, "wb") as sink:
+        with ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(tmp_path, final_path)
+
+    # Trocar o ponteiro atomicamente para que nenhum worker leia um arquivo parcial
+    pointer_tmp = os.path.join(directory, f"{POINTER_FILE}.{os.getpid()}.tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(snapshot_id)
+    os.replace(pointer_tmp, os.path.join(directory, POINTER_FILE))
+
+    _cleanup_old_snapshots(directory, snapshot_id, keep)
+    print(f"Snapshot {snapshot_id} publicado com {table.num_rows} linhas")
+    return snapshot_id
+
+def _cleanup_old_snapshots(directory, current_id, keep):
+    # Workers que ainda mapeiam um arquivo removido continuam lendo-o até trocarem de snapshot
+    snapshots = sorted(name for name in os.listdir(directory) if name.endswith(".arrow"))
+    others = [name for name in snapshots if name != f"{current_id}.arrow"]
+    old = others[:-keep] if keep else others
+    for name in old:
+        try:
+            os.remove(os.path.join(directory, name))
+        except OSError as e:
+            print(f"Não foi possível remover o snapshot {name}: {e}")
+
+def current_snapshot_id(directory=SNAPSHOT_DIR):
+    """
+    Lê o identificador do snapshot ativo ou retorna None se nenhum foi publicado
+    """
+    try:
+        with open(os.path.join(directory, POINTER_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def open_snapshot(snapshot_id, directory=SNAPSHOT_DIR):
+    """
+    Abre um snapshot via memory-map e o converte para DataFrame
+
+    Colunas numéricas sem nulos permanecem apontando para as páginas mapeadas (somente leitura);
+    colunas de dicionário viram category, copiando apenas os códigos e as categorias.
+    """
+    path = os.path.join(directory, f"{snapshot_id}.arrow")
+    source = pa.memory_map(path, "r")
+    table = ipc.open_file(source).read_all()
+    df = table.to_pandas(split_blocks=True, zero_copy_only=False)
+    # Identifica o snapshot para os caches derivados (séries temporais, índices)
+    df.attrs["snapshot_id"] = snapshot_id
+    return df
+
+class SnapshotReader:
+    """
+    Mantém o DataFrame do snapshot atual de um processo e troca para o novo quando o ponteiro muda
+    """
+    def __init__(self, directory=SNAPSHOT_DIR, check_interval=5.0):
+        self.directory = directory
+        self.check_interval = check_interval
+        self.snapshot_id = None
+        self.df = None
+        self.last_check = 0.0
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns:
+            Tupla (DataFrame, identificador do snapshot)
+
+        Raises:
+            FileNotFoundError se nenhum snapshot foi publicado no diretório
+        """
+        with self.lock:
+            now = time.monotonic()
+            if self.df is None or now - self.last_check >= self.check_interval:
+                self.last_check = now
+                snapshot_id = current_snapshot_id(self.directory)
+                if snapshot_id is None:
+                    raise FileNotFoundError(f"Nenhum snapshot publicado em {self.directory}")
+                if snapshot_id != self.snapshot_id:
+                    # A referência é trocada de uma vez; quem já tem o DataFrame antigo continua usando-o
+                    self.df = open_snapshot(snapshot_id, self.directory)
+                    self.snapshot_id = snapshot_id
+                    print(f"Snapshot {snapshot_id} carregado via memory-map ({len(self.df)} linhas)")
+            return self.df, self.snapshot_id
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gerencia o snapshot Arrow compartilhado da tabela consolidada")
+    parser.add_argument("comando", choices=["refresh", "info"], help="refresh: recarrega do banco e publica; info: mostra o snapshot atual")
+    parser.add_argument("--dir", default=SNAPSHOT_DIR, help="Diretório dos snapshots")
+    args = parser.parse_args()
+
+    if args.comando == "refresh":
+        from pipeline import connect_to_db, load_data
+
+        engine = connect_to_db()
+        if engine is None:
+            raise SystemExit("Não foi possível conectar ao banco de dados.")
+        write_snapshot(load_data(engine), args.dir)
+        engine.dispose()
+    else:
+        snapshot_id = current_snapshot_id(args.dir)
+        if snapshot_id is None:
+            print(f"Nenhum snapshot publicado em {args.dir}")
+        else:
+            path = os.path.join(args.dir, f"{snapshot_id}.arrow")
+            print(f"Snapshot atual: {snapshot_id} ({os.path.getsize(path) / 1e6:.1f} MB)")
@@ -0,0 +1,228 @@
+# Proteção para as consultas SQL geradas pelo LLM antes de executá-las no banco
+#
+# 1. Aceita apenas uma instrução SELECT/WITH, sem comandos de escrita ou funções perigosas
+# 2. Injeta LIMIT (ou reduz um LIMIT maior que o permitido)
+# 3. Estima custo e linhas com EXPLAIN (PostgreSQL) e rejeita consultas acima dos limites
+# 4. Executa em transação somente leitura com statement_timeout
+#
+# Limites configuráveis por variáveis de ambiente (SQL_GUARD_*). As contagens de consultas aceitas,
+# rejeitadas e reescritas ficam em `metrics` e também são anotadas no span atual.
+import json
+import os
+import re
+import threading
+import time
+from collections import Counter
+import pandas as pd
+from dotenv import load_dotenv
+from tracing import span
+
+load_dotenv()
+
+MAX_ROWS = int(os.getenv("SQL_GUARD_MAX_ROWS", "1000"))
+MAX_COST = float(os.getenv("SQL_GUARD_MAX_COST", "1000000"))
+MAX_ESTIMATED_ROWS = float(os.getenv("SQL_GUARD_MAX_ESTIMATED_ROWS", "5000000"))
+TIMEOUT_MS = int(os.getenv("SQL_GUARD_TIMEOUT_MS", "10000"))
+
+FORBIDDEN_KEYWORDS = [
+    "INSERT", "UPDATE", "DELETE", "MERGE", "UPSERT", "DROP", "ALTER", "CREATE", "TRUNCATE", "GRANT",
+    "REVOKE", "COPY", "CALL", "DO", "EXECUTE", "PREPARE", "VACUUM", "ANALYZE", "CLUSTER", "REINDEX",
+    "LOCK", "SET", "RESET", "LISTEN", "NOTIFY", "INTO", "ATTACH", "DETACH", "PRAGMA"
+]
+
+FORBIDDEN_FUNCTIONS = [
+    "pg_sleep", "pg_read_file", "pg_read_binary_file", "pg_ls_dir", "lo_import", "lo_export",
+    "dblink", "pg_terminate_backend", "pg_cancel_backend", "set_config", "load_extension"
+]
+
+metrics = Counter()
+_metrics_lock = threading.Lock()
+
+class SQLGuardError(ValueError):
+    """
+    Consulta rejeitada pela proteção (motivo na mensagem)
+    """
+
+def _count(key):
+    with _metrics_lock:
+        metrics[key] += 1
+
+def get_metrics():
+    with _metrics_lock:
+        return dict(metrics)
+
+def clean_sql(query):
+    """
+    Remove cercas de código markdown, comentários e ponto e vírgula final
+    """
+    query = re.sub(r"^```(?:sql)?\s*|\s*```$", "", query.strip(), flags=re.IGNORECASE)
+    query = re.sub(r"/\*.*?\*/", " ", query, flags=re.DOTALL)
+    query = re.sub(r"--[^\n]*", " ", query)
+    return query.strip().rstrip(";").strip()
+
+def mask_sql(query, mask_parentheses=False):
+    """
+    Substitui o conteúdo de literais (e opcionalmente de parênteses) por espaços, preservando posições
+
+    Permite procurar palavras-chave apenas no nível superior da consulta.
+    """
+    chars = list(query)
+    depth = 0
+    quote = None
+    for i, ch in enumerate(query):
+        if quote:
+            if ch == quote:
+                quote = None
+            else:
+                chars[i] = " "
+        elif ch in ("'", '"'):
+            quote = ch
+        elif mask_parentheses and ch == "(":
+            depth += 1
+        elif mask_parentheses and ch == ")":
+            depth = max(0, depth - 1)
+        elif depth > 0:
+            chars[i] = " "
+    return "".join(chars)
+
+def validate_sql(query):
+    """
+    Garante uma única instrução somente leitura
+
+    Raises:
+        SQLGuardError com o motivo da rejeição
+    """
+    masked = mask_sql(query)
+    if ";" in masked:
+        raise SQLGuardError("Mais de uma instrução SQL")
+    first = re.match(r"\s*(\w+)", masked)
+    if not first or first.group(1).upper() not in ("SELECT", "WITH"):
+        raise SQLGuardError("Apenas consultas SELECT são permitidas")
+    upper = masked.upper()
+    for keyword in FORBIDDEN_KEYWORDS:
+        if re.search(rf"\b{keyword}\b", upper):
+            raise SQLGuardError(f"Comando não permitido: {keyword}")
+    lower = masked.lower()
+    for function in FORBIDDEN_FUNCTIONS:
+        if re.search(rf"\b{function}\s*\(", lower):
+            raise SQLGuardError(f"Função não permitida: {function}")
+
+def enforce_limit(query, max_rows=MAX_ROWS):
+    """
+    Injeta LIMIT no nível superior ou reduz um LIMIT (ou FETCH FIRST) maior que max_rows
+
+    Uma consulta simples recebe o LIMIT no próprio nível superior (antes de OFFSET), então o ORDER BY
+    dela continua valendo para as linhas mantidas. Consultas compostas (UNION, INTERSECT, EXCEPT) são
+    envolvidas em um SELECT externo que repete o ORDER BY, já que a ordem da subconsulta não é garantida.
+
+    Returns:
+        Tupla (consulta, reescrita: bool)
+    """
+    masked = mask_sql(query, mask_parentheses=True)
+    match = re.search(r"\b(?:LIMIT|FETCH\s+(?:FIRST|NEXT))\s+(\d+)\b", masked, flags=re.IGNORECASE)
+    if match is not None:
+        if int(match.group(1)) > max_rows:
+            return query[:match.start(1)] + str(max_rows) + query[match.end(1):], True
+        return query, False
+
+    offset = re.search(r"\bOFFSET\b", masked, flags=re.IGNORECASE)
+    if re.search(r"\b(?:UNION|INTERSECT|EXCEPT)\b", masked, flags=re.IGNORECASE):
+        order = re.search(r"\bORDER\s+BY\b", masked, flags=re.IGNORECASE)
+        outer_order = ""
+        if order is not None:
+            # ORDER BY de consulta composta só cita colunas do resultado (nome ou posição), válidas por fora
+            end = offset.start() if offset is not None and offset.start() > order.end() else len(query)
+            outer_order = f" ORDER BY {query[order.end():end].strip()}"
+        return f"SELECT * FROM ({query}) AS consulta_limitada{outer_order} LIMIT {max_rows}", True
+    if offset is not None:
+        return f"{query[:offset.start()]}LIMIT {max_rows} {query[offset.start():]}", True
+    return f"{query} LIMIT {max_rows}", True
+
+def explain_estimate(conn, query):
+    """
+    Retorna (custo total, linhas estimadas) do plano no PostgreSQL ou (None, None) em outros bancos
+    """
+    if conn.dialect.name != "postgresql":
+        return None, None
+    plan = conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {query}").scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    root = plan[0]["Plan"]
+    return root["Total Cost"], root["Plan Rows"]
+
+def _read_only_sqlite(conn, timeout_ms):
+    # O SQLite não tem statement_timeout: um progress handler interrompe a consulta após o prazo
+    dbapi_conn = conn.connection.driver_connection
+    deadline = time.monotonic() + timeout_ms / 1000
+    dbapi_conn.set_progress_handler(lambda: 1 if time.monotonic() > deadline else 0, 10_000)
+    conn.exec_driver_sql("PRAGMA query_only = ON")
+
+def _restore_sqlite(conn):
+    dbapi_conn = conn.connection.driver_connection
+    dbapi_conn.set_progress_handler(None, 0)
+    conn.exec_driver_sql("PRAGMA query_only = OFF")
+
+def run_guarded_query(query, engine, max_rows=MAX_ROWS, max_cost=MAX_COST,
+                      max_estimated_rows=MAX_ESTIMATED_ROWS, timeout_ms=TIMEOUT_MS):
+    """
+    Valida, limita, estima e executa a consulta em transação somente leitura
+
+    Returns:
+        DataFrame com o resultado
+
+    Raises:
+        SQLGuardError quando a consulta é rejeitada pela validação ou pelo custo estimado, ou quando
+        excede o timeout (não é um erro que a correção da consulta resolva)
+    """
+    with span("sql_guard") as s:
+        query = clean_sql(query)
+        try:
+            validate_sql(query)
+        except SQLGuardError as e:
+            _count("rejeitadas_validacao")
+            s.set_attribute("guard.rejeitada", str(e))
+            raise
+
+        query, rewritten = enforce_limit(query, max_rows)
+        if rewritten:
+            _count("reescritas_limit")
+        s.set_attribute("guard.limit_injetado", rewritten)
+        s.set_attribute("db.statement", query)
+
+        with engine.connect() as conn:
+            is_postgres = conn.dialect.name == "postgresql"
+            is_sqlite = conn.dialect.name == "sqlite"
+            with conn.begin():
+                if is_postgres:
+                    conn.exec_driver_sql("SET TRANSACTION READ ONLY")
+                    conn.exec_driver_sql(f"SET LOCAL statement_timeout = {int(timeout_ms)}")
+                elif is_sqlite:
+                    _read_only_sqlite(conn, timeout_ms)
+
+                try:
+                    cost, estimated_rows = explain_estimate(conn, query)
+                    s.set_attribute("guard.custo_estimado", cost)
+                    s.set_attribute("guard.linhas_estimadas", estimated_rows)
+                    if cost is not None and cost > max_cost:
+                        _count("rejeitadas_custo")
+                        raise SQLGuardError(f"Custo estimado {cost:,.0f} acima do limite {max_cost:,.0f}")
+                    if estimated_rows is not None and estimated_rows > max_estimated_rows:
+                        _count("rejeitadas_custo")
+                        raise SQLGuardError(f"Linhas estimadas {estimated_rows:,.0f} acima do limite {max_estimated_rows:,.0f}")
+
+                    try:
+                        df = pd.read_sql(query, conn)
+                    except Exception as e:
+                        if "statement timeout" in str(e) or "interrupted" in str(e):
+                            _count("timeouts")
+                            s.set_attribute("guard.rejeitada", "timeout")
+                            raise SQLGuardError(f"Consulta interrompida após o timeout de {int(timeout_ms)} ms") from e
+                        _count("erros_execucao")
+                        raise
+                finally:
+                    if is_sqlite:
+                        _restore_sqlite(conn)
+
+        _count("aceitas")
+        s.set_attribute("db.rows", len(df))
+        return df
@@ -0,0 +1,223 @@
+# Correção automática das consultas SQL geradas que falham no banco
+#
+# Quando a consulta falha, o erro do banco é devolvido ao LLM para uma nova versão, no máximo
+# SQL_REPAIR_ATTEMPTS vezes. Correções bem-sucedidas são memorizadas pela impressão digital da
+# consulta original (com literais substituídos por marcadores), então o mesmo erro recorrente,
+# mesmo com outro estado ou outro mês, é corrigido localmente sem nova chamada ao LLM. Rejeições de
+# sql_guard (escrita, custo, timeout) não são erros do banco e não passam pela correção.
+#
+# As correções ficam em memória e em SQL_REPAIR_FILE (JSON lines, recarregado na inicialização).
+# Estatísticas de sucesso na primeira tentativa: get_repair_stats() ou python sql_repair.py
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import Counter
+from dotenv import load_dotenv
+from sql_guard import SQLGuardError
+from tracing import span
+
+load_dotenv()
+
+MAX_ATTEMPTS = int(os.getenv("SQL_REPAIR_ATTEMPTS", "2"))
+REPAIR_FILE = os.getenv("SQL_REPAIR_FILE", os.path.join("usage", "sql_repairs.jsonl"))
+
+# Literais de texto e números isolados (números dentro de identificadores não casam por causa do \b)
+LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+
+stats = Counter()
+_lock = threading.Lock()
+_repairs = None
+
+def parameterize(query):
+    """
+    Separa os literais da consulta
+
+    Returns:
+        Tupla (modelo normalizado com marcadores ?, lista de literais na ordem em que aparecem)
+    """
+    literals = LITERAL_PATTERN.findall(query)
+    template = LITERAL_PATTERN.sub("?", query)
+    template = re.sub(r"\s+", " ", template).strip().rstrip(";").strip().lower()
+    return template, literals
+
+def fingerprint(query):
+    template, _ = parameterize(query)
+    return hashlib.sha1(template.encode("utf-8")).hexdigest()[:16]
+
+def _to_template(repaired, literals):
+    # Os literais da consulta original que reaparecem na corrigida viram marcadores {{n}}
+    def mark(match):
+        literal = match.group(0)
+        return f"{{{{{literals.index(literal)}}}}}" if literal in literals else literal
+    return LITERAL_PATTERN.sub(mark, repaired)
+
+def _from_template(template, literals):
+    def fill(match):
+        index = int(match.group(1))
+        return literals[index] if index < len(literals) else match.group(0)
+    return re.sub(r"\{\{(\d+)\}\}", fill, template)
+
+def _load_repairs():
+    global _repairs
+    if _repairs is not None:
+        return _repairs
+    _repairs = {}
+    if os.path.exists(REPAIR_FILE):
+        with open(REPAIR_FILE, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                if entry.get("template") is None:
+                    _repairs.pop(entry["fingerprint"], None)
+                else:
+                    _repairs[entry["fingerprint"]] = entry["template"]
+    return _repairs
+
+def _store_repair(key, template):
+    # template None registra a remoção de uma correção que deixou de funcionar
+    with _lock:
+        repairs = _load_repairs()
+        if template is None:
+            repairs.pop(key, None)
+        else:
+            repairs[key] = template
+        directory = os.path.dirname(REPAIR_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(REPAIR_FILE, "a", encoding="utf-8") as f:
+            f.write(json.dumps({"fingerprint": key, "template": template}, ensure_ascii=False) + "\n")
+
+def lookup_repair(query):
+    """
+    Retorna a correção memorizada para a consulta (com os literais atuais) ou None
+    """
+    _, literals = parameterize(query)
+    with _lock:
+        template = _load_repairs().get(fingerprint(query))
+    return _from_template(template, literals) if template is not None else None
+
+def _count(key):
+    with _lock:
+        stats[key] += 1
+
+def execute_with_repair(query, execute, repair=None, max_attempts=MAX_ATTEMPTS):
+    """
+    Executa a consulta e, se falhar, tenta a correção memorizada e depois até max_attempts correções do LLM
+
+    Params:
+        query: consulta gerada
+        execute: função que recebe a consulta e retorna o resultado (levanta exceção em caso de erro)
+        repair: função (consulta, mensagem de erro) -> nova consulta; sem ela não há correção
+        max_attempts: máximo de chamadas a `repair`
+
+    Returns:
+        Tupla (resultado, consulta executada com sucesso)
+
+    Raises:
+        SQLGuardError imediatamente, sem correção, quando a proteção rejeita uma consulta
+        O último erro de execução quando nenhuma tentativa funciona
+    """
+    with span("sql_repair") as s:
+        _count("consultas")
+        try:
+            result = execute(query)
+            _count("sucesso_primeira")
+            s.set_attribute("sql.tentativas", 1)
+            return result, query
+        except SQLGuardError:
+            _count("rejeitadas")
+            raise
+        except Exception as e:
+            error = e
+
+        if repair is None:
+            _count("falhas")
+            raise error
+
+        key = fingerprint(query)
+        _, literals = parameterize(query)
+        attempts = 1
+
+        # O LLM sempre recebe a consulta junto com o erro que ela própria produziu
+        current = query
+        cached = lookup_repair(query)
+        if cached is not None:
+            attempts += 1
+            try:
+                result = execute(cached)
+                _count("sucesso_cache")
+                s.set_attribute("sql.tentativas", attempts)
+                s.set_attribute("sql.reparo", "cache")
+                return result, cached
+            except SQLGuardError:
+                _count("rejeitadas")
+                raise
+            except Exception as e:
+                print(f"Correção memorizada falhou, removendo: {e}")
+                _store_repair(key, None)
+                current, error = cached, e
+
+        for _ in range(max_attempts):
+            attempts += 1
+            _count("chamadas_llm")
+            current = repair(current, str(error)[:500])
+            try:
+                result = execute(current)
+            except SQLGuardError:
+                _count("rejeitadas")
+                raise
+            except Exception as e:
+                error = e
+                continue
+            _count("sucesso_llm")
+            _store_repair(key, _to_template(current, literals))
+            s.set_attribute("sql.tentativas", attempts)
+            s.set_attribute("sql.reparo", "llm")
+            return result, current
+
+        _count("falhas")
+        s.set_attribute("sql.tentativas", attempts)
+        raise error
+
+def get_repair_stats():
+    """
+    Contadores de execução e taxa de sucesso na primeira tentativa do processo atual
+    """
+    with _lock:
+        summary = dict(stats)
+    total = summary.get("consultas", 0)
+    summary["taxa_primeira"] = summary.get("sucesso_primeira", 0) / total if total else 0.0
+    summary["taxa_final"] = (total - summary.get("falhas", 0)) / total if total else 0.0
+    return summary
+
+if __name__ == "__main__":
+    # Taxa de sucesso na primeira tentativa a partir dos spans gravados por tracing.py
+    from tracing import load_spans
+
+    attempts = Counter()
+    repairs = Counter()
+    first_try = 0
+    failures = 0
+    for item in load_spans():
+        if item["name"] != "sql_repair":
+            continue
+        count = int(item["attributes"].get("sql.tentativas", 1))
+        attempts[count] += 1
+        if item["error"]:
+            failures += 1
+        else:
+            repairs[item["attributes"].get("sql.reparo", "nenhum")] += 1
+            first_try += count == 1
+
+    total = sum(attempts.values())
+    if not total:
+        print("Nenhuma execução de sql_repair nos spans")
+    else:
+        print(f"Consultas: {total} | sucesso na primeira tentativa: {first_try / total:.1%} | falhas: {failures / total:.1%}")
+        print("Tentativas:", dict(sorted(attempts.items())))
+        print("Correções:", dict(repairs))
+        print(f"Correções memorizadas em {REPAIR_FILE}: {len(_load_repairs())}")
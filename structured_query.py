@@ -0,0 +1,321 @@
+# Consultas estruturadas: perguntas comuns respondidas sem SQL gerado pelo LLM
+#
+# Uma consulta estruturada é um dicionário com:
+#   dimension  dimensão agrupada (uf, regiao, tipo_cliente, porte, modalidade, ocupacao, cnae_secao) ou None para o total
+#   filters    {dimensão: [valores]} aplicados antes do agrupamento
+#   metric     volume, taxa, ativo_problematico, operacoes ou carteira
+#   order      "desc", "asc" ou None
+#   limit      quantidade de linhas ou None
+# A pergunta é convertida primeiro por um parser local (palavras-chave e valores das dimensões); só
+# quando ele não reconhece a pergunta o LLM emite a estrutura em JSON, validada antes do uso. A
+# execução filtra e agrupa os agregados do mês de referência, tirados do cubo do snapshot (cube.py);
+# rankings sem filtros além de PF/PJ saem direto do índice de rankings (ranking_index).
+#
+# Uso:
+#   python structured_query.py "Quais os 5 principais estados em taxa de inadimplência?"
+import argparse
+import json
+import re
+import threading
+import weakref
+import numpy as np
+import pandas as pd
+from langchain_core.prompts import ChatPromptTemplate
+from cube import get_cube
+from insights import DEFAULT_PERIOD, MONTH_NAMES
+from ranking_index import (
+    DEFAULT_MIN_CARTEIRA, MIN_CARTEIRA, get_ranking_index, parse_dimension, parse_metric, parse_order
+)
+from timeseries import match_values, normalize_text
+from tracing import span, stream_llm, traced
+
+DIMENSIONS = ["uf", "regiao", "tipo_cliente", "porte", "modalidade", "ocupacao", "cnae_secao"]
+SUM_COLUMNS = {
+    "inadimplida": "soma_carteira_inadimplida_arrastada",
+    "carteira_ativa": "soma_carteira_ativa",
+    "ativo_problematico": "soma_ativo_problematico",
+    "operacoes": "soma_numero_de_operacoes"
+}
+METRICS = {
+    "volume": "inadimplida",
+    "taxa": "taxa_inadimplencia",
+    "ativo_problematico": "ativo_problematico",
+    "operacoes": "operacoes",
+    "carteira": "carteira_ativa"
+}
+MAX_RESULT_ROWS = 30
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+
+class Aggregates:
+    """
+    Somas do mês de referência no grão de todas as dimensões, com os valores possíveis de cada uma
+    """
+    def __init__(self, period, frame):
+        self.period = period
+        self.frame = frame
+        self.values = {dimension: [str(v) for v in frame[dimension].cat.categories] for dimension in DIMENSIONS}
+
+@traced("build_aggregates")
+def build_aggregates(df, period=None):
+    """
+    Agrega o mês de referência (padrão: dezembro de 2024, ou o último mês disponível) por todas as dimensões
+    """
+    cube = get_cube(df)
+    months = [month for month in cube.labels["data_base"] if not pd.isna(month)]
+    if period is not None:
+        period = pd.Period(period, freq="M")
+    else:
+        period = DEFAULT_PERIOD if DEFAULT_PERIOD in months else max(months)
+    part = cube.slice(data_base=period)
+    if part.cells == 0:
+        raise ValueError(f"Nenhum dado para {period}")
+
+    # dropna=False: linhas sem região ou ocupação continuam nos totais
+    frame = part.rollup(*DIMENSIONS, dropna=False)[DIMENSIONS + list(SUM_COLUMNS.values())]
+    frame = frame.rename(columns={v: k for k, v in SUM_COLUMNS.items()})
+    for dimension in DIMENSIONS:
+        frame[dimension] = frame[dimension].astype(str).astype("category")
+    return Aggregates(period, frame)
+
+def get_aggregates(df):
+    """
+    Retorna os agregados do DataFrame do cache (uma montagem por snapshot ou por DataFrame de sessão)
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None and (cached[0] is None or cached[0]() is df):
+            return cached[1]
+
+    aggregates = build_aggregates(df)
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (reference, aggregates)
+    return aggregates
+
+def mentions_other_period(question, period):
+    """
+    Indica se a pergunta cita um ano ou mês diferente do mês de referência dos agregados
+    """
+    text = normalize_text(question)
+    years = {int(year) for year in re.findall(r"\b(20\d{2})\b", text)}
+    months = {i + 1 for i, name in enumerate(MONTH_NAMES) if re.search(rf"\b{normalize_text(name)}\b", text)}
+    return bool(years - {period.year} or months - {period.month})
+
+def parse_question(question, aggregates):
+    """
+    Converte a pergunta em consulta estruturada pelo parser local
+
+    Returns:
+        Consulta estruturada ou None se a pergunta não citar dimensão nem valor conhecido, ou se pedir
+        uma medida ou operação que a estrutura não expressa (médias, dias de atraso, clientes, variações)
+    """
+    text = normalize_text(question)
+    metric = parse_metric(text)
+    if metric is None:
+        return None
+    dimension = parse_dimension(text)
+    filters = {}
+    for name, value in match_values(question, aggregates.values):
+        filters.setdefault(name, []).append(value)
+
+    # Sem agrupamento pedido, dois valores da mesma dimensão são comparados entre si ("PF e PJ")
+    if dimension is None:
+        dimension = next((name for name, values in filters.items() if len(values) > 1), None)
+    if dimension is None and not filters:
+        return None
+
+    order = parse_order(text) if dimension is not None else None
+    return {
+        "dimension": dimension,
+        "filters": filters,
+        "metric": "carteira" if re.search(r"carteira (ativa|total)", text) and "inadimpl" not in text else metric,
+        "order": None if order is None else ("asc" if order[0] else "desc"),
+        "limit": None if order is None else order[1]
+    }
+
+def validate_query(query, aggregates):
+    """
+    Valida e normaliza uma consulta estruturada (por exemplo, a emitida pelo LLM)
+
+    Raises:
+        ValueError se algum campo estiver fora do vocabulário aceito
+    """
+    if not isinstance(query, dict):
+        raise ValueError("A consulta estruturada deve ser um objeto")
+    dimension = query.get("dimension")
+    if dimension is not None and dimension not in DIMENSIONS:
+        raise ValueError(f"Dimensão desconhecida: {dimension}")
+    metric = query.get("metric") or "volume"
+    if metric not in METRICS:
+        raise ValueError(f"Métrica desconhecida: {metric}")
+    order = query.get("order")
+    if order not in (None, "asc", "desc"):
+        raise ValueError(f"Ordem desconhecida: {order}")
+    limit = query.get("limit")
+    if limit is not None and (not isinstance(limit, int) or not 1 <= limit <= 100):
+        raise ValueError(f"Limite inválido: {limit}")
+
+    filters = {}
+    for name, values in (query.get("filters") or {}).items():
+        if name not in DIMENSIONS:
+            raise ValueError(f"Filtro em dimensão desconhecida: {name}")
+        known = {normalize_text(value): value for value in aggregates.values[name]}
+        values = values if isinstance(values, list) else [values]
+        matched = [known.get(normalize_text(value)) for value in values]
+        if None in matched:
+            raise ValueError(f"Valor desconhecido em {name}: {values}")
+        filters[name] = matched
+    if dimension is None and order is not None:
+        raise ValueError("Ordenação exige uma dimensão")
+    return {"dimension": dimension, "filters": filters, "metric": metric, "order": order, "limit": limit}
+
+def parse_with_llm(question, llm, aggregates):
+    """
+    Pede ao LLM apenas a estrutura da consulta, em JSON, quando o parser local não reconhece a pergunta
+
+    Returns:
+        Consulta estruturada validada ou None se a pergunta não couber no formato
+    """
+    vocabulary = "\n".join(f"- {dimension}: {', '.join(values)}" for dimension, values in aggregates.values.items())
+    system = f"""
+        Converta a pergunta sobre inadimplência em uma consulta estruturada JSON com os campos:
+        "dimension": dimensão agrupada ou null para o total
+        "filters": objeto {{dimensão: [valores]}} com os filtros
+        "metric": volume, taxa, ativo_problematico, operacoes ou carteira
+        "order": "desc", "asc" ou null
+        "limit": número de linhas ou null
+
+        Dimensões e valores aceitos:
+        {vocabulary}
+
+        Se a pergunta não puder ser respondida nesse formato (períodos diferentes, cálculos específicos), responda null.
+        Responda APENAS com o JSON.
+        """
+    prompt = ChatPromptTemplate.from_messages([
+        # Chaves do JSON e valores das dimensões não são variáveis do template
+        ("system", system.replace("{", "{{").replace("}", "}}")),
+        ("human", "{input}")
+    ])
+    result = stream_llm(prompt | llm, {"input": question}, "llm.structured_query")
+    match = re.search(r"\{.*\}", result.content, re.DOTALL)
+    if match is None:
+        return None
+    try:
+        return validate_query(json.loads(match.group(0)), aggregates)
+    except (json.JSONDecodeError, ValueError) as e:
+        print(f"Estrutura do LLM descartada: {e}")
+        return None
+
+def _ranking_segment(query):
+    """
+    Segmento do índice de rankings que atende a consulta, ou None se ela tiver outros filtros
+    """
+    if query["dimension"] is None or query["order"] is None or query["limit"] is None:
+        return None
+    if query["metric"] == "carteira":
+        return None
+    filters = query["filters"]
+    if not filters:
+        return "Todos"
+    if list(filters) == ["tipo_cliente"] and len(filters["tipo_cliente"]) == 1 and query["dimension"] != "tipo_cliente":
+        return filters["tipo_cliente"][0]
+    return None
+
+def run_structured_query(query, aggregates, ranking=None):
+    """
+    Executa a consulta estruturada sobre os agregados (ou sobre o índice de rankings, quando possível)
+
+    Returns:
+        DataFrame com inadimplida, carteira_ativa, ativo_problematico, operacoes e taxa_inadimplencia por valor da dimensão
+    """
+    segment = _ranking_segment(query) if ranking is not None else None
+    if segment is not None:
+        items = ranking.top(query["dimension"], query["metric"], query["limit"], query["order"] == "asc", segment)
+        rows = [ranking.row(query["dimension"], label, segment) for label, _ in items]
+        result = pd.DataFrame(rows, index=pd.Index([label for label, _ in items], name=query["dimension"]))
+        return result[list(SUM_COLUMNS) + ["taxa_inadimplencia"]]
+
+    frame = aggregates.frame
+    mask = np.ones(len(frame), dtype=bool)
+    for name, values in query["filters"].items():
+        mask &= frame[name].isin(values).to_numpy()
+    selected = frame[mask]
+    if query["dimension"] is None:
+        result = selected[list(SUM_COLUMNS)].sum().to_frame("Total").T
+    else:
+        result = selected.groupby(query["dimension"], observed=True)[list(SUM_COLUMNS)].sum()
+    result["taxa_inadimplencia"] = result["inadimplida"] / result["carteira_ativa"].replace(0, np.nan) * 100
+
+    if query["order"] is not None:
+        column = METRICS[query["metric"]]
+        if query["metric"] == "taxa":
+            result = result[result["carteira_ativa"] > MIN_CARTEIRA.get(query["dimension"], DEFAULT_MIN_CARTEIRA)]
+        result = result.sort_values(column, ascending=query["order"] == "asc", kind="stable")
+    return result.head(query["limit"] or MAX_RESULT_ROWS)
+
+def format_result(query, result, period):
+    """
+    Texto com a consulta e o resultado, para o contexto da resposta
+    """
+    filters = "; ".join(f"{name} em {', '.join(values)}" for name, values in query["filters"].items()) or "sem filtros"
+    text = (f"CONSULTA ESTRUTURADA ({period.strftime('%m/%Y')}) - agrupamento: {query['dimension'] or 'total'}, "
+            f"filtros: {filters}, métrica: {query['metric']}")
+    if query["order"] is not None:
+        text += f", ordem: {query['order']}, limite: {query['limit']}"
+    text += "\n"
+    formatted = result.copy()
+    for column in ["inadimplida", "carteira_ativa", "ativo_problematico"]:
+        formatted[column] = formatted[column].map(lambda v: f"R$ {v:,.2f}")
+    formatted["operacoes"] = formatted["operacoes"].map(lambda v: f"{v:,.0f}")
+    formatted["taxa_inadimplencia"] = formatted["taxa_inadimplencia"].map(lambda v: "-" if pd.isna(v) else f"{v:.2f}%")
+    return text + formatted.to_string()
+
+def answer_structured(question, df, llm=None):
+    """
+    Contexto da pergunta pelo caminho estruturado: parser local, depois o LLM emitindo a estrutura
+
+    Returns:
+        Tupla (texto, consulta estruturada) ou (None, None) se a pergunta não couber no formato
+    """
+    with span("structured_query") as s:
+        aggregates = get_aggregates(df)
+        # Os agregados cobrem só o mês de referência e as métricas de METRICS; outros períodos e
+        # medidas seguem pelo SQL dinâmico, sem passar pelo LLM estruturado
+        if mentions_other_period(question, aggregates.period) or parse_metric(normalize_text(question)) is None:
+            s.set_attribute("structured.origem", "nenhuma")
+            return None, None
+        query = parse_question(question, aggregates)
+        s.set_attribute("structured.origem", "local" if query is not None else "llm")
+        if query is not None:
+            query = validate_query(query, aggregates)
+        elif llm is not None:
+            query = parse_with_llm(question, llm, aggregates)
+        if query is None:
+            s.set_attribute("structured.origem", "nenhuma")
+            return None, None
+        s.set_attribute("structured.consulta", json.dumps(query, ensure_ascii=False))
+        result = run_structured_query(query, aggregates, get_ranking_index(df))
+        return format_result(query, result, aggregates.period), query
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mostra a consulta estruturada e o resultado de uma pergunta (parser local)")
+    parser.add_argument("pergunta", help="Pergunta em linguagem natural")
+    args = parser.parse_args()
+
+    from snapshot import current_snapshot_id, open_snapshot
+
+    snapshot_id = current_snapshot_id()
+    if snapshot_id is None:
+        raise SystemExit("Nenhum snapshot publicado (python snapshot.py refresh)")
+    text, query = answer_structured(args.pergunta, open_snapshot(snapshot_id))
+    if query is None:
+        print("Pergunta não reconhecida pelo parser local")
+    else:
+        print(json.dumps(query, ensure_ascii=False))
+        print(text)
@@ -0,0 +1,226 @@
+# Gerador de dados sintéticos no formato da table_agg_inad_consolidado
+#
+# Produz as mesmas colunas da tabela real (data_base, uf, cliente, porte, modalidade, ocupacao,
+# cnae_secao e as medidas soma_*) com cardinalidades e assimetrias próximas às do SCR.data,
+# permitindo medir desempenho sem acesso ao banco de produção.
+#
+# Uso:
+#   python synthetic_data.py 10000000 --parquet dados.parquet
+#   python synthetic_data.py 1000000 --sqlite local.db --snapshot-dir .snapshots
+import argparse
+import time
+import numpy as np
+import pandas as pd
+
+# Participação aproximada de cada UF na carteira de crédito
+UF_WEIGHTS = {
+    'SP': 0.290, 'RJ': 0.085, 'MG': 0.095, 'PR': 0.065, 'RS': 0.065, 'SC': 0.050, 'BA': 0.045,
+    'GO': 0.035, 'DF': 0.040, 'PE': 0.030, 'CE': 0.025, 'ES': 0.020, 'MT': 0.025, 'MS': 0.015,
+    'PA': 0.020, 'AM': 0.012, 'MA': 0.012, 'RN': 0.010, 'PB': 0.010, 'AL': 0.007, 'PI': 0.007,
+    'SE': 0.006, 'RO': 0.006, 'TO': 0.006, 'AC': 0.003, 'AP': 0.003, 'RR': 0.003
+}
+
+PF_PORTES = {
+    'PF - Sem rendimento': 0.06, 'PF - Até 1 salário mínimo': 0.18, 'PF - Mais de 1 a 2 salários mínimos': 0.22,
+    'PF - Mais de 2 a 3 salários mínimos': 0.15, 'PF - Mais de 3 a 5 salários mínimos': 0.14,
+    'PF - Mais de 5 a 10 salários mínimos': 0.12, 'PF - Mais de 10 a 20 salários mínimos': 0.07,
+    'PF - Acima de 20 salários mínimos': 0.04, 'PF - Indisponível': 0.02
+}
+
+PJ_PORTES = {
+    'PJ - Micro': 0.40, 'PJ - Pequeno': 0.30, 'PJ - Médio': 0.17, 'PJ - Grande': 0.10, 'PJ - Indisponível': 0.03
+}
+
+# Modalidade: (peso, taxa média de inadimplência)
+PF_MODALIDADES = {
+    'PF - Cartão de crédito': (0.24, 0.085), 'PF - Empréstimo com consignação em folha': (0.18, 0.020),
+    'PF - Empréstimo sem consignação em folha': (0.16, 0.065), 'PF - Habitacional': (0.14, 0.012),
+    'PF - Veículos': (0.12, 0.035), 'PF - Rural e agroindustrial': (0.08, 0.015),
+    'PF - Outros créditos': (0.08, 0.045)
+}
+
+PJ_MODALIDADES = {
+    'PJ - Capital de giro': (0.30, 0.035), 'PJ - Investimento': (0.14, 0.020),
+    'PJ - Operações com recebíveis': (0.14, 0.015), 'PJ - Comércio exterior': (0.08, 0.008),
+    'PJ - Rural e agroindustrial': (0.08, 0.012), 'PJ - Cheque especial e conta garantida': (0.08, 0.070),
+    'PJ - Financiamento de infraestrutura/desenvolvimento/projeto e outros créditos': (0.10, 0.010),
+    'PJ - Outros créditos': (0.08, 0.030)
+}
+
+PF_OCUPACOES = {
+    'PF - Empregado de empresa privada': 0.30, 'PF - Aposentado/pensionista': 0.20,
+    'PF - Servidor ou empregado público': 0.16, 'PF - Autônomo': 0.12, 'PF - Empresário': 0.07,
+    'PF - MEI': 0.05, 'PF - Empregado de entidades sem fins lucrativos': 0.02, 'PF - Outros': 0.08
+}
+
+PJ_CNAE_SECOES = {
+    'PJ - Comércio; reparação de veículos automotores e motocicletas': 0.24,
+    'PJ - Indústrias de transformação': 0.20, 'PJ - Serviços': 0.14, 'PJ - Construção': 0.07,
+    'PJ - Transporte, armazenagem e correio': 0.07,
+    'PJ - Agricultura, pecuária, produção florestal, pesca e aqüicultura': 0.08,
+    'PJ - Atividades financeiras, de seguros e serviços relacionados': 0.05,
+    'PJ - Serviços industriais de utilidade pública': 0.04,
+    'PJ - Administração pública, defesa e seguridade social': 0.03,
+    'PJ - Indústrias extrativas': 0.03, 'PJ - Outros': 0.05
+}
+
+NAO_SE_APLICA = '-'
+
+def _month_labels(start, end):
+    # A tabela real guarda data_base como texto dd/mm/aaaa no último dia do mês
+    months = pd.date_range(start=start, end=end, freq='ME')
+    return [m.strftime('%d/%m/%Y') for m in months]
+
+def _pick(rng, weights, size):
+    labels = list(weights)
+    p = np.array([w[0] if isinstance(w, tuple) else w for w in weights.values()], dtype=float)
+    return rng.choice(len(labels), size=size, p=p / p.sum())
+
+def generate_chunk(n_rows, rng, months):
+    """
+    Gera um bloco de linhas sintéticas
+
+    Params:
+        n_rows: quantidade de linhas
+        rng: np.random.Generator
+        months: lista de datas-base (texto dd/mm/aaaa)
+
+    Returns:
+        DataFrame com colunas categóricas e medidas soma_*
+    """
+    is_pf = rng.random(n_rows) < 0.62
+    n_pf = int(is_pf.sum())
+    n_pj = n_rows - n_pf
+
+    # Volume cresce levemente ao longo do tempo: meses recentes têm mais linhas
+    month_p = np.linspace(0.8, 1.2, len(months))
+    month_codes = rng.choice(len(months), size=n_rows, p=month_p / month_p.sum())
+    uf_codes = _pick(rng, UF_WEIGHTS, n_rows)
+
+    # Categorias globais: valores PF seguidos dos valores PJ
+    porte_labels = list(PF_PORTES) + list(PJ_PORTES)
+    modalidade_labels = list(PF_MODALIDADES) + list(PJ_MODALIDADES)
+    ocupacao_labels = list(PF_OCUPACOES) + [NAO_SE_APLICA]
+    cnae_labels = [NAO_SE_APLICA] + list(PJ_CNAE_SECOES)
+
+    porte_codes = np.empty(n_rows, dtype=np.int16)
+    modalidade_codes = np.empty(n_rows, dtype=np.int16)
+    ocupacao_codes = np.empty(n_rows, dtype=np.int16)
+    cnae_codes = np.empty(n_rows, dtype=np.int16)
+
+    porte_codes[is_pf] = _pick(rng, PF_PORTES, n_pf)
+    porte_codes[~is_pf] = len(PF_PORTES) + _pick(rng, PJ_PORTES, n_pj)
+    modalidade_codes[is_pf] = _pick(rng, PF_MODALIDADES, n_pf)
+    modalidade_codes[~is_pf] = len(PF_MODALIDADES) + _pick(rng, PJ_MODALIDADES, n_pj)
+    ocupacao_codes[is_pf] = _pick(rng, PF_OCUPACOES, n_pf)
+    ocupacao_codes[~is_pf] = len(PF_OCUPACOES)
+    cnae_codes[is_pf] = 0
+    cnae_codes[~is_pf] = 1 + _pick(rng, PJ_CNAE_SECOES, n_pj)
+
+    # Carteira ativa com cauda longa; PJ concentra tickets maiores
+    carteira = rng.lognormal(mean=11.0, sigma=1.8, size=n_rows)
+    carteira[~is_pf] *= 4.0
+
+    # Taxa de inadimplência depende da modalidade, com ruído beta e um ciclo ao longo dos meses
+    base_rates = np.array([v[1] for v in PF_MODALIDADES.values()] + [v[1] for v in PJ_MODALIDADES.values()])
+    cycle = 1.0 + 0.15 * np.sin(month_codes / 6.0)
+    rate = np.clip(base_rates[modalidade_codes] * cycle * rng.beta(2.0, 2.0, size=n_rows) * 2.0, 0, 1)
+    # Parte das linhas não tem inadimplência alguma
+    rate[rng.random(n_rows) < 0.35] = 0.0
+
+    inadimplida = carteira * rate
+    ativo_problematico = inadimplida * (1.0 + rng.gamma(1.5, 0.4, size=n_rows))
+    a_vencer_90 = carteira * rng.uniform(0.08, 0.35, size=n_rows)
+    ticket = np.where(is_pf, rng.lognormal(8.5, 1.0, size=n_rows), rng.lognormal(11.0, 1.2, size=n_rows))
+    operacoes = np.maximum(1, np.round(carteira / ticket)).astype(np.int64)
+
+    client_labels = ['Pessoa Física', 'Pessoa Jurídica']
+
+    return pd.DataFrame({
+        'data_base': pd.Categorical.from_codes(month_codes, categories=months),
+        'uf': pd.Categorical.from_codes(uf_codes, categories=list(UF_WEIGHTS)),
+        'cliente': pd.Categorical.from_codes((~is_pf).astype(np.int8), categories=client_labels),
+        'porte': pd.Categorical.from_codes(porte_codes, categories=porte_labels),
+        'modalidade': pd.Categorical.from_codes(modalidade_codes, categories=modalidade_labels),
+        'ocupacao': pd.Categorical.from_codes(ocupacao_codes, categories=ocupacao_labels),
+        'cnae_secao': pd.Categorical.from_codes(cnae_codes, categories=cnae_labels),
+        'soma_numero_de_operacoes': operacoes,
+        'soma_a_vencer_ate_90_dias': a_vencer_90.round(2),
+        'soma_carteira_ativa': carteira.round(2),
+        'soma_carteira_inadimplida_arrastada': inadimplida.round(2),
+        'soma_ativo_problematico': ativo_problematico.round(2)
+    })
+
+def iter_synthetic_chunks(n_rows, seed=42, start='2021-01-01', end='2024-12-31', chunk_rows=2_000_000):
+    """
+    Gera os dados sintéticos em blocos para não materializar 100M linhas de uma vez
+    """
+    rng = np.random.default_rng(seed)
+    months = _month_labels(start, end)
+    remaining = n_rows
+    while remaining > 0:
+        size = min(chunk_rows, remaining)
+        yield generate_chunk(size, rng, months)
+        remaining -= size
+
+def generate_synthetic_data(n_rows, seed=42, start='2021-01-01', end='2024-12-31'):
+    """
+    Gera um DataFrame sintético completo em memória (use iter_synthetic_chunks para escalas grandes)
+    """
+    chunks = list(iter_synthetic_chunks(n_rows, seed=seed, start=start, end=end))
+    df = pd.concat(chunks, ignore_index=True)
+    # pd.concat preserva as categorias porque todos os blocos usam as mesmas listas
+    return df
+
+def write_parquet(path, n_rows, seed=42, start='2021-01-01', end='2024-12-31'):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for chunk in iter_synthetic_chunks(n_rows, seed=seed, start=start, end=end):
+        table = pa.Table.from_pandas(chunk, preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path, table.schema)
+        writer.write_table(table)
+    if writer is not None:
+        writer.close()
+
+def write_sqlite(path, n_rows, seed=42, start='2021-01-01', end='2024-12-31', table='table_agg_inad_consolidado'):
+    """
+    Cria um banco SQLite local com a tabela sintética (substitui a tabela se já existir)
+    """
+    from sqlalchemy import create_engine
+
+    engine = create_engine(f"sqlite:///{path}")
+    if_exists = 'replace'
+    for chunk in iter_synthetic_chunks(n_rows, seed=seed, start=start, end=end):
+        chunk.astype({c: 'object' for c in chunk.select_dtypes('category').columns}).to_sql(
+            table, engine, if_exists=if_exists, index=False, chunksize=100_000
+        )
+        if_exists = 'append'
+    engine.dispose()
+    return f"sqlite:///{path}"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Gera dados sintéticos da tabela consolidada de inadimplência")
+    parser.add_argument("linhas", type=int, help="Quantidade de linhas (ex.: 1000000 a 100000000)")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--inicio", default="2021-01-01", help="Primeiro mês da série")
+    parser.add_argument("--fim", default="2024-12-31", help="Último mês da série")
+    parser.add_argument("--parquet", help="Grava os dados em um arquivo parquet")
+    parser.add_argument("--sqlite", help="Grava os dados em um banco SQLite local")
+    parser.add_argument("--snapshot-dir", help="Publica os dados como snapshot Arrow (ver snapshot.py)")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    if args.parquet:
+        write_parquet(args.parquet, args.linhas, seed=args.seed, start=args.inicio, end=args.fim)
+        print(f"Parquet gravado em {args.parquet}")
+    if args.sqlite:
+        write_sqlite(args.sqlite, args.linhas, seed=args.seed, start=args.inicio, end=args.fim)
+        print(f"SQLite gravado em {args.sqlite}")
+    if args.snapshot_dir:
+        from snapshot import write_snapshot
+
+        write_snapshot(generate_synthetic_data(args.linhas, seed=args.seed, start=args.inicio, end=args.fim), args.snapshot_dir)
+    print(f"{args.linhas:,} linhas geradas em {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,34 @@
+import json
+import pandas as pd
+from charts import CHART_TOP_K, OTHERS_LABEL, bar_figure, top_k_with_others
+from cube import Cube
+from synthetic_data import generate_synthetic_data
+
+def test_top_k_keeps_rates_of_every_bar():
+    frame = pd.DataFrame({
+        "uf": [f"U{i}" for i in range(15)],
+        "soma_carteira_inadimplida_arrastada": [float(100 - i) for i in range(15)],
+        "soma_carteira_ativa": [1000.0] * 15,
+        "soma_ativo_problematico": [0.0] * 15,
+        "soma_numero_de_operacoes": [1.0] * 15
+    })
+    result = top_k_with_others(frame, "uf", k=10)
+
+    assert len(result) == 11
+    assert result["uf"].iloc[-1] == OTHERS_LABEL
+    assert result["taxa_inadimplencia"].notna().all()
+    assert result["taxa_inadimplencia"].iloc[0] == 10.0
+    # "Outros": (90 + 89 + 88 + 87 + 86) / 5000
+    assert round(result["taxa_inadimplencia"].iloc[-1], 2) == 8.8
+
+def test_bar_text_shows_each_rate():
+    df = generate_synthetic_data(20_000, seed=1)
+    cube = Cube.from_frame(df)
+    bar = json.loads(bar_figure(cube, "uf").to_json())["data"][0]
+
+    month = cube.slice(data_base="2024-12").rollup("uf")
+    assert len(bar["x"]) == CHART_TOP_K + 1
+    for label, text in zip(bar["x"][:-1], bar["text"][:-1]):
+        row = month[month["uf"] == label].iloc[0]
+        assert text == f"{row['taxa_inadimplencia']:.2f}%"
+    assert all(text != "0.00%" for text in bar["text"])
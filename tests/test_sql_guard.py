@@ -0,0 +1,38 @@
+import pytest
+from sqlalchemy import create_engine, text
+from sql_guard import enforce_limit, run_guarded_query
+
+@pytest.fixture
+def engine():
+    engine = create_engine("sqlite:///:memory:")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE t (uf TEXT, valor REAL)"))
+        conn.execute(text("INSERT INTO t VALUES ('SP', 1), ('RJ', 5), ('MG', 3), ('BA', 4), ('PR', 2)"))
+    return engine
+
+def test_plain_select_gets_top_level_limit():
+    query = "SELECT uf, SUM(valor) AS total FROM t GROUP BY uf ORDER BY total DESC"
+    assert enforce_limit(query, 3) == (f"{query} LIMIT 3", True)
+
+def test_limit_goes_before_offset():
+    assert enforce_limit("SELECT uf FROM t ORDER BY valor OFFSET 1", 3) == ("SELECT uf FROM t ORDER BY valor LIMIT 3 OFFSET 1", True)
+
+def test_larger_limit_is_reduced_and_subquery_limit_ignored():
+    query = "SELECT uf FROM (SELECT uf FROM t LIMIT 2) AS s ORDER BY uf LIMIT 50"
+    assert enforce_limit(query, 10) == ("SELECT uf FROM (SELECT uf FROM t LIMIT 2) AS s ORDER BY uf LIMIT 10", True)
+    assert enforce_limit("SELECT uf FROM t LIMIT 5", 10) == ("SELECT uf FROM t LIMIT 5", False)
+
+def test_compound_query_is_wrapped_with_outer_order_by():
+    query = "SELECT uf, valor FROM t WHERE valor > 3 UNION ALL SELECT uf, valor FROM t WHERE valor < 2 ORDER BY valor DESC"
+    limited, rewritten = enforce_limit(query, 2)
+    assert rewritten
+    assert limited == f"SELECT * FROM ({query}) AS consulta_limitada ORDER BY valor DESC LIMIT 2"
+
+def test_top_n_keeps_order(engine):
+    result = run_guarded_query("SELECT uf, valor FROM t ORDER BY valor DESC", engine, max_rows=3)
+    assert result["uf"].tolist() == ["RJ", "BA", "MG"]
+
+    result = run_guarded_query(
+        "SELECT uf, valor FROM t WHERE valor >= 3 UNION SELECT uf, valor FROM t WHERE valor = 1 ORDER BY 2 ASC", engine, max_rows=2
+    )
+    assert result["uf"].tolist() == ["SP", "MG"]
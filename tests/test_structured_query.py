@@ -0,0 +1,43 @@
+import pytest
+from structured_query import answer_structured, build_aggregates, parse_question
+from synthetic_data import generate_synthetic_data
+
+@pytest.fixture(scope="module")
+def df():
+    return generate_synthetic_data(20_000, seed=1)
+
+@pytest.fixture(scope="module")
+def aggregates(df):
+    return build_aggregates(df)
+
+@pytest.mark.parametrize("question, expected", [
+    ("Quais os 5 principais estados em taxa de inadimplência?",
+     {"dimension": "uf", "filters": {}, "metric": "taxa", "order": "desc", "limit": 5}),
+    ("Compare a inadimplência entre PF e PJ",
+     {"dimension": "tipo_cliente", "filters": {"tipo_cliente": ["PF", "PJ"]}, "metric": "volume", "order": None, "limit": None}),
+    ("Qual o valor de inadimplência em São Paulo?",
+     {"dimension": None, "filters": {"uf": ["SP"]}, "metric": "volume", "order": None, "limit": None}),
+    ("Qual modalidade tem mais operações entre PJ?",
+     {"dimension": "modalidade", "filters": {"tipo_cliente": ["PJ"]}, "metric": "operacoes", "order": "desc", "limit": 5}),
+    ("Qual a carteira ativa por porte?",
+     {"dimension": "porte", "filters": {}, "metric": "carteira", "order": None, "limit": None})
+])
+def test_parse_question_accepts_supported_questions(aggregates, question, expected):
+    assert parse_question(question, aggregates) == expected
+
+@pytest.mark.parametrize("question", [
+    "Qual a média de dias de atraso por estado?",
+    "Quantos clientes existem em cada região?",
+    "Qual estado teve o maior crescimento da inadimplência?",
+    "Qual a variação da taxa de inadimplência por modalidade?",
+    "Qual o valor vencido acima de 90 dias por modalidade?",
+    "Qual o ticket médio por cliente em cada porte?"
+])
+def test_parse_question_rejects_unsupported_measures(aggregates, question):
+    assert parse_question(question, aggregates) is None
+
+def test_unsupported_question_skips_structured_llm(df):
+    def llm(*args, **kwargs):
+        raise AssertionError("o LLM estruturado não deve ser chamado")
+
+    assert answer_structured("Quantos clientes existem em cada região?", df, llm) == (None, None)
@@ -0,0 +1,265 @@
+# Séries mensais pré-calculadas para as perguntas de TENDÊNCIA
+#
+# Para cada dimensão (uf, região, tipo de cliente, porte, modalidade, ocupação, setor CNAE e o total)
+# guarda uma matriz meses x valores de cada medida, com a taxa de inadimplência, o índice de ativo
+# problemático, médias móveis e variações mensal (MoM) e anual (YoY) calculadas de forma vetorizada
+# sobre todo o histórico de data_base. As séries são montadas uma vez por snapshot e as perguntas
+# de tendência são respondidas a partir delas sem consulta ao banco.
+import re
+import threading
+import unicodedata
+import weakref
+import numpy as np
+import pandas as pd
+from insights import REGION_MAP, client_type
+from tracing import traced
+
+DIMENSIONS = ["total", "uf", "regiao", "tipo_cliente", "porte", "modalidade", "ocupacao", "cnae_secao"]
+SUM_COLUMNS = {
+    "carteira_ativa": "soma_carteira_ativa",
+    "inadimplida": "soma_carteira_inadimplida_arrastada",
+    "ativo_problematico": "soma_ativo_problematico",
+    "operacoes": "soma_numero_de_operacoes"
+}
+METRIC_LABELS = {
+    "taxa_inadimplencia": "Taxa de inadimplência (%)",
+    "inadimplida": "Carteira inadimplida (R$)",
+    "carteira_ativa": "Carteira ativa (R$)",
+    "ativo_problematico": "Ativo problemático (R$)",
+    "indice_ativo_problematico": "Ativo problemático / carteira (%)",
+    "operacoes": "Número de operações"
+}
+ROLLING_WINDOW = 3
+
+UF_NAMES = {
+    'acre': 'AC', 'alagoas': 'AL', 'amapa': 'AP', 'amazonas': 'AM', 'bahia': 'BA', 'ceara': 'CE',
+    'distrito federal': 'DF', 'espirito santo': 'ES', 'goias': 'GO', 'maranhao': 'MA', 'mato grosso do sul': 'MS',
+    'mato grosso': 'MT', 'minas gerais': 'MG', 'estado do para': 'PA', 'paraiba': 'PB', 'parana': 'PR', 'pernambuco': 'PE',
+    'piaui': 'PI', 'rio de janeiro': 'RJ', 'rio grande do norte': 'RN', 'rio grande do sul': 'RS', 'rondonia': 'RO',
+    'roraima': 'RR', 'santa catarina': 'SC', 'sao paulo': 'SP', 'sergipe': 'SE', 'tocantins': 'TO'
+}
+
+_cache = {}
+_cache_lock = threading.Lock()
+_MAX_CACHED = 4
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFKD", str(text)).encode("ascii", "ignore").decode("ascii")
+    return text.lower()
+
+def month_index(data_base):
+    # data_base chega como texto dd/mm/aaaa, categoria (snapshot) ou datetime
+    if pd.api.types.is_datetime64_any_dtype(data_base):
+        return data_base.dt.to_period("M")
+    if isinstance(data_base.dtype, pd.CategoricalDtype):
+        # Converte só as categorias e expande pelos códigos
+        categories = data_base.cat.categories
+        periods = pd.to_datetime(categories, format="%d/%m/%Y", errors="coerce").to_period("M")
+        return data_base.map(dict(zip(categories, periods))).astype("period[M]")
+    return pd.to_datetime(data_base, format="%d/%m/%Y", errors="coerce").dt.to_period("M")
+
+class TimeSeriesStore:
+    """
+    Séries mensais por dimensão: frames[dimensão][métrica] é um DataFrame meses x valores
+    """
+    def __init__(self, frames, months):
+        self.frames = frames
+        self.months = months
+
+    def values(self, dimension):
+        return list(self.frames[dimension]["inadimplida"].columns)
+
+    def series(self, dimension="total", value="Total", metric="taxa_inadimplencia", window=ROLLING_WINDOW):
+        """
+        Série de uma métrica para um valor da dimensão, com média móvel e variações
+
+        Returns:
+            DataFrame indexado por mês com valor, media_movel, var_mensal_pct e var_anual_pct
+        """
+        values = self.frames[dimension][metric][value]
+        return pd.DataFrame({
+            "valor": values,
+            "media_movel": values.rolling(window, min_periods=1).mean(),
+            "var_mensal_pct": values.pct_change(1, fill_method=None) * 100,
+            "var_anual_pct": values.pct_change(12, fill_method=None) * 100
+        })
+
+    def changes(self, dimension, metric="taxa_inadimplencia", start=None, end=None):
+        """
+        Variação de todos os valores da dimensão entre dois meses (padrão: últimos 12 meses), vetorizada
+        """
+        frame = self.frames[dimension][metric]
+        end = end if end is not None else frame.index[-1]
+        start = start if start is not None else frame.index[max(0, frame.index.get_loc(end) - 12)]
+        last, previous = frame.loc[end], frame.loc[start]
+        return pd.DataFrame({
+            "inicio": previous,
+            "fim": last,
+            "variacao": last - previous,
+            "variacao_pct": (last / previous.replace(0, np.nan) - 1) * 100
+        }).sort_values("variacao", ascending=False)
+
+@traced("build_timeseries")
+def build_timeseries(df):
+    """
+    Agrega o DataFrame consolidado em séries mensais por dimensão
+
+    Params:
+        df: DataFrame com os dados consolidados (data_base como texto dd/mm/aaaa, categoria ou datetime)
+
+    Returns:
+        TimeSeriesStore
+    """
+    month = month_index(df["data_base"])
+    months = pd.period_range(month.min(), month.max(), freq="M")
+    if len(months) == 0:
+        raise ValueError("Nenhuma data_base válida para montar as séries")
+    keys = {
+        "total": None,
+        "uf": df["uf"],
+        "regiao": df["uf"].map(REGION_MAP),
+        "tipo_cliente": client_type(df["cliente"]),
+        "porte": df["porte"],
+        "modalidade": df["modalidade"],
+        "ocupacao": df["ocupacao"],
+        "cnae_secao": df["cnae_secao"]
+    }
+    sums = df[list(SUM_COLUMNS.values())]
+
+    frames = {}
+    for dimension, key in keys.items():
+        if key is None:
+            grouped = sums.groupby(month.rename("mes")).sum()
+        else:
+            grouped = sums.groupby([month.rename("mes"), key.rename("valor")], observed=True).sum()
+        dimension_frames = {}
+        for metric, column in SUM_COLUMNS.items():
+            values = grouped[column].to_frame("Total") if key is None else grouped[column].unstack("valor")
+            # Meses sem dados para um valor ficam com zero para manter a grade mensal completa
+            dimension_frames[metric] = values.reindex(months).fillna(0.0)
+        ativa = dimension_frames["carteira_ativa"].replace(0, np.nan)
+        dimension_frames["taxa_inadimplencia"] = dimension_frames["inadimplida"] / ativa * 100
+        dimension_frames["indice_ativo_problematico"] = dimension_frames["ativo_problematico"] / ativa * 100
+        frames[dimension] = dimension_frames
+    return TimeSeriesStore(frames, months)
+
+def get_timeseries(df):
+    """
+    Retorna as séries do DataFrame do cache (uma montagem por snapshot ou por DataFrame de sessão)
+    """
+    key = df.attrs.get("snapshot_id") or id(df)
+    with _cache_lock:
+        cached = _cache.get(key)
+        # Sem snapshot, a chave é o id do objeto: a referência fraca evita reaproveitar um id reciclado
+        if cached is not None and (cached[0] is None or cached[0]() is df):
+            return cached[1]
+
+    store = build_timeseries(df)
+    reference = None if df.attrs.get("snapshot_id") else weakref.ref(df)
+    with _cache_lock:
+        if len(_cache) >= _MAX_CACHED:
+            _cache.pop(next(iter(_cache)))
+        _cache[key] = (reference, store)
+    return store
+
+def match_values(question, candidates):
+    """
+    Valores de dimensão citados na pergunta, como lista de (dimensão, valor)
+
+    Params:
+        question: pergunta do usuário
+        candidates: dicionário {dimensão: valores possíveis}; estados também são reconhecidos pelo
+            nome e o tipo de cliente por PF/PJ ou pessoa física/jurídica
+    """
+    text = normalize_text(question)
+    matches = []
+    if "uf" in candidates:
+        for name, uf in sorted(UF_NAMES.items(), key=lambda item: -len(item[0])):
+            if re.search(rf"\b{name}\b", text):
+                matches.append(("uf", uf))
+                text = text.replace(name, " ")
+        for uf in candidates["uf"]:
+            if re.search(rf"\b{uf}\b", question):
+                matches.append(("uf", uf))
+    if "tipo_cliente" in candidates:
+        if re.search(r"\b(pf|pessoas? fisicas?)\b", text):
+            matches.append(("tipo_cliente", "PF"))
+        if re.search(r"\b(pj|pessoas? juridicas?|empresas)\b", text):
+            matches.append(("tipo_cliente", "PJ"))
+    for dimension, values in candidates.items():
+        if dimension in ("uf", "tipo_cliente"):
+            continue
+        for value in values:
+            # Rótulos de porte e modalidade trazem o prefixo "PF - " ou "PJ - "
+            normalized = re.sub(r"^p[fj] - ", "", normalize_text(value))
+            if value != "-" and len(normalized) > 3 and re.search(rf"\b{re.escape(normalized)}\b", text):
+                matches.append((dimension, value))
+    return list(dict.fromkeys(matches))
+
+def _match_metric(question):
+    text = normalize_text(question)
+    if "ativo problematico" in text or "ativos problematicos" in text:
+        return "ativo_problematico"
+    if "carteira" in text and "inadimpl" not in text:
+        return "carteira_ativa"
+    if "operac" in text:
+        return "operacoes"
+    if re.search(r"\b(valor|valores|volume|montante|r\$)", text):
+        return "inadimplida"
+    return "taxa_inadimplencia"
+
+def _match_period(question, store):
+    years = sorted({int(y) for y in re.findall(r"\b(20\d{2})\b", question)})
+    months = store.months
+    if years:
+        selected = months[(months.year >= years[0]) & (months.year <= years[-1])]
+        if len(selected):
+            return selected
+    return months[-12:]
+
+def _format(value, metric):
+    if pd.isna(value):
+        return "-"
+    if metric in ("taxa_inadimplencia", "indice_ativo_problematico"):
+        return f"{value:.2f}%"
+    if metric == "operacoes":
+        return f"{value:,.0f}"
+    return f"R$ {value:,.2f}"
+
+def describe_trend(question, store):
+    """
+    Texto com a evolução mensal das séries citadas na pergunta, para o contexto da resposta
+
+    Sem valores de dimensão reconhecidos, descreve o total e as maiores altas por estado e modalidade.
+    """
+    metric = _match_metric(question)
+    period = _match_period(question, store)
+    candidates = {dimension: store.values(dimension) for dimension in DIMENSIONS if dimension != "total"}
+    targets = match_values(question, candidates) or [("total", "Total")]
+
+    text = f"SÉRIES MENSAIS - {METRIC_LABELS[metric]} ({period[0].strftime('%m/%Y')} a {period[-1].strftime('%m/%Y')})\n"
+    for dimension, value in targets[:4]:
+        series = store.series(dimension, value, metric).loc[period]
+        values = series["valor"].dropna()
+        if values.empty:
+            continue
+        text += f"\n{dimension} = {value}:\n"
+        text += "mês | valor | média móvel 3m | var. mensal | var. anual\n"
+        for month, row in series.iterrows():
+            text += (f"{month.strftime('%m/%Y')} | {_format(row['valor'], metric)} | {_format(row['media_movel'], metric)} | "
+                     f"{row['var_mensal_pct']:+.2f}% | {row['var_anual_pct']:+.2f}%\n").replace("+nan%", "-")
+        first, last = values.iloc[0], values.iloc[-1]
+        steps = len(values) - 1
+        growth = ((last / first) ** (1 / steps) - 1) * 100 if steps and first > 0 and last > 0 else float("nan")
+        text += (f"Resumo: de {_format(first, metric)} para {_format(last, metric)} "
+                 f"({(last / first - 1) * 100 if first else float('nan'):+.2f}%), crescimento médio mensal {growth:+.2f}%, "
+                 f"máximo em {values.idxmax().strftime('%m/%Y')} ({_format(values.max(), metric)}), "
+                 f"mínimo em {values.idxmin().strftime('%m/%Y')} ({_format(values.min(), metric)})\n")
+
+    if targets == [("total", "Total")]:
+        for dimension in ["uf", "modalidade"]:
+            changes = store.changes(dimension, metric, start=period[0], end=period[-1]).dropna().head(3)
+            text += f"\nMaiores altas por {dimension} no período:\n"
+            for value, row in changes.iterrows():
+                text += f"- {value}: {_format(row['inicio'], metric)} -> {_format(row['fim'], metric)}\n"
+    return text
@@ -0,0 +1,200 @@
+# Contabilização de tokens e custo por chamada ao LLM
+#
+# O TokenUsageHandler é registrado como callback do cliente em get_llm_client e grava, para cada
+# chamada, os tokens de prompt, de resposta e em cache. Usa os campos de uso retornados pelo
+# provedor quando existem e estimativas com tiktoken caso contrário. Os registros são agrupados
+# por pergunta (usage_scope) para receberem a intenção e a sessão antes de serem gravados.
+#
+# Relatório: python token_usage.py --por intent,etapa
+import argparse
+import contextvars
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from dotenv import load_dotenv
+from tracing import current_span
+
+load_dotenv()
+
+USAGE_FILE = os.getenv("TOKEN_USAGE_FILE", os.path.join("usage", "token_usage.jsonl"))
+
+# Preço em US$ por milhão de tokens (deepseek-chat); ajustável por variáveis de ambiente
+PRICES = {
+    "input_cache_hit": float(os.getenv("PRICE_INPUT_CACHE_HIT", "0.07")),
+    "input_cache_miss": float(os.getenv("PRICE_INPUT_CACHE_MISS", "0.27")),
+    "output": float(os.getenv("PRICE_OUTPUT", "1.10"))
+}
+
+_scope = contextvars.ContextVar("token_usage_scope", default=None)
+_write_lock = threading.Lock()
+_encoding = None
+
+def _count_tokens(text):
+    """
+    Estima tokens com tiktoken (cl100k_base); sem o arquivo do encoder disponível, usa ~4 caracteres por token
+    """
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except Exception as e:
+            print(f"tiktoken indisponível, usando estimativa por caracteres: {e}")
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+def estimate_cost(prompt_tokens, completion_tokens, cached_tokens=0):
+    uncached = max(0, prompt_tokens - cached_tokens)
+    return (
+        cached_tokens * PRICES["input_cache_hit"]
+        + uncached * PRICES["input_cache_miss"]
+        + completion_tokens * PRICES["output"]
+    ) / 1e6
+
+def _write(records):
+    if not records:
+        return
+    directory = os.path.dirname(USAGE_FILE)
+    with _write_lock:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(USAGE_FILE, "a", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+@contextmanager
+def usage_scope(session_id=None, question_id=None):
+    """
+    Agrupa as chamadas de uma pergunta; ao sair, completa intenção/sessão e grava os registros
+
+    O dicionário retornado pode receber a chave "intent" depois da classificação.
+    """
+    scope = {"session_id": session_id, "question_id": question_id, "intent": None, "records": []}
+    token = _scope.set(scope)
+    try:
+        yield scope
+    finally:
+        _scope.reset(token)
+        for record in scope["records"]:
+            record["intent"] = scope["intent"]
+        _write(scope["records"])
+
+class TokenUsageHandler(BaseCallbackHandler):
+    """
+    Callback do LangChain que registra o uso de tokens de cada chamada ao modelo de chat
+    """
+    def __init__(self):
+        self.pending = {}
+        self.lock = threading.Lock()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        # Estimativa por papel da mensagem: mostra quanto do prompt vem do sistema (insights), histórico ou pergunta
+        breakdown = {}
+        for message in messages[0] if messages else []:
+            role = "history" if message.type == "ai" else message.type
+            content = message.content if isinstance(message.content, str) else json.dumps(message.content)
+            breakdown[role] = breakdown.get(role, 0) + _count_tokens(content)
+        span = current_span()
+        with self.lock:
+            self.pending[run_id] = {
+                "start": time.time(),
+                "stage": span.name if span is not None else "desconhecida",
+                "breakdown": breakdown
+            }
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        with self.lock:
+            pending = self.pending.pop(run_id, None)
+        if pending is None:
+            return
+
+        message = None
+        if response.generations and response.generations[0]:
+            message = getattr(response.generations[0][0], "message", None)
+        usage = getattr(message, "usage_metadata", None) if message is not None else None
+        token_usage = (response.llm_output or {}).get("token_usage") or {}
+
+        estimated_prompt = sum(pending["breakdown"].values())
+        if usage:
+            source = "provedor"
+            prompt_tokens = usage.get("input_tokens", 0)
+            completion_tokens = usage.get("output_tokens", 0)
+            cached_tokens = (usage.get("input_token_details") or {}).get("cache_read", 0) or 0
+        elif token_usage:
+            source = "provedor"
+            prompt_tokens = token_usage.get("prompt_tokens", 0)
+            completion_tokens = token_usage.get("completion_tokens", 0)
+            cached_tokens = 0
+        else:
+            source = "tiktoken"
+            prompt_tokens = estimated_prompt
+            completion_tokens = _count_tokens(getattr(message, "content", "") or "")
+            cached_tokens = 0
+        # A DeepSeek informa o cache em um campo próprio
+        cached_tokens = cached_tokens or token_usage.get("prompt_cache_hit_tokens", 0) or 0
+
+        scope = _scope.get()
+        record = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "dia": time.strftime("%Y-%m-%d"),
+            "session_id": scope["session_id"] if scope else None,
+            "question_id": scope["question_id"] if scope else None,
+            "intent": scope["intent"] if scope else None,
+            "etapa": pending["stage"],
+            "fonte": source,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "cached_tokens": cached_tokens,
+            "prompt_por_papel": pending["breakdown"],
+            "custo_usd": estimate_cost(prompt_tokens, completion_tokens, cached_tokens),
+            "duracao_s": time.time() - pending["start"]
+        }
+        if scope is not None:
+            scope["records"].append(record)
+        else:
+            _write([record])
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        with self.lock:
+            self.pending.pop(run_id, None)
+
+def load_usage(path=USAGE_FILE):
+    import pandas as pd
+
+    if not os.path.exists(path):
+        return pd.DataFrame()
+    return pd.read_json(path, lines=True)
+
+def summarize_usage(df, by):
+    """
+    Agrega tokens e custo pelas colunas informadas (ex.: ["intent"], ["session_id"], ["dia"], ["etapa"])
+    """
+    summary = df.groupby(by, dropna=False).agg(
+        chamadas=("prompt_tokens", "size"),
+        perguntas=("question_id", "nunique"),
+        prompt_tokens=("prompt_tokens", "sum"),
+        completion_tokens=("completion_tokens", "sum"),
+        cached_tokens=("cached_tokens", "sum"),
+        custo_usd=("custo_usd", "sum")
+    )
+    summary["prompt_medio"] = summary["prompt_tokens"] / summary["chamadas"]
+    return summary.sort_values("custo_usd", ascending=False)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Relatório de uso de tokens e custo do LLM")
+    parser.add_argument("--arquivo", default=USAGE_FILE)
+    parser.add_argument("--por", default="intent,etapa", help="Colunas de agrupamento: intent, session_id, dia, etapa")
+    args = parser.parse_args()
+
+    usage = load_usage(args.arquivo)
+    if usage.empty:
+        print(f"Nenhum registro em {args.arquivo}")
+    else:
+        print(summarize_usage(usage, [c.strip() for c in args.por.split(",")]).round(4).to_string())
+        print(f"\nTotal: {usage['prompt_tokens'].sum():,} tokens de prompt, "
+              f"{usage['completion_tokens'].sum():,} de resposta, US$ {usage['custo_usd'].sum():.4f}")
@@ -0,0 +1,213 @@
+# Spans de tempo por etapa exportados em JSON lines no formato OTLP/JSON do OpenTelemetry
+#
+# Cada linha do arquivo é um ExportTraceServiceRequest com um único span, o mesmo formato do
+# file exporter do OpenTelemetry Collector (pode ser lido pelo receiver otlpjsonfile).
+# Todos os spans de uma pergunta compartilham o traceId e o atributo question.id.
+#
+# Variáveis de ambiente:
+#   TRACING=0           desativa a exportação
+#   TRACE_FILE=caminho  arquivo de saída (padrão traces/spans.jsonl)
+import contextvars
+import functools
+import json
+import os
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from dotenv import load_dotenv
+
+load_dotenv()
+
+TRACING_ENABLED = os.getenv("TRACING", "1") != "0"
+TRACE_FILE = os.getenv("TRACE_FILE", os.path.join("traces", "spans.jsonl"))
+SERVICE_NAME = "inadimplinha"
+
+# Códigos de status do OTLP
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+_write_lock = threading.Lock()
+
+class Span:
+    def __init__(self, name, trace_id, parent_id=None, question_id=None, attributes=None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.question_id = question_id
+        self.attributes = dict(attributes or {})
+        if question_id is not None:
+            self.attributes["question.id"] = question_id
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_OK
+        self.status_message = ""
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    @property
+    def duration(self):
+        """
+        Duração em segundos (até agora, se o span ainda estiver aberto)
+        """
+        end = self.end_ns if self.end_ns is not None else time.time_ns()
+        return (end - self.start_ns) / 1e9
+
+    def to_otlp(self):
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items() if v is not None],
+            "status": {"code": self.status, "message": self.status_message}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [
+                    _otlp_attribute("service.name", SERVICE_NAME),
+                    _otlp_attribute("process.pid", os.getpid())
+                ]},
+                "scopeSpans": [{"scope": {"name": "tracing"}, "spans": [span]}]
+            }]
+        }
+
+def _otlp_attribute(key, value):
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+def _export(span):
+    if not TRACING_ENABLED:
+        return
+    line = json.dumps(span.to_otlp(), ensure_ascii=False)
+    directory = os.path.dirname(TRACE_FILE)
+    with _write_lock:
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(TRACE_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+def new_question_id():
+    return secrets.token_hex(8)
+
+def current_span():
+    return _current_span.get()
+
+@contextmanager
+def span(name, question_id=None, **attributes):
+    """
+    Abre um span filho do span atual; sem span ativo, inicia um novo trace
+
+    Uso:
+        with span("sql.execute", **{"db.statement": sql}) as s:
+            ...
+            s.set_attribute("db.rows", len(df))
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        trace_id = parent.trace_id
+        parent_id = parent.span_id
+        question_id = question_id or parent.question_id
+    else:
+        trace_id = secrets.token_hex(16)
+        parent_id = None
+
+    current = Span(name, trace_id, parent_id, question_id, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.status = STATUS_ERROR
+        current.status_message = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+        _export(current)
+
+def traced(name):
+    """
+    Decorador que envolve a função em um span com o nome informado
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def stream_llm(chain, inputs, name, config=None):
+    """
+    Invoca a cadeia em modo streaming para medir o tempo até o primeiro token
+
+    Returns:
+        Mensagem completa (soma dos chunks), equivalente ao retorno de chain.invoke
+    """
+    with span(name) as s:
+        message = None
+        for chunk in chain.stream(inputs, config=config):
+            # O primeiro chunk da API costuma trazer só o papel; o TTFT conta a partir do primeiro texto
+            if "llm.ttft_ms" not in s.attributes and getattr(chunk, "content", ""):
+                s.set_attribute("llm.ttft_ms", (time.time_ns() - s.start_ns) / 1e6)
+            message = chunk if message is None else message + chunk
+        if message is None:
+            raise ValueError("O LLM não retornou nenhum conteúdo")
+        s.set_attribute("llm.total_ms", (time.time_ns() - s.start_ns) / 1e6)
+        return message
+
+def load_spans(path=TRACE_FILE):
+    """
+    Lê o arquivo de spans e retorna uma lista de dicionários simplificados (nome, duração, atributos)
+    """
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                request = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            for resource_span in request.get("resourceSpans", []):
+                for scope_span in resource_span.get("scopeSpans", []):
+                    for item in scope_span.get("spans", []):
+                        attributes = {a["key"]: next(iter(a["value"].values())) for a in item.get("attributes", [])}
+                        spans.append({
+                            "name": item["name"],
+                            "trace_id": item["traceId"],
+                            "duration_ms": (int(item["endTimeUnixNano"]) - int(item["startTimeUnixNano"])) / 1e6,
+                            "error": item.get("status", {}).get("code") == STATUS_ERROR,
+                            "attributes": attributes
+                        })
+    return spans
+
+if __name__ == "__main__":
+    import argparse
+    import statistics
+
+    parser = argparse.ArgumentParser(description="Resumo das durações por span (ex.: ui.rerun x ui.chat_fragment)")
+    parser.add_argument("--arquivo", default=TRACE_FILE)
+    args = parser.parse_args()
+
+    durations = {}
+    for item in load_spans(args.arquivo):
+        durations.setdefault(item["name"], []).append(item["duration_ms"])
+
+    print(f"{'span':<32}{'n':>7}{'p50 ms':>12}{'p95 ms':>12}{'máx ms':>12}")
+    for name, values in sorted(durations.items()):
+        values.sort()
+        p95 = values[min(len(values) - 1, int(round(0.95 * (len(values) - 1))))]
+        print(f"{name:<32}{len(values):>7}{statistics.median(values):>12.1f}{p95:>12.1f}{values[-1]:>12.1f}")